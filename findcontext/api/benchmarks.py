@@ -0,0 +1,126 @@
+'''
+Benchmarks for the API emitters and resource ingestion, run against
+the OpenSearch descriptions in findcontext/data. From the findcontext
+directory:
+
+    python api/benchmarks.py
+'''
+
+import glob
+import json
+import os
+import sys
+import timeit
+
+def recursive_element_to_dict(e, parent, nsmap):
+    # The original recursive converter, kept for comparison.
+    if isinstance(e.tag, basestring):
+        d = {}
+        key = e.tag
+        changed_prefixes = []
+        for prefix, ns in e.nsmap.iteritems():
+            nss = nsmap.get(prefix, [])
+            if len(nss) == 0 or not ns == nss[-1]:
+                nss.append(ns)
+                nsmap[prefix] = nss
+                changed_prefixes.append(prefix)
+                xmlns = 'xmlns'
+                if prefix: xmlns += '$%s' % prefix
+                d[xmlns] = ns
+            if prefix: prefix = '%s$' % prefix
+            key = key.replace('{%s}' % ns, prefix or '')
+        d.update(e.attrib)
+        if e.text and e.text.strip(): 
+            d['$t'] = e.text
+        for child in e:
+            recursive_element_to_dict(child, d, nsmap)
+        for prefix in changed_prefixes:
+            nsmap[prefix].pop()
+        if key in parent:
+            if isinstance(parent[key], list):
+                parent[key].append(d)
+            else:
+                parent[key] = [ parent[key], d ]
+        else:
+            parent[key] = d
+    return parent
+
+def load_corpus():
+    from lxml import etree
+    from findcontext.api.emitters import a
+    paths = sorted(glob.glob(os.path.join(
+                os.path.dirname(__file__), '..', 'data', '*.xml')))
+    paths.append(os.path.join(
+            os.path.dirname(__file__), '..', 'test-data', 'wikipedia.xml'))
+    osds = [ etree.parse(path).getroot() for path in paths ]
+    feed = a.feed(*[ a.entry(a.content(osd)) for osd in
+                     [ etree.parse(path).getroot() for path in paths ] ])
+    return osds, feed
+
+def bench_element_to_dict(number=200):
+    from findcontext.api.emitters import CustomJSONEmitter
+    osds, feed = load_corpus()
+    convert = CustomJSONEmitter.element_to_dict
+    for doc in osds + [ feed ]:
+        assert (json.dumps(convert(doc, {})) == 
+                json.dumps(recursive_element_to_dict(doc, {}, {})))
+    for name, doc_list in (('descriptions', osds), ('feed', [ feed ])):
+        old = timeit.Timer(lambda: [ recursive_element_to_dict(doc, {}, {})
+                                     for doc in doc_list ]).timeit(number)
+        new = timeit.Timer(lambda: [ convert(doc, {}) 
+                                     for doc in doc_list ]).timeit(number)
+        print 'element_to_dict (%s): recursive %.3fms, iterative %.3fms' % (
+            name, old * 1000 / number, new * 1000 / number)
+
+def bench_resource_to_dict(number=200):
+    from datetime import datetime
+    from findcontext.api.emitters import CustomJSONEmitter
+    from findcontext.main.models import Resource
+    osds, feed = load_corpus()
+    now = datetime.now()
+    resources = [ Resource(id=i, last_updated=now, open_search_description=osd)
+                  for i, osd in enumerate(osds) ]
+    old = timeit.Timer(lambda: [ recursive_element_to_dict(
+                r.open_search_description, {}, {}) for r in resources ]
+                       ).timeit(number)
+    new = timeit.Timer(lambda: [ CustomJSONEmitter.resource_to_dict(r)
+                                 for r in resources ]).timeit(number)
+    print 'resource JSON dicts: recursive %.3fms, memoized %.3fms' % (
+        old * 1000 / number, new * 1000 / number)
+
+def bench_ingest(number=200):
+    from lxml import etree
+    from findcontext.api.handlers import osd_schema
+    from findcontext.main.models import Resource
+    paths = sorted(glob.glob(os.path.join(
+                os.path.dirname(__file__), '..', 'data', '*.xml')))
+    corpus = [ open(path).read() for path in paths ]
+    field = Resource._meta.get_field('open_search_description')
+    def old():
+        for data in corpus:
+            tree = etree.fromstring(data)
+            osd_schema.assertValid(tree)
+            tree.find('{http://a9.com/-/spec/opensearch/1.1/}ShortName').text
+            r = Resource(open_search_description=tree)
+            r.short_name
+            text = field.get_db_prep_value(field.pre_save(r, True))
+            etree.fromstring(text) # reparsed when next loaded
+    def new():
+        for data in corpus:
+            tree = etree.fromstring(data)
+            osd_schema.assertValid(tree)
+            r = Resource.from_xml(data, tree)
+            r.short_name
+            field.get_db_prep_value(field.pre_save(r, True))
+    old_time = timeit.Timer(old).timeit(number)
+    new_time = timeit.Timer(new).timeit(number)
+    print 'ingest (%d descriptions): reparsing %.3fms, single parse %.3fms' % (
+        len(corpus), old_time * 1000 / number, new_time * 1000 / number)
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.abspath(
+            os.path.join(os.path.dirname(__file__), '..', '..')))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'findcontext.settings')
+    bench_element_to_dict()
+    bench_resource_to_dict()
+    bench_ingest()
@@ -0,0 +1,120 @@
+import hashlib
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from django.views.decorators.http import condition
+from findcontext.main.loaders import resource_version, package_version
+from findcontext.main.compression import choose_encoding, compress_response
+
+CACHE_SECONDS = getattr(settings, 'API_CACHE_SECONDS', 60 * 60)
+
+def validator(version):
+    """
+    Returns a digest of a version, which ends every ETag issued for it.
+    """
+    return hashlib.md5(repr(version)).hexdigest()
+
+def etag_validator(etag):
+    """
+    Returns the version digest at the end of an ETag, or None if the
+    ETag doesn't carry one.
+    """
+    parts = etag.rsplit('-', 1)
+    if len(parts) < 2 or not parts[1]:
+        return None
+    return parts[1]
+
+class ConditionalResource(object):
+    """
+    Wraps a piston Resource so that GET responses carry an ETag and a
+    Last-Modified date derived from the model timestamps, conditional
+    GETs are answered with 304, and rendered bodies are cached.
+
+    Cached bodies are keyed by the ETag, which changes whenever the
+    underlying rows are saved or deleted, so a save invalidates them. The
+    ETag also names the authenticated user, since users may be shown
+    more than anonymous clients. Responses are compressed according to
+    Accept-Encoding, and the compressed variants are cached alongside
+    the bodies.
+    """
+    def __init__(self, resource, version_func):
+        self.resource = resource
+        self.version_func = version_func
+        self.csrf_exempt = getattr(resource, 'csrf_exempt', False)
+        self.conditional_view = condition(
+            etag_func=self.etag, last_modified_func=self.last_modified)(
+            self.render)
+
+    def user(self, request):
+        """
+        Authenticates the request the way the piston resource will, and
+        returns the user's id, 'anonymous' if the anonymous handler will
+        serve it, or None if it will be challenged.
+        """
+        if not hasattr(request, '_findcontext_user'):
+            handler = self.resource.handler
+            anonymous = getattr(handler, 'anonymous', None)
+            if self.resource.authentication.is_authenticated(request):
+                request._findcontext_user = request.user.id
+            elif (anonymous is not None and
+                  request.method in anonymous.allowed_methods):
+                request._findcontext_user = 'anonymous'
+            else:
+                request._findcontext_user = None
+        return request._findcontext_user
+
+    def version(self, request, id=None):
+        if request.method not in ('GET', 'HEAD'):
+            return None
+        if not hasattr(request, '_findcontext_version'):
+            request._findcontext_version = self.version_func(id)
+        return request._findcontext_version
+
+    def etag(self, request, *args, **kwargs):
+        """
+        Returns a hash of the representation's version and variant,
+        followed by a digest of the version alone, so that writes with
+        If-Match can be checked against the row whichever representation
+        the ETag came from. Requests that will be challenged
+        get none, so they are neither cached nor answered with 304.
+        """
+        version = self.version(request, **kwargs)
+        if version is None:
+            return None
+        user = self.user(request)
+        if user is None:
+            return None
+        return '%s-%s' % (
+            hashlib.md5(repr((request.get_full_path(), user,
+                              choose_encoding(request),
+                              version))).hexdigest(), validator(version))
+
+    def last_modified(self, request, *args, **kwargs):
+        version = self.version(request, **kwargs)
+        if version is None or self.user(request) is None:
+            return None
+        return version[0]
+
+    def render(self, request, *args, **kwargs):
+        etag = self.etag(request, *args, **kwargs)
+        if etag is None:
+            return compress_response(
+                request, self.resource(request, *args, **kwargs))
+        key = 'findcontext.api.body.%s' % etag
+        cached = cache.get(key)
+        if cached is not None:
+            content, content_type = cached
+            response = HttpResponse(content, content_type=content_type)
+            patch_vary_headers(response, ('Authorization',))
+        else:
+            response = self.resource(request, *args, **kwargs)
+            if response.status_code == 200 and response._is_string:
+                cache.set(key, (response.content, response['Content-Type']),
+                          CACHE_SECONDS)
+        return compress_response(request, response, key, CACHE_SECONDS)
+
+    def __call__(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return self.render(request, *args, **kwargs) # handlers check writes
+        return self.conditional_view(request, *args, **kwargs)
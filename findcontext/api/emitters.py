@@ -1,34 +1,90 @@
+import copy
 import json
 from datetime import datetime
-from django.contrib.sites.models import Site
+from django.conf import settings
 from django.db.models.query import QuerySet
+from django.db.models.signals import post_save
 from django.utils import feedgenerator
 from lxml import etree
 from lxml.builder import ElementMaker
 from findcontext.main.models import Resource, Package
+from findcontext.main import uris
+from findcontext.main.lru import LRUCache
 from piston.emitters import XMLEmitter, JSONEmitter
+from paging import Page
+import fragments
 
 ATOM_NS = 'http://www.w3.org/2005/Atom'
 a = ElementMaker(namespace=ATOM_NS, nsmap={ None: ATOM_NS })
+OPENSEARCH_NS = 'http://a9.com/-/spec/opensearch/1.1/'
+
+# JSON-ready dicts of resource descriptions, keyed by resource id
+resource_dicts = LRUCache(getattr(settings, 'OSD_CACHE_SIZE', 1000))
+
+def is_pretty(request):
+    return request.GET.get('pretty') != '0'
+
+def fragment_kind(kind, pretty):
+    if pretty:
+        return kind
+    return kind + '-compact'
 
 
 class OSDEmitter(XMLEmitter):
 
+    @classmethod
+    def resource_to_string(cls, resource, pretty=True):
+        return etree.tostring(resource.open_search_description, 
+                              encoding='utf-8', pretty_print=pretty,
+                              xml_declaration=True)
+
     def render(self, request):
         if isinstance(self.data, Resource):
-            return etree.tostring(self.data.open_search_description, 
-                                  encoding='utf-8', pretty_print=True,
-                                  xml_declaration=True)
+            pretty = is_pretty(request)
+            return fragments.get(
+                fragment_kind('osd', pretty), self.data,
+                lambda r: self.resource_to_string(r, pretty))
         return super(OSDEmitter, self).render(request)
 
 
 class AtomEmitter(XMLEmitter):
 
+    @classmethod
+    def package_resources(cls, package):
+        resources = getattr(package, 'loaded_resources', None)
+        if resources is None:
+            resources = package.resources.all()
+        return resources
+
     @classmethod
     def package_to_atom(cls, package):
         return cls.resources_to_atom(
-            package.resources.all(), package.name, package.description,
-            package.last_updated, package.uri)
+            cls.package_resources(package), package.name, 
+            package.description, package.last_updated, package.uri)
+
+    @classmethod
+    def package_to_string(cls, package, pretty=True):
+        return cls.join_feed(
+            cls.package_resources(package), 
+            (package.name, package.description, package.last_updated,
+             package.uri), pretty)
+
+    @classmethod
+    def join_feed(cls, resources, feed_args=(), pretty=True):
+        """
+        Serializes a feed by joining its stored entry fragments onto its
+        head and tail. feed_args are passed on to resources_to_atom.
+        """
+        head = cls.serialize(cls.resources_to_atom([], *feed_args), pretty)
+        end = head.rindex('</feed>')
+        return ''.join([ head[:end] ] + cls.entry_strings(resources, pretty) +
+                       [ head[end:] ])
+
+    @classmethod
+    def entry_strings(cls, resources, pretty=True):
+        return fragments.get_many(
+            fragment_kind('atom', pretty), list(resources), 
+            lambda r: cls.resource_to_string(r, pretty))
     
     @classmethod
     def resources_to_atom(cls, resources, 
@@ -36,8 +92,9 @@ class AtomEmitter(XMLEmitter):
                           description='All available resources.',
                           updated=datetime.now(),
                           package_uri=None):
+        base_uri = uris.base_uri()
         if not package_uri:
-            package_uri = 'http://%s/api/resource/' % Site.objects.get_current().domain
+            package_uri = base_uri + '/api/resource/'
         feed = a.feed(
             a.title(name),
             a.id(package_uri),
@@ -45,78 +102,234 @@ class AtomEmitter(XMLEmitter):
             a.subtitle(description),
             a.link(rel='self', href=package_uri))
         for resource in resources:
-            feed.append(a.entry(
-                    a.title(resource.short_name),
-                    a.id(resource.uri),
-                    a.updated(feedgenerator.rfc3339_date(resource.last_updated)),
-                    a.summary(resource.description),
-                    a.author(a.name(resource.developer)),
-                    a.content(
-                        resource.open_search_description,
-                        type='application/opensearchdescription+xml')))
+            feed.append(cls.resource_to_entry(resource, base_uri))
         return feed
 
-    def serialize(self, doc):
-        return etree.tostring(doc, encoding='utf-8', pretty_print=True,
+    @classmethod
+    def page_to_atom(cls, page):
+        entries = cls.resources_to_atom(page.object_list)
+        feed = etree.Element(entries.tag, nsmap={ None: ATOM_NS,
+                                                  'opensearch': OPENSEARCH_NS })
+        position = entries.index(entries.find('{%s}link' % ATOM_NS)) + 1
+        head, rest = entries[:position], entries[position:]
+        feed.extend(head)
+        for name, value in (('totalResults', page.total),
+                            ('itemsPerPage', page.count),
+                            ('startIndex', page.start_index)):
+            if value is not None:
+                etree.SubElement(feed, '{%s}%s' % (OPENSEARCH_NS, name)).text = str(value)
+        for rel, uri in (('first', page.first_uri),
+                         ('next', page.next_uri),
+                         ('previous', page.previous_uri)):
+            if uri:
+                feed.append(
+                    a.link(rel=rel, href=uri, type='application/atom+xml'))
+        feed.extend(rest)
+        return feed
+
+    @classmethod
+    def resource_to_entry(cls, resource, base_uri):
+        return a.entry(
+            a.title(resource.short_name),
+            a.id(base_uri + resource.get_absolute_url()),
+            a.updated(feedgenerator.rfc3339_date(resource.last_updated)),
+            a.summary(resource.description),
+            a.author(a.name(resource.developer)),
+            a.content(
+                copy.deepcopy(resource.open_search_description),
+                type='application/opensearchdescription+xml'))
+
+    @classmethod
+    def resource_to_string(cls, resource, pretty=True):
+        return cls.entry_to_string(
+            cls.resource_to_entry(resource, uris.base_uri()), pretty)
+
+    @classmethod
+    def entry_to_string(cls, entry, pretty=True):
+        """
+        Serializes an entry exactly as it would appear in a feed, without
+        the namespace declaration a standalone entry gets.
+        """
+        s = etree.tostring(a.feed(entry), encoding='utf-8', pretty_print=pretty)
+        start = s.index('>') + 1
+        if pretty:
+            start += 1
+        return s[start:s.rindex('</feed>')]
+
+    @classmethod
+    def stream_resources(cls, resources, chunk_size=100, pretty=True):
+        """
+        Yields the all-resources feed a piece at a time. Resources are
+        fetched in chunks of chunk_size ordered by id, so memory use does
+        not grow with the size of the catalog.
+        """
+        head = cls.serialize(cls.resources_to_atom([]), pretty)
+        end = head.rindex('</feed>')
+        yield head[:end]
+        resources = resources.order_by('id')
+        chunk = list(resources[:chunk_size])
+        while chunk:
+            for entry in cls.entry_strings(chunk, pretty):
+                yield entry
+            chunk = list(resources.filter(id__gt=chunk[-1].id)[:chunk_size])
+        yield head[end:]
+
+    @classmethod
+    def serialize(cls, doc, pretty=True):
+        return etree.tostring(doc, encoding='utf-8', pretty_print=pretty,
                               xml_declaration=True)
 
     def render(self, request):
+        pretty = is_pretty(request)
         if isinstance(self.data, Package):
-            return self.serialize(self.package_to_atom(self.data))
+            return self.package_to_string(self.data, pretty)
         if isinstance(self.data, QuerySet):
-            return self.serialize(self.resources_to_atom(self.data))
+            if request.GET.get('stream'):
+                return self.stream_resources(self.data, pretty=pretty)
+            return self.join_feed(self.data, pretty=pretty)
+        if isinstance(self.data, Page):
+            if issubclass(self.data.model, Resource):
+                return self.serialize(self.page_to_atom(self.data), pretty)
+            self.data = self.data.as_dict()
         return super(AtomEmitter, self).render(request)    
 
 
 class CustomJSONEmitter(JSONEmitter):
 
     @classmethod
-    def element_to_dict(cls, e, parent, nsmap={}):
+    def element_to_dict(cls, e, parent, nsmap=None):
         # see http://code.google.com/apis/gdata/docs/json.html
-        if isinstance(e.tag, basestring):
+        # The tree is walked with an explicit stack. Each entry carries the
+        # namespace scope its element was found in: the prefix -> URI map
+        # in effect, and a table of the keys already resolved for tags in
+        # that scope, which children with the same namespaces share.
+        stack = [ (e, parent, nsmap or {}, {}) ]
+        pop, push = stack.pop, stack.extend
+        while stack:
+            e, container, in_scope, keys = pop()
+            tag = e.tag
+            if not isinstance(tag, basestring):
+                continue
             d = {}
             # deal with namespaces
-            key = e.tag
-            changed_prefixes = []
-            for prefix, ns in e.nsmap.iteritems():
-                nss = nsmap.get(prefix, [])
-                if len(nss) == 0 or not ns == nss[-1]:
-                    nss.append(ns)
-                    nsmap[prefix] = nss
-                    changed_prefixes.append(prefix)
-                    xmlns = 'xmlns'
-                    if prefix: xmlns += '$%s' % prefix
-                    d[xmlns] = ns
-                if prefix: prefix = '%s$' % prefix
-                key = key.replace('{%s}' % ns, prefix or '')
-            # recursively build our dict
+            element_nsmap = e.nsmap
+            if element_nsmap != in_scope:
+                for prefix, ns in element_nsmap.iteritems():
+                    if not in_scope.get(prefix) == ns:
+                        xmlns = 'xmlns'
+                        if prefix: xmlns += '$%s' % prefix
+                        d[xmlns] = ns
+                in_scope, keys = element_nsmap, {}
+            key = keys.get(tag)
+            if key is None:
+                key = tag
+                for prefix, ns in element_nsmap.iteritems():
+                    if prefix: prefix = '%s$' % prefix
+                    key = key.replace('{%s}' % ns, prefix or '')
+                keys[tag] = key
             d.update(e.attrib)
-            if e.text and e.text.strip(): 
-                d['$t'] = e.text
-            for child in e:
-                cls.element_to_dict(child, d, nsmap)
-            # pop changed prefixes
-            for prefix in changed_prefixes:
-                nsmap[prefix].pop()
-            # add dict to parent
-            if key in parent:
-                if isinstance(parent[key], list):
-                    parent[key].append(d)
+            text = e.text
+            if text and text.strip(): 
+                d['$t'] = text
+            # add dict to its container
+            if key in container:
+                if isinstance(container[key], list):
+                    container[key].append(d)
                 else:
-                    parent[key] = [ parent[key], d ]
+                    container[key] = [ container[key], d ]
             else:
-                parent[key] = d
+                container[key] = d
+            # children are popped, and so added to d, in document order
+            if len(e):
+                push([ (child, d, in_scope, keys) for child in reversed(e) ])
         return parent
 
+    @classmethod
+    def resource_to_dict(cls, resource):
+        """
+        Returns the JSON-ready dict for a resource's description. The dict
+        is memoized per resource and last_updated value, and is shared:
+        don't change it.
+        """
+        cached = resource_dicts.get(resource.id)
+        if cached is not None and cached[0] == resource.last_updated:
+            return cached[1]
+        d = cls.element_to_dict(resource.open_search_description, {})
+        if resource.id is not None:
+            resource_dicts.set(resource.id, (resource.last_updated, d))
+        return d
+
+    @classmethod
+    def dumps(cls, o, pretty=True):
+        if pretty:
+            return json.dumps(o)
+        return json.dumps(o, separators=(',', ':'))
+
+    @classmethod
+    def entry_to_string(cls, resource, pretty=True):
+        """
+        Returns the JSON for a resource's feed entry, as it appears in the
+        JSON form of a feed.
+        """
+        feed = a.feed(AtomEmitter.resource_to_entry(resource, uris.base_uri()))
+        return cls.dumps(
+            cls.element_to_dict(feed, {})['feed']['entry'], pretty)
+
+    @classmethod
+    def package_to_string(cls, package, pretty=True):
+        """
+        Serializes a package feed by joining its resources' stored entry
+        fragments onto the JSON of the feed's other members.
+        """
+        feed = cls.element_to_dict(
+            AtomEmitter.resources_to_atom(
+                [], package.name, package.description,
+                package.last_updated, package.uri), {})['feed']
+        entries = fragments.get_many(
+            fragment_kind('json', pretty),
+            list(AtomEmitter.package_resources(package)),
+            lambda r: cls.entry_to_string(r, pretty))
+        separator, space = pretty and (', ', ' ') or (',', '')
+        members = [ '%s:%s%s' % (json.dumps(name), space,
+                                 cls.dumps(value, pretty))
+                    for name, value in feed.items() ]
+        if len(entries) == 1:
+            members.append('"entry":%s%s' % (space, entries[0]))
+        elif len(entries) > 1:
+            members.append('"entry":%s[%s]' % (space, separator.join(entries)))
+        return '{"feed":%s{%s}}' % (space, separator.join(members))
+
     def render(self, request):
+        pretty = is_pretty(request)
         if isinstance(self.data, Resource):
-            return json.dumps(
-                self.element_to_dict(
-                    self.data.open_search_description, {}))
+            return self.dumps(self.resource_to_dict(self.data), pretty)
         if isinstance(self.data, Package):
-            return json.dumps(
-                self.element_to_dict(
-                    AtomEmitter.package_to_atom(self.data), {}))
+            return self.package_to_string(self.data, pretty)
+        if isinstance(self.data, Page):
+            if issubclass(self.data.model, Resource):
+                return self.dumps(
+                    self.element_to_dict(
+                        AtomEmitter.page_to_atom(self.data), {}), pretty)
+            self.data = self.data.as_dict()
         return super(CustomJSONEmitter, self).render(request)
 
 
+def precompute_fragments(sender, instance, raw=False, **kwargs):
+    """
+    Renders and stores a resource's fragments when it is saved, so that
+    the first request for it doesn't have to.
+    """
+    if raw:
+        return
+    fragments.store('osd', instance, OSDEmitter.resource_to_string(instance))
+    try:
+        fragments.store('atom', instance, 
+                        AtomEmitter.resource_to_string(instance))
+        fragments.store('json', instance, 
+                        CustomJSONEmitter.entry_to_string(instance))
+    except AttributeError:
+        # Descriptions without the elements a feed entry needs are left
+        # to fail when a feed including them is requested.
+        pass
+
+post_save.connect(precompute_fragments, sender=Resource)
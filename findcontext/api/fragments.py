@@ -0,0 +1,49 @@
+import hashlib
+from django.conf import settings
+from django.core.cache import cache
+from findcontext.main import uris
+
+CACHE_SECONDS = getattr(settings, 'API_CACHE_SECONDS', 60 * 60)
+
+def key(kind, resource):
+    """
+    Returns the cache key for one kind of rendered fragment of a
+    resource. Keys change with the resource's last_updated value and with
+    the site's base URI, which appears in the fragments.
+    """
+    return 'findcontext.fragment.%s.%s.%s' % (
+        kind, resource.id, hashlib.md5(repr(
+                (resource.last_updated, uris.base_uri()))).hexdigest())
+
+def get(kind, resource, render):
+    """
+    Returns the stored fragment of the given kind for a resource,
+    rendering it with render(resource) and storing it if need be.
+    """
+    if resource.id is None:
+        return render(resource)
+    k = key(kind, resource)
+    fragment = cache.get(k)
+    if fragment is None:
+        fragment = render(resource)
+        cache.set(k, fragment, CACHE_SECONDS)
+    return fragment
+
+def get_many(kind, resources, render):
+    """
+    Like get, but for a list of resources, fetching stored fragments
+    in one round trip to the cache.
+    """
+    keys = [ key(kind, r) for r in resources ]
+    found = cache.get_many(keys)
+    fragments = []
+    for k, r in zip(keys, resources):
+        fragment = found.get(k)
+        if fragment is None:
+            fragment = render(r)
+            cache.set(k, fragment, CACHE_SECONDS)
+        fragments.append(fragment)
+    return fragments
+
+def store(kind, resource, fragment):
+    cache.set(key(kind, resource), fragment, CACHE_SECONDS)
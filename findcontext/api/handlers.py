@@ -1,53 +1,178 @@
+import json
 import os
 from django import forms
+from django.db import IntegrityError
 from django.http import HttpResponse
+from django.utils.http import parse_etags
 from lxml import etree
 from piston.emitters import Emitter, Mimer
 from piston.handler import BaseHandler, AnonymousBaseHandler
 from piston.utils import rc
 from emitters import OSDEmitter, AtomEmitter, CustomJSONEmitter
 from findcontext.main.models import Resource, Package, LogRecord
+from findcontext.main import loaders, ranking, logbuffer
+import caching
+import paging
+
+# Times an upsert retries when concurrent writers keep getting in between
+UPSERT_ATTEMPTS = 3
+LOG_BATCH_LIMIT = 1000
 
 osd_schema = etree.RelaxNG(
     file=os.path.abspath(os.path.join(os.path.dirname(__file__), 
                                       'schemas/opensearchdescription.rng')))
 
+def bad_request(message):
+    return HttpResponse('Bad Request: %s' % message, status=400)
+
+def paged(request, queryset):
+    try:
+        page = paging.paginate(request, queryset)
+    except ValueError as e:
+        return bad_request(e)
+    if page is None:
+        return queryset
+    return page
+
+def precondition_failed():
+    return HttpResponse('Precondition Failed', status=412)
+
+def accepted():
+    return HttpResponse('Accepted', status=202)
+
+def read_description(request):
+    """
+    Returns an unsaved resource for the OpenSearch description in the
+    body of a request. Raises ValueError if there isn't a valid one.
+    """
+    if not request.content_type == 'application/opensearchdescription+xml':
+        raise ValueError(
+            'Content-Type must be application/opensearchdescription+xml')
+    try:
+        osd_schema.assertValid(request.data)
+    except etree.DocumentInvalid as e:
+        raise ValueError(e.message)
+    return Resource.from_xml(request.raw_post_data, request.data)
+
+def upsert(resource):
+    """
+    Replaces the resource with the same short name in one UPDATE, or if
+    there isn't one inserts it in one INSERT, trying again if another
+    writer inserts or deletes it in between.
+    """
+    short_name = resource.short_name
+    for attempt in range(UPSERT_ATTEMPTS):
+        if resource.replace(_short_name=short_name):
+            return rc.ALL_OK
+        try:
+            resource.insert()
+            return rc.CREATED
+        except IntegrityError:
+            continue
+    return rc.DUPLICATE_ENTRY
+
+def read_resources(request, id=None):
+    if id is None:
+        return paged(request, loaders.load_resources())
+    try:
+        return Resource.objects.get(pk=id)
+    except Resource.DoesNotExist:
+        return rc.NOT_FOUND
+
+def read_packages(request, id=None, columns=None):
+    if id is None:
+        return paged(request, loaders.load_packages(columns))
+    try:
+        package = loaders.load_package(id)
+    except Package.DoesNotExist:
+        return rc.NOT_FOUND
+    if 'q' in request.GET:
+        positions = dict([ (r_id, i) for i, r_id in enumerate(
+                    ranking.rank(package.id, request.GET['q'])) ])
+        package.loaded_resources.sort(
+            key=lambda r: positions.get(r.id, len(positions)))
+    return package
+
 class AnonymousResourceHandler(AnonymousBaseHandler):
     allowed_methods = ('GET',)
     model = Resource
+    def read(self, request, *args, **kwargs):
+        return read_resources(request, *args, **kwargs)
 
 class ResourceHandler(BaseHandler):
-    allowed_methods = ('GET', 'POST', 'DELETE')
+    allowed_methods = ('GET', 'POST', 'PUT', 'DELETE')
     model = Resource
     anonymous = AnonymousResourceHandler
+    def read(self, request, *args, **kwargs):
+        return read_resources(request, *args, **kwargs)
+
     def bad_request(self, message):
         return HttpResponse('Bad Request: %s' % message, status=400)
 
     def create(self, request, *args, **kwargs):
-        if not request.content_type == 'application/opensearchdescription+xml':
-            return self.bad_request(
-                'Content-Type must be application/opensearchdescription+xml')
         try:
-            osd_schema.assertValid(request.data)
-        except etree.DocumentInvalid as e:
-            return self.bad_request(e.message)
-        short_name = request.data.find(
-            '{http://a9.com/-/spec/opensearch/1.1/}ShortName').text
-        if Resource.objects.filter(_short_name__exact=short_name).count() > 0:
+            resource = read_description(request)
+        except ValueError as e:
+            return self.bad_request(e)
+        try:
+            resource.insert()
+        except IntegrityError:
             return rc.DUPLICATE_ENTRY
-        else:
-            Resource.objects.create(open_search_description=request.data)
-            return rc.CREATED
+        return rc.CREATED
+
+    def update(self, request, id=None):
+        """
+        Replaces the description of a resource. With If-Match, it is only
+        replaced if it hasn't changed since one of its ETags was issued.
+        PUT to the list of resources upserts by short name instead.
+        """
+        try:
+            resource = read_description(request)
+        except ValueError as e:
+            return self.bad_request(e)
+        if id is None:
+            return upsert(resource)
+        try:
+            resource.id = int(id)
+        except ValueError:
+            return rc.NOT_FOUND
+        if_match = request.META.get('HTTP_IF_MATCH', '').strip()
+        conditions = {}
+        if if_match and if_match != '*':
+            try:
+                etags = parse_etags(if_match)
+            except ValueError:
+                etags = []
+            state = loaders.resource_state(resource.id)
+            if state is None or caching.validator(loaders.resource_version(
+                    resource.id, state)) not in map(caching.etag_validator,
+                                                    etags):
+                return precondition_failed()
+            # only replace the row as it was when it was checked
+            conditions.update(last_updated=state[0], previous=state[1])
+        try:
+            if resource.replace(**conditions):
+                return rc.ALL_OK
+        except IntegrityError:
+            return rc.DUPLICATE_ENTRY
+        if if_match:
+            return precondition_failed()
+        return rc.NOT_FOUND
 
 class AnonymousPackageHandler(AnonymousBaseHandler):
     allowed_methods = ('GET',)
     model = Package
     fields = ('uri', 'name', 'description')
+    def read(self, request, *args, **kwargs):
+        return read_packages(request, columns=('id', 'name', 'description', 'last_updated'),
+                             *args, **kwargs)
 
 class PackageHandler(BaseHandler):
     allowed_methods = ('GET',)
     model = Package
     anonymous = AnonymousPackageHandler
+    def read(self, request, *args, **kwargs):
+        return read_packages(request, *args, **kwargs)
 
 class LogRecordHandler(BaseHandler):
     allowed_methods = ('POST',)
@@ -58,8 +183,30 @@ class LogRecordHandler(BaseHandler):
     def create(self, request, *args, **kwargs):
         if len(request.data) == 0:
             return self.bad_request('Log message must not be empty')
-        LogRecord.objects.create(user=request.user, message=request.data)
-        return rc.CREATED
+        try:
+            message = request.data.decode('utf-8')
+        except UnicodeDecodeError:
+            return self.bad_request('Log message must be UTF-8')
+        logbuffer.buffer.add(request.user, message)
+        return accepted()
+
+class LogBatchHandler(BaseHandler):
+    allowed_methods = ('POST',)
+    model = LogRecord
+    def bad_request(self, message):
+        return HttpResponse('Bad Request: %s' % message, status=400)
+
+    def create(self, request, *args, **kwargs):
+        messages = request.data
+        if not (isinstance(messages, list) and messages and
+                all([ isinstance(m, basestring) and m for m in messages ])):
+            return self.bad_request(
+                'Expected a JSON list of non-empty log messages')
+        if len(messages) > LOG_BATCH_LIMIT:
+            return self.bad_request(
+                'At most %d log messages can be sent at once' % LOG_BATCH_LIMIT)
+        logbuffer.buffer.add(request.user, messages)
+        return accepted()
 
 Emitter.register('osd', OSDEmitter, 'application/opensearchdescription+xml; charset=utf-8')
 Emitter.register('atom', AtomEmitter, 'application/atom+xml; charset=utf-8')
@@ -76,4 +223,5 @@ def load_text(raw_post_data):
 
 Mimer.register(load_xml, ('application/opensearchdescription+xml',))
 Mimer.register(load_text, ('text/plain', 'text/plain; charset=UTF-8'))
+Mimer.register(json.loads, ('application/json', 'application/json; charset=UTF-8'))
         
@@ -0,0 +1,200 @@
+import tarfile
+import zipfile
+from multiprocessing import Pool
+from StringIO import StringIO
+from django.conf import settings
+from django.db import transaction
+from lxml import etree
+from findcontext.main.models import Resource, OPENSEARCH_NS
+from handlers import osd_schema
+
+# Worker processes used to validate documents; None means one per CPU
+PROCESSES = getattr(settings, 'BULK_IMPORT_PROCESSES', None)
+# Payloads with fewer documents than this are validated in-process
+PARALLEL_MINIMUM = getattr(settings, 'BULK_IMPORT_PARALLEL_MINIMUM', 8)
+MAX_DOCUMENTS = getattr(settings, 'BULK_IMPORT_MAX_DOCUMENTS', 1000)
+# Largest payload accepted, and largest total size of the documents in it
+MAX_BYTES = getattr(settings, 'BULK_IMPORT_MAX_BYTES', 10 * 1024 * 1024)
+
+ATOM_NS = 'http://www.w3.org/2005/Atom'
+ZIP_TYPES = ('application/zip', 'application/x-zip-compressed')
+TAR_TYPES = ('application/x-tar', 'application/x-gtar', 'application/gzip',
+             'application/x-gzip')
+SHORT_NAME_LENGTH = Resource._meta.get_field('_short_name').max_length
+
+_pool = None
+
+def start_pool():
+    """
+    Starts the validation worker processes. Call this once at startup,
+    before the process has threads or database connections to copy into
+    the workers; without a pool, documents are validated in-process.
+    """
+    global _pool
+    if _pool is None:
+        _pool = Pool(PROCESSES)
+    return _pool
+
+def stop_pool():
+    """
+    Stops the validation worker processes started by start_pool.
+    """
+    global _pool
+    if _pool is not None:
+        _pool.terminate()
+        _pool.join()
+        _pool = None
+
+def check_sizes(sizes):
+    """
+    Raises ValueError if there are too many documents of the given sizes
+    or they are too large in total.
+    """
+    if len(sizes) > MAX_DOCUMENTS:
+        raise ValueError('At most %d documents can be imported at once'
+                         % MAX_DOCUMENTS)
+    if sum(sizes) > MAX_BYTES:
+        raise ValueError('Documents must total at most %d bytes' % MAX_BYTES)
+
+def read_atom(data):
+    try:
+        feed = etree.fromstring(data)
+    except etree.XMLSyntaxError as e:
+        raise ValueError(e)
+    documents = []
+    for i, entry in enumerate(feed.findall('{%s}entry' % ATOM_NS)):
+        name = (entry.findtext('{%s}title' % ATOM_NS) or
+                entry.findtext('{%s}id' % ATOM_NS) or 'entry %d' % (i + 1))
+        content = entry.find('{%s}content' % ATOM_NS)
+        osd = None
+        if content is not None and len(content):
+            osd = content[0]
+        documents.append((name, osd is not None and etree.tostring(osd) or ''))
+    check_sizes([ len(data) for name, data in documents ])
+    return documents
+
+def read_zip(data):
+    """
+    Reads the .xml members of a zip archive, checking their number and
+    sizes before decompressing any of them.
+    """
+    try:
+        archive = zipfile.ZipFile(StringIO(data))
+        infos = [ info for info in archive.infolist()
+                  if info.filename.endswith('.xml') ]
+        check_sizes([ info.file_size for info in infos ])
+        documents = []
+        for info in infos:
+            # don't trust the stated size to bound the decompressed data
+            member = archive.open(info).read(info.file_size + 1)
+            if len(member) > info.file_size:
+                raise ValueError('%s is larger than stated' % info.filename)
+            documents.append((info.filename, member))
+        return documents
+    except zipfile.BadZipfile as e:
+        raise ValueError(e)
+
+def read_tar(data):
+    """
+    Reads the .xml members of a tar archive, checking their number and
+    sizes before extracting any of them.
+    """
+    try:
+        archive = tarfile.open(fileobj=StringIO(data), mode='r:*')
+        members = []
+        for member in archive:
+            if member.isfile() and member.name.endswith('.xml'):
+                members.append(member)
+                if len(members) > MAX_DOCUMENTS:
+                    break
+        check_sizes([ member.size for member in members ])
+        return [ (member.name, archive.extractfile(member).read())
+                 for member in members ]
+    except tarfile.TarError as e:
+        raise ValueError(e)
+
+def read_documents(data, content_type):
+    """
+    Returns (name, XML) for each document in a bulk payload: an Atom
+    feed with an OpenSearch description as the content of each entry,
+    or a zip or tar archive of .xml files. Raises ValueError if the
+    payload can't be read, or has more than MAX_DOCUMENTS documents or
+    more than MAX_BYTES of them.
+    """
+    content_type = content_type.split(';')[0].strip()
+    if content_type == 'application/atom+xml':
+        return read_atom(data)
+    if content_type in ZIP_TYPES:
+        return read_zip(data)
+    if content_type in TAR_TYPES:
+        return read_tar(data)
+    raise ValueError('Content-Type must be application/atom+xml, '
+                     'application/zip or application/x-tar')
+
+def validate(data):
+    """
+    Returns (short name, None) if data is a valid OpenSearch description,
+    or (None, message) if it isn't. Runs in a worker process.
+    """
+    try:
+        osd = etree.fromstring(data)
+        osd_schema.assertValid(osd)
+    except (etree.XMLSyntaxError, etree.DocumentInvalid) as e:
+        return None, e.message or 'Not XML'
+    short_name = osd.findtext('{%s}ShortName' % OPENSEARCH_NS)
+    if len(short_name) > SHORT_NAME_LENGTH:
+        return None, 'ShortName must be at most %d characters' % (
+            SHORT_NAME_LENGTH)
+    return short_name, None
+
+def parallel_map(function, items):
+    """
+    Maps a module-level function over items in the worker processes, or
+    in this process if there are none or too few items to be worth
+    sending.
+    """
+    if _pool is None or len(items) < PARALLEL_MINIMUM:
+        return map(function, items)
+    return _pool.map(function, items)
+
+@transaction.commit_on_success
+def insert(documents):
+    resources = [ Resource.from_xml(data) for data in documents ]
+    for resource in resources:
+        resource.save()
+    return resources
+
+def import_documents(documents):
+    """
+    Validates a list of (name, XML) documents in parallel and creates a
+    resource for each valid one whose short name isn't taken, all in
+    one transaction. Returns a report dict with the status of each
+    document: 'created', 'invalid' or 'duplicate'. Raises IntegrityError
+    if another import takes one of the short names first.
+    """
+    results = parallel_map(validate, [ data for name, data in documents ])
+    names = [ short_name for short_name, message in results if short_name ]
+    taken = set(Resource.objects.filter(_short_name__in=names).values_list(
+            '_short_name', flat=True))
+    report = []
+    valid = []
+    for (name, data), (short_name, message) in zip(documents, results):
+        entry = { 'document': name }
+        if short_name is None:
+            entry.update(status='invalid', message=message)
+        elif short_name in taken:
+            entry.update(status='duplicate', name=short_name)
+        else:
+            taken.add(short_name)
+            entry.update(status='created', name=short_name)
+            valid.append((entry, data))
+        report.append(entry)
+    resources = insert([ data for entry, data in valid ])
+    for (entry, data), resource in zip(valid, resources):
+        entry['uri'] = resource.uri
+    counts = dict([ (status, 0) for status in
+                    ('created', 'invalid', 'duplicate') ])
+    for entry in report:
+        counts[entry['status']] += 1
+    counts['documents'] = report
+    return counts
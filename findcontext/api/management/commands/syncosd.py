@@ -0,0 +1,46 @@
+import os
+import sys
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from findcontext.api import imports, sync
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option('--keep', action='store_false', dest='delete',
+                    default=True,
+                    help="Don't delete the resources of files that are gone."),
+        make_option('--batch-size', type='int', dest='batch_size',
+                    default=None,
+                    help='Number of resources saved per transaction.'),
+        )
+    help = 'Syncs directory trees of OpenSearch description files into resources.'
+    args = '<directory directory ...>'
+
+    def handle(self, *directories, **options):
+        if not directories:
+            raise CommandError('Give at least one directory to sync.')
+        verbosity = int(options.get('verbosity', 1))
+        for directory in directories:
+            if not os.path.isdir(directory):
+                raise CommandError('%s is not a directory.' % directory)
+        imports.start_pool()
+        try:
+            for directory in directories:
+                self.sync_directory(directory, verbosity, options)
+        finally:
+            imports.stop_pool()
+
+    def sync_directory(self, directory, verbosity, options):
+        report = sync.sync(directory, options.get('delete', True),
+                           options.get('batch_size'))
+        for path, message in report['invalid'] + report['conflicts']:
+            sys.stderr.write('%s: %s\n' % (path, message))
+        if verbosity > 1:
+            for status in ('created', 'updated', 'deleted'):
+                for path in report[status]:
+                    print '%s %s' % (status, path)
+        if verbosity > 0:
+            print '%s: %d created, %d updated, %d unchanged, %d deleted, %d failed' % (
+                directory, len(report['created']), len(report['updated']),
+                report['unchanged'], len(report['deleted']),
+                len(report['invalid']) + len(report['conflicts']))
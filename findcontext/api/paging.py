@@ -0,0 +1,113 @@
+import base64
+from datetime import datetime
+from django.conf import settings
+from django.db.models import Q
+from findcontext.main import uris
+
+PAGE_SIZE = getattr(settings, 'API_PAGE_SIZE', 20)
+MAX_PAGE_SIZE = getattr(settings, 'API_MAX_PAGE_SIZE', 500)
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+class Page(object):
+    """
+    One page of a listing, with OpenSearch-style paging metadata.
+    """
+    def __init__(self, model, object_list, total, start_index, count,
+                 next_uri=None, previous_uri=None, first_uri=None):
+        self.model = model
+        self.object_list = object_list
+        self.total = total
+        self.start_index = start_index
+        self.count = count
+        self.next_uri = next_uri
+        self.previous_uri = previous_uri
+        self.first_uri = first_uri
+
+    def as_dict(self):
+        d = { 'totalResults': self.total, 'itemsPerPage': self.count,
+              'entries': self.object_list }
+        if self.start_index is not None:
+            d['startIndex'] = self.start_index
+        for key, uri in (('first', self.first_uri),
+                         ('next', self.next_uri),
+                         ('previous', self.previous_uri)):
+            if uri:
+                d[key] = uri
+        return d
+
+def encode_cursor(obj):
+    t = obj.last_updated
+    return base64.urlsafe_b64encode('%s.%06d|%d' % (
+            t.strftime(TIMESTAMP_FORMAT), t.microsecond, obj.id))
+
+def decode_cursor(cursor):
+    try:
+        stamp, id = base64.urlsafe_b64decode(str(cursor)).split('|')
+        stamp, microsecond = stamp.split('.')
+        t = datetime.strptime(stamp, TIMESTAMP_FORMAT)
+        return t.replace(microsecond=int(microsecond)), int(id)
+    except (TypeError, ValueError):
+        raise ValueError('Invalid cursor')
+
+def _page_uri(request, **params):
+    GET = request.GET.copy()
+    for key in ('startIndex', 'cursor'):
+        if key in GET:
+            del GET[key]
+    for key, value in params.items():
+        GET[key] = value
+    return '%s?%s' % (uris.absolute_uri(request.path), GET.urlencode())
+
+def positive_int(request, key, default):
+    try:
+        value = int(request.GET.get(key, default))
+    except ValueError:
+        raise ValueError('%s must be an integer' % key)
+    if value < 1:
+        raise ValueError('%s must be at least 1' % key)
+    return value
+
+def paginate(request, queryset):
+    """
+    Returns a Page of the queryset, ordered by (last_updated, id), if the
+    request asks for paging with startIndex, count or cursor; otherwise
+    returns None. Raises ValueError if the paging parameters are invalid.
+
+    startIndex is 1-based, as in OpenSearch. A cursor is an opaque token
+    taken from a previous page's next link; it pages by key rather than
+    by offset, so deep pages cost no more than the first.
+    """
+    if not ('startIndex' in request.GET or 'count' in request.GET
+            or 'cursor' in request.GET):
+        return None
+    count = min(positive_int(request, 'count', PAGE_SIZE), MAX_PAGE_SIZE)
+    queryset = queryset.order_by('last_updated', 'id')
+    total = queryset.count()
+    first_uri = _page_uri(request, startIndex=1, count=count)
+    cursor = request.GET.get('cursor')
+    if cursor:
+        if 'startIndex' in request.GET:
+            raise ValueError('Use either startIndex or cursor, not both')
+        t, id = decode_cursor(cursor)
+        object_list = list(queryset.filter(
+                Q(last_updated__gt=t) | Q(last_updated=t, id__gt=id))[:count + 1])
+        next_uri = None
+        if len(object_list) > count:
+            object_list = object_list[:count]
+            next_uri = _page_uri(request, cursor=encode_cursor(object_list[-1]),
+                                 count=count)
+        return Page(queryset.model, object_list, total, None, count,
+                    next_uri=next_uri, first_uri=first_uri)
+    start_index = positive_int(request, 'startIndex', 1)
+    object_list = list(queryset[start_index - 1:start_index - 1 + count])
+    next_uri = previous_uri = None
+    if start_index - 1 + count < total:
+        if object_list:
+            next_uri = _page_uri(
+                request, cursor=encode_cursor(object_list[-1]), count=count)
+    if start_index > 1:
+        previous_uri = _page_uri(
+            request, startIndex=max(1, start_index - count), count=count)
+    return Page(queryset.model, object_list, total, start_index, count,
+                next_uri=next_uri, previous_uri=previous_uri,
+                first_uri=first_uri)
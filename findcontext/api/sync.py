@@ -0,0 +1,152 @@
+import hashlib
+import os
+from django.conf import settings
+from django.db import transaction
+from findcontext.main.models import Resource, SyncedFile
+import imports
+
+BATCH_SIZE = getattr(settings, 'SYNC_BATCH_SIZE', 500)
+
+def read_file(item):
+    """
+    Reads and hashes a file and, if its hash isn't the known one,
+    validates it. Returns (path, sha1, data, short name, message), where
+    data is None if the file is unchanged and message is set if it is
+    unreadable or invalid. Runs in a worker process.
+    """
+    path, known_sha1 = item
+    try:
+        f = open(path, 'rb')
+        try:
+            data = f.read()
+        finally:
+            f.close()
+    except IOError as e:
+        return path, None, None, None, str(e)
+    sha1 = hashlib.sha1(data).hexdigest()
+    if sha1 == known_sha1:
+        return path, sha1, None, None, None
+    short_name, message = imports.validate(data)
+    return path, sha1, data, short_name, message
+
+def find_files(root):
+    """
+    Returns a dict mapping the path of each .xml file under root to its
+    (size, mtime).
+    """
+    files = {}
+    for directory, dirnames, filenames in os.walk(root):
+        for filename in filenames:
+            if filename.endswith('.xml'):
+                path = os.path.join(directory, filename)
+                stat = os.stat(path)
+                files[path] = (stat.st_size, stat.st_mtime)
+    return files
+
+def batches(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+@transaction.commit_on_success
+def touch(paths, records, files):
+    for path in paths:
+        size, mtime = files[path]
+        SyncedFile.objects.filter(pk=records[path].id).update(
+            size=size, mtime=mtime)
+
+@transaction.commit_on_success
+def upsert(changed, records, files, report):
+    names = [ short_name for path, sha1, data, short_name in changed ]
+    owners = dict(Resource.objects.filter(_short_name__in=names).values_list(
+            '_short_name', 'id'))
+    synced = dict(SyncedFile.objects.filter(
+            resource__in=owners.values()).values_list('resource', 'path'))
+    for path, sha1, data, short_name in changed:
+        record = records.get(path)
+        resource_id = record and record.resource_id or None
+        owner = owners.get(short_name)
+        if owner is not None and owner != resource_id:
+            old_path = synced.get(owner, path)
+            if (resource_id is None and old_path in records
+                and old_path not in files):
+                record = records.pop(old_path) # renamed; move its row
+            elif resource_id is not None or old_path != path:
+                report['conflicts'].append(
+                    (path, 'ShortName %s is already taken' % short_name))
+                continue
+            resource_id = owner # adopt a resource that no file describes
+        resource = Resource.from_xml(data)
+        resource.id = resource_id
+        resource.save()
+        owners[short_name] = resource.id
+        synced[resource.id] = path
+        size, mtime = files[path]
+        if record is None:
+            SyncedFile.objects.create(path=path, size=size, mtime=mtime,
+                                      sha1=sha1, resource=resource)
+        else:
+            SyncedFile.objects.filter(pk=record.id).update(
+                path=path, size=size, mtime=mtime, sha1=sha1,
+                resource=resource)
+        report[resource_id is None and 'created' or 'updated'].append(path)
+
+@transaction.commit_on_success
+def remove(paths, records):
+    Resource.objects.filter(
+        id__in=[ records[path].resource_id for path in paths ]).delete()
+
+def sync(root, delete=True, batch_size=None):
+    """
+    Syncs the OpenSearch description files under a directory into
+    resources. Files whose size and modification time haven't changed
+    since the last sync are skipped without being read; the rest are
+    hashed and validated in the worker processes, and those whose
+    contents have changed are saved in batches of batch_size, one
+    transaction per batch. A new file with the short name of a file that
+    is gone is taken to be that file renamed, and updates its resource.
+    If delete is true the resources of other files that are gone are
+    deleted.
+
+    Returns a report dict listing the paths 'created', 'updated' and
+    'deleted', the number 'unchanged', and (path, message) pairs for
+    the files that were 'invalid' or had 'conflicts' with the short
+    name of another resource.
+    """
+    if batch_size is None:
+        batch_size = BATCH_SIZE
+    root = os.path.abspath(root)
+    report = { 'created': [], 'updated': [], 'deleted': [], 'unchanged': 0,
+               'invalid': [], 'conflicts': [] }
+    files = find_files(root)
+    records = dict([ (r.path, r) for r in SyncedFile.objects.filter(
+                path__startswith=os.path.join(root, '')) ])
+    stale = []
+    for path, (size, mtime) in sorted(files.items()):
+        record = records.get(path)
+        if record is None:
+            stale.append((path, None))
+        elif record.size != size or record.mtime != mtime:
+            stale.append((path, record.sha1))
+        else:
+            report['unchanged'] += 1
+    touched = []
+    changed = []
+    for path, sha1, data, short_name, message in imports.parallel_map(
+        read_file, stale):
+        if message is not None:
+            report['invalid'].append((path, message))
+        elif data is None:
+            touched.append(path)
+        else:
+            changed.append((path, sha1, data, short_name))
+    report['unchanged'] += len(touched)
+    for batch in batches(touched, batch_size):
+        touch(batch, records, files)
+    for batch in batches(changed, batch_size):
+        upsert(batch, records, files, report)
+    if delete:
+        gone = sorted([ path for path in records if path not in files ])
+        for batch in batches(gone, batch_size):
+            remove(batch, records)
+        report['deleted'] = gone
+    return report
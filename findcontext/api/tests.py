@@ -6,27 +6,78 @@ import json
 import base64
 import urllib
 import time
+import gzip
+import zlib
+import tarfile
+import zipfile
+import os
+import re
+import shutil
+import socket
+import tempfile
 from lxml import etree
 from StringIO import StringIO
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, DatabaseError
 from django.test.client import Client
 from django.contrib.auth.models import User
 from django.utils import feedgenerator
-from main.models import Resource, Package
-from api.utils import TestServerThread
+from main.models import Resource, Package, GazetteerTerm, SyncedFile
+from api.utils import TestServerThread, StubServerThread
+from findcontext.api import handlers
+from findcontext.main import logbuffer, ranking
 
 
 class TestCase(unittest.TestCase):
+    """
+    Gives each test a client and a user, 'tester', whose Authorization
+    header is in self.auth. If with_package is true it also gets a
+    package, self.p, owned by that user.
+    """
+    with_package = False
+
+    def setUp(self):
+        self.c = Client()
+        self.u = User.objects.create_user('tester', '', 'testerpass')
+        self.auth = 'Basic %s' % base64.b64encode('tester:testerpass')
+        if self.with_package:
+            self.p = Package.objects.create(
+                name='Test Package', description='This is a test.',
+                owner=self.u)
+
+    def tearDown(self):
+        if self.with_package:
+            self.p.delete()
+        self.u.delete()
+
     def assert_equal_show_diff(self, a, b):
         self.assertEqual(a, b, '\n' + ''.join(difflib.ndiff(a.splitlines(True), 
                                                             b.splitlines(True))))
 
+def count_queries(func, *args, **kwargs):
+    debug = settings.DEBUG
+    settings.DEBUG = True
+    connection.queries = []
+    try:
+        func(*args, **kwargs)
+        return len(connection.queries)
+    finally:
+        settings.DEBUG = debug
+
 class LoggingTestCase(TestCase):
     def setUp(self):
-        self.c = Client()
-        self.u = User.objects.create_user('tester', '', 'testerpass')
+        super(LoggingTestCase, self).setUp()
+        ranking.clicks.clear() # so flushing only writes
 
     def tearDown(self):
-        self.u.delete()
+        logbuffer.buffer.flush()
+        super(LoggingTestCase, self).tearDown()
+
+    def post_batch(self, messages):
+        return self.c.post(
+            '/api/log/batch', data=json.dumps(messages),
+            content_type='application/json', HTTP_AUTHORIZATION=self.auth)
 
     def test_anonymous_logging(self):
         response = self.c.post(
@@ -45,8 +96,9 @@ class LoggingTestCase(TestCase):
         response = self.c.post(
             '/api/log/', data='this is a log message', content_type='text/plain',
             HTTP_AUTHORIZATION='Basic %s' % base64.b64encode('tester:testerpass'))
-        self.assertEqual(201, response.status_code)
-        self.assertEqual('Created', response.content)
+        self.assertEqual(202, response.status_code)
+        self.assertEqual('Accepted', response.content)
+        self.assertEqual(1, logbuffer.buffer.flush())
         records = self.u.log.all()
         self.assertEqual(1, len(records))
         self.assertEqual('this is a log message', records[0].message)
@@ -55,23 +107,117 @@ class LoggingTestCase(TestCase):
         response = self.c.post(
             '/api/log/', data='this is a log message', content_type='text/plain; charset=UTF-8',
             HTTP_AUTHORIZATION='Basic %s' % base64.b64encode('tester:testerpass'))
-        self.assertEqual(201, response.status_code)
-        self.assertEqual('Created', response.content)
+        self.assertEqual(202, response.status_code)
+        self.assertEqual('Accepted', response.content)
+        logbuffer.buffer.flush()
         records = self.u.log.all()
         self.assertEqual(1, len(records))
         self.assertEqual('this is a log message', records[0].message)
 
+    def test_batch_logging(self):
+        messages = [ u'message %d' % i for i in range(50) ] + [ u'caf\xe9' ]
+        response = self.post_batch(messages)
+        self.assertEqual(202, response.status_code)
+        self.assertEqual(0, self.u.log.count())
+        self.assertEqual(1, count_queries(logbuffer.buffer.flush))
+        self.assertEqual(messages, [ r.message for r in
+                                     self.u.log.order_by('id') ])
+
+    def test_rows_are_inserted_in_multi_row_statements(self):
+        messages = [ u'message %d' % i for i in range(5) ]
+        self.post_batch(messages)
+        rows_per_insert = logbuffer.ROWS_PER_INSERT
+        logbuffer.ROWS_PER_INSERT = 2
+        debug = settings.DEBUG
+        settings.DEBUG = True
+        connection.queries = []
+        try:
+            logbuffer.buffer.flush()
+            inserts = [ q['sql'] for q in connection.queries
+                        if q['sql'].startswith('INSERT') ]
+        finally:
+            settings.DEBUG = debug
+            logbuffer.ROWS_PER_INSERT = rows_per_insert
+        self.assertEqual(3, len(inserts))
+        self.assertTrue('message 1' in inserts[0])
+        self.assertEqual(messages, [ r.message for r in
+                                     self.u.log.order_by('id') ])
+
+    def test_batch_logging_anonymous(self):
+        response = self.c.post('/api/log/batch', data='["message"]',
+                               content_type='application/json')
+        self.assertEqual(401, response.status_code)
+
+    def test_bad_batches(self):
+        for messages in ({ 'message': 'x' }, [], [ 'x', '' ], [ 'x', 1 ],
+                         [ 'x' ] * (handlers.LOG_BATCH_LIMIT + 1)):
+            response = self.post_batch(messages)
+            self.assertEqual(400, response.status_code)
+            self.assertEqual('Bad Request: ', response.content[:13])
+        self.assertEqual(0, len(logbuffer.buffer))
+
+    def test_flush_when_full(self):
+        buffer = logbuffer.LogBuffer(size=3)
+        buffer.add(self.u, [ 'one', 'two' ])
+        self.assertEqual(0, self.u.log.count())
+        buffer.add(self.u, 'three')
+        self.assertEqual(0, len(buffer))
+        self.assertEqual(3, self.u.log.count())
+
+    def test_flush_when_old(self):
+        buffer = logbuffer.LogBuffer(seconds=60)
+        buffer.add(self.u, 'one')
+        self.assertTrue(buffer._timer.isAlive())
+        buffer.flush()
+        self.assertTrue(buffer._timer is None)
+        self.assertEqual(1, self.u.log.count())
+
+    def test_failed_flush_keeps_records(self):
+        buffer = logbuffer.LogBuffer()
+        buffer.add(self.u, [ 'one', 'two' ])
+        insert = logbuffer.insert
+        def failing_insert(rows):
+            raise DatabaseError('down')
+        logbuffer.insert = failing_insert
+        try:
+            self.assertRaises(DatabaseError, buffer.flush)
+        finally:
+            logbuffer.insert = insert
+        buffer.add(self.u, 'three')
+        self.assertEqual(3, buffer.flush())
+        self.assertEqual([ 'one', 'two', 'three' ], [
+                r.message for r in self.u.log.order_by('id') ])
+
+    def test_failed_flush_when_full_still_accepts(self):
+        size = logbuffer.buffer.size
+        insert = logbuffer.insert
+        def failing_insert(rows):
+            raise DatabaseError('down')
+        logbuffer.buffer.size = 2
+        logbuffer.insert = failing_insert
+        try:
+            response = self.post_batch([ u'one', u'two' ])
+        finally:
+            logbuffer.buffer.size = size
+            logbuffer.insert = insert
+        self.assertEqual(202, response.status_code)
+        self.assertEqual(2, len(logbuffer.buffer))
+        self.assertTrue(logbuffer.buffer._timer.isAlive())
+        self.assertEqual(2, logbuffer.buffer.flush())
+        self.assertEqual([ 'one', 'two' ], [
+                r.message for r in self.u.log.order_by('id') ])
+
 class ResourceTestCase(TestCase):
     def setUp(self):
-        self.c = Client()
+        super(ResourceTestCase, self).setUp()
         self.r = Resource.objects.create(
             open_search_description=etree.parse(
                 'test-data/wikipedia.xml').getroot())
-        self.u = User.objects.create_user('tester', '', 'testerpass')
 
     def tearDown(self):
         self.r.delete()
-        self.u.delete()
+        Resource.objects.filter(_short_name='WorldCat Catalog: Books').delete()
+        super(ResourceTestCase, self).tearDown()
 
     def test_get_resource_as_xml(self):
         response = self.c.get('/api/resource/%s' % self.r.id)
@@ -220,19 +366,14 @@ class ResourceTestCase(TestCase):
 
 
 class PackageTestCase(TestCase):
+    with_package = True
 
     def setUp(self):
-        self.c = Client()
-        self.u = User.objects.create_user('tester', '', 'testerpass')
-        self.p = Package.objects.create(name='Test Package', description='This is a test.', owner=self.u)
+        super(PackageTestCase, self).setUp()
         self.p.resources.add(Resource.get('Celtic Art & Cultures'))
         self.p.resources.add(Resource.get('Monasticon Hibernicum'))
         self.p.save()
 
-    def tearDown(self):
-        self.p.delete()
-        self.u.delete()
-
     def test_get_package_as_xml(self):
         response = self.c.get('/api/package/%s' % self.p.id)
         expected = '''<?xml version='1.0' encoding='utf-8'?>
@@ -416,6 +557,1193 @@ class PackageTestCase(TestCase):
          self.assertEqual('Test Package', o[1]['name'])
 
 
+class QueryCountTestCase(TestCase):
+    with_package = True
+
+    def setUp(self):
+        super(QueryCountTestCase, self).setUp()
+        self.p.resources.add(Resource.get('Monasticon Hibernicum'))
+
+    def add_resources(self):
+        for r in Resource.objects.exclude(_short_name='Monasticon Hibernicum'):
+            self.p.resources.add(r)
+
+    def test_package_feed_queries_are_constant(self):
+        for format in ('atom', 'json'):
+            url = '/api/package/%s?format=%s' % (self.p.id, format)
+            few = count_queries(self.c.get, url)
+            self.add_resources()
+            many = count_queries(self.c.get, url)
+            self.assertEqual(few, many)
+            self.p.resources.clear()
+            self.p.resources.add(Resource.get('Monasticon Hibernicum'))
+
+    def test_package_list_queries_are_constant(self):
+        few = count_queries(self.c.get, '/api/package/')
+        other = Package.objects.create(name='Other Package', description='Another test.', owner=self.u)
+        try:
+            many = count_queries(self.c.get, '/api/package/')
+        finally:
+            other.delete()
+        self.assertEqual(few, many)
+        # one query for the list's version, one for the list itself
+        self.assertEqual(2, many)
+
+    def test_resource_feed_queries(self):
+        cache.clear()
+        # one query for the feed's version, one for the resources
+        self.assertEqual(2, count_queries(self.c.get, '/api/resource/'))
+
+
+class ConditionalGetTestCase(TestCase):
+    with_package = True
+
+    def setUp(self):
+        super(ConditionalGetTestCase, self).setUp()
+        self.r = Resource.get('Monasticon Hibernicum')
+        self.p.resources.add(self.r)
+
+    def test_not_modified(self):
+        for url in ('/api/package/', '/api/package/%s' % self.p.id,
+                    '/api/resource/', '/api/resource/%s' % self.r.id):
+            response = self.c.get(url)
+            self.assertEqual(200, response.status_code)
+            self.assertTrue(response.has_header('Last-Modified'))
+            response = self.c.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(304, response.status_code)
+            self.assertEqual('', response.content)
+
+    def test_if_modified_since(self):
+        url = '/api/package/%s' % self.p.id
+        response = self.c.get(url)
+        response = self.c.get(
+            url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(304, response.status_code)
+
+    def test_etag_varies_with_format(self):
+        url = '/api/package/%s' % self.p.id
+        self.assertNotEqual(self.c.get(url)['ETag'],
+                            self.c.get(url + '?format=json')['ETag'])
+
+    def test_save_invalidates(self):
+        url = '/api/package/%s' % self.p.id
+        self.r = Resource.objects.create(
+            open_search_description=etree.parse(
+                'test-data/worldcat.xml').getroot())
+        self.p.resources.add(self.r)
+        response = self.c.get(url)
+        self.r.open_search_description.find(
+            '{http://a9.com/-/spec/opensearch/1.1/}Description').text = 'Changed'
+        try:
+            self.r.save()
+            fresh = self.c.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        finally:
+            self.r.delete()
+        self.assertEqual(200, fresh.status_code)
+        self.assertNotEqual(response['ETag'], fresh['ETag'])
+        self.assertTrue('<summary>Changed</summary>' in fresh.content)
+
+    def test_membership_change_invalidates(self):
+        url = '/api/package/%s' % self.p.id
+        response = self.c.get(url)
+        self.p.resources.add(Resource.get('Celtic Art & Cultures'))
+        fresh = self.c.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(200, fresh.status_code)
+        self.assertTrue('Celtic Art &amp; Cultures' in fresh.content)
+
+    def test_swapping_members_invalidates(self):
+        url = '/api/package/%s' % self.p.id
+        newest = Resource.objects.create(
+            open_search_description=etree.parse(
+                'test-data/worldcat.xml').getroot())
+        other = Resource.get('Celtic Art & Cultures')
+        try:
+            self.p.resources.add(newest)
+            response = self.c.get(url)
+            self.p.resources.remove(self.r)
+            self.p.resources.add(other)
+            fresh = self.c.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(200, fresh.status_code)
+            self.assertFalse('Monasticon Hibernicum' in fresh.content)
+            self.r.package_set.add(self.p)
+            other.package_set.remove(self.p)
+            response = self.c.get(url, HTTP_IF_NONE_MATCH=fresh['ETag'])
+            self.assertEqual(200, response.status_code)
+            self.assertTrue('Monasticon Hibernicum' in response.content)
+        finally:
+            newest.delete()
+
+    def test_cached_body_is_per_user(self):
+        auth = lambda password: 'Basic %s' % base64.b64encode(
+            'tester:%s' % password)
+        authenticated = self.c.get(
+            '/api/package/', HTTP_AUTHORIZATION=auth('testerpass'))
+        self.assertTrue('password' in authenticated.content)
+        for password in ('WRONG', 'testerpass'):
+            response = self.c.get('/api/package/',
+                                  HTTP_AUTHORIZATION=auth(password),
+                                  HTTP_IF_NONE_MATCH=authenticated['ETag'])
+            if password == 'WRONG':
+                self.assertEqual(200, response.status_code)
+                self.assertFalse('password' in response.content)
+                self.assertEqual(self.c.get('/api/package/').content,
+                                 response.content)
+            else:
+                self.assertEqual(304, response.status_code)
+
+    def test_cached_body_skips_rendering(self):
+        url = '/api/package/%s' % self.p.id
+        first = self.c.get(url)
+        self.assertEqual(1, count_queries(self.c.get, url))
+        self.assertEqual(first.content, self.c.get(url).content)
+
+    def test_missing_package(self):
+        self.assertEqual(404, self.c.get('/api/package/9999').status_code)
+
+
+class StreamingFeedTestCase(TestCase):
+
+    def test_streamed_feed_matches_buffered_feed(self):
+        c = Client()
+        buffered = c.get('/api/resource/').content
+        response = c.get('/api/resource/?stream=1')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('application/atom+xml; charset=utf-8',
+                         response['Content-Type'])
+        streamed = response.content
+        ids = lambda content: sorted(
+            e.text for e in etree.fromstring(content).iterfind(
+                '{http://www.w3.org/2005/Atom}entry/{http://www.w3.org/2005/Atom}id'))
+        self.assertEqual(ids(buffered), ids(streamed))
+        self.assertEqual(Resource.objects.count(), len(ids(streamed)))
+
+    def test_feed_is_written_in_pieces(self):
+        from api.emitters import AtomEmitter
+        pieces = list(AtomEmitter.stream_resources(
+                Resource.objects.all(), chunk_size=5))
+        # head, one piece per entry, tail
+        self.assertEqual(Resource.objects.count() + 2, len(pieces))
+        self.assertTrue(pieces[0].startswith('<?xml'))
+        self.assertEqual('</feed>\n', pieces[-1])
+        etree.fromstring(''.join(pieces))
+
+
+class PagingTestCase(TestCase):
+    ATOM = '{http://www.w3.org/2005/Atom}'
+    OPENSEARCH = '{http://a9.com/-/spec/opensearch/1.1/}'
+
+    def get_feed(self, url):
+        response = self.c.get(url)
+        self.assertEqual(200, response.status_code)
+        return etree.fromstring(response.content)
+
+    def entry_ids(self, feed):
+        return [ e.text for e in feed.iterfind(
+                '%sentry/%sid' % (self.ATOM, self.ATOM)) ]
+
+    def link(self, feed, rel):
+        for link in feed.iterfind('%slink' % self.ATOM):
+            if link.get('rel') == rel:
+                return link.get('href').replace('http://findcontext.org', '')
+        return None
+
+    def test_start_index_and_count(self):
+        feed = self.get_feed('/api/resource/?startIndex=3&count=4')
+        self.assertEqual(4, len(self.entry_ids(feed)))
+        self.assertEqual(str(Resource.objects.count()), 
+                         feed.findtext('%stotalResults' % self.OPENSEARCH))
+        self.assertEqual('3', feed.findtext('%sstartIndex' % self.OPENSEARCH))
+        self.assertEqual('4', feed.findtext('%sitemsPerPage' % self.OPENSEARCH))
+        self.assertTrue(self.link(feed, 'previous') is not None)
+        self.assertTrue(self.link(feed, 'next') is not None)
+
+    def test_following_next_links_visits_every_resource(self):
+        ids = []
+        url = '/api/resource/?count=5'
+        while url:
+            feed = self.get_feed(url)
+            ids.extend(self.entry_ids(feed))
+            url = self.link(feed, 'next')
+        self.assertEqual(Resource.objects.count(), len(ids))
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertEqual(self.entry_ids(self.get_feed('/api/resource/?count=500')), ids)
+
+    def test_unpaged_listing(self):
+        feed = self.get_feed('/api/resource/')
+        self.assertEqual(None, feed.find('%stotalResults' % self.OPENSEARCH))
+        self.assertEqual(Resource.objects.count(), len(self.entry_ids(feed)))
+
+    def test_paged_packages_as_json(self):
+        response = self.c.get('/api/package/?count=1')
+        o = json.loads(response.content)
+        self.assertEqual(Package.objects.count(), o['totalResults'])
+        self.assertEqual(1, len(o['entries']))
+        self.assertEqual('Celtic Studies 138', o['entries'][0]['name'])
+
+    def test_bad_paging_parameters(self):
+        for query in ('count=0', 'startIndex=x', 'cursor=nonsense',
+                      'cursor=MjAxMC0wMS0xOVQwMDoxODozNC4wMDAwMDB8MQ==&startIndex=2'):
+            response = self.c.get('/api/resource/?' + query)
+            self.assertEqual(400, response.status_code, query)
+
+
+class ElementToDictTestCase(TestCase):
+
+    def test_matches_recursive_converter(self):
+        from api.benchmarks import load_corpus, recursive_element_to_dict
+        from api.emitters import CustomJSONEmitter
+        osds, feed = load_corpus()
+        for doc in osds + [ feed ]:
+            self.assertEqual(
+                json.dumps(recursive_element_to_dict(doc, {}, {})),
+                json.dumps(CustomJSONEmitter.element_to_dict(doc, {})))
+
+    def test_resource_dicts_are_memoized(self):
+        from api.emitters import CustomJSONEmitter
+        r = Resource.objects.create(
+            open_search_description=etree.parse(
+                'test-data/worldcat.xml').getroot())
+        try:
+            first = CustomJSONEmitter.resource_to_dict(Resource.objects.get(pk=r.id))
+            self.assertTrue(first is CustomJSONEmitter.resource_to_dict(
+                    Resource.objects.get(pk=r.id)))
+            r.save()
+            self.assertFalse(first is CustomJSONEmitter.resource_to_dict(
+                    Resource.objects.get(pk=r.id)))
+        finally:
+            r.delete()
+
+
+class FragmentsTestCase(TestCase):
+    with_package = True
+
+    def setUp(self):
+        super(FragmentsTestCase, self).setUp()
+        self.r = Resource.objects.create(
+            open_search_description=etree.parse(
+                'test-data/worldcat.xml').getroot())
+        self.p.resources.add(self.r)
+
+    def tearDown(self):
+        super(FragmentsTestCase, self).tearDown()
+        self.r.delete()
+
+    def test_fragments_stored_on_save(self):
+        from api import fragments
+        for kind in ('osd', 'atom', 'json'):
+            self.assertTrue(cache.get(fragments.key(kind, self.r)) is not None)
+
+    def test_joined_feeds_match_built_feeds(self):
+        from api.emitters import AtomEmitter, CustomJSONEmitter
+        self.p.resources.add(Resource.get('Monasticon Hibernicum'))
+        for resources in ([], [ self.r ], list(self.p.resources.all())):
+            self.p.loaded_resources = resources
+            self.assertEqual(
+                AtomEmitter.serialize(AtomEmitter.package_to_atom(self.p)),
+                AtomEmitter.package_to_string(self.p))
+            for pretty in (True, False):
+                self.assertEqual(
+                    CustomJSONEmitter.element_to_dict(
+                        AtomEmitter.package_to_atom(self.p), {}),
+                    json.loads(CustomJSONEmitter.package_to_string(
+                            self.p, pretty)))
+
+
+class CompressionTestCase(TestCase):
+    with_package = True
+
+    def setUp(self):
+        super(CompressionTestCase, self).setUp()
+        self.r = Resource.get('Monasticon Hibernicum')
+        self.p.resources.add(self.r)
+        self.url = '/api/package/%s' % self.p.id
+        cache.clear()
+
+    def test_gzip(self):
+        plain = self.c.get(self.url)
+        self.assertFalse(plain.has_header('Content-Encoding'))
+        response = self.c.get(self.url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual('gzip', response['Content-Encoding'])
+        self.assertTrue('Accept-Encoding' in response['Vary'])
+        self.assertNotEqual(plain['ETag'], response['ETag'])
+        self.assertEqual(
+            plain.content, 
+            gzip.GzipFile(fileobj=StringIO(response.content)).read())
+
+    def test_deflate(self):
+        plain = self.c.get(self.url + '?format=json')
+        response = self.c.get(self.url + '?format=json',
+                              HTTP_ACCEPT_ENCODING='deflate')
+        self.assertEqual('deflate', response['Content-Encoding'])
+        self.assertEqual(plain.content, zlib.decompress(response.content))
+
+    def test_compressed_variant_is_stored(self):
+        from findcontext.main import compression
+        first = self.c.get(self.url, HTTP_ACCEPT_ENCODING='gzip')
+        compress = compression.compress
+        compression.compress = None
+        try:
+            second = self.c.get(self.url, HTTP_ACCEPT_ENCODING='gzip')
+        finally:
+            compression.compress = compress
+        self.assertEqual(first.content, second.content)
+
+    def test_not_modified_when_compressed(self):
+        response = self.c.get(self.url, HTTP_ACCEPT_ENCODING='gzip')
+        response = self.c.get(self.url, HTTP_ACCEPT_ENCODING='gzip',
+                              HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(304, response.status_code)
+
+    def test_compact_output(self):
+        for format in ('atom', 'json'):
+            url = '%s?format=%s' % (self.url, format)
+            pretty = self.c.get(url).content
+            compact = self.c.get(url + '&pretty=0').content
+            self.assertTrue(len(compact) < len(pretty))
+            if format == 'json':
+                self.assertEqual(json.loads(pretty), json.loads(compact))
+            else:
+                parser = etree.XMLParser(remove_blank_text=True)
+                self.assertEqual(
+                    etree.tostring(etree.fromstring(pretty, parser)),
+                    etree.tostring(etree.fromstring(compact, parser)))
+
+
+class QueryLinksTestCase(TestCase):
+    with_package = True
+
+    def setUp(self):
+        super(QueryLinksTestCase, self).setUp()
+        self.p.resources.add(Resource.get('Monasticon Hibernicum'))
+        self.p.resources.add(Resource.get('Celtic Art & Cultures'))
+        self.url = '/api/package/%s/links' % self.p.id
+
+    def rows(self, response):
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('application/x-ndjson; charset=utf-8', response['Content-Type'])
+        return [ json.loads(line) for line in response.content.splitlines() ]
+
+    def test_post_lines(self):
+        rows = self.rows(self.c.post(self.url, data='abbey\n\nround tower\n',
+                                     content_type='text/plain'))
+        self.assertEqual(4, len(rows))
+        self.assertEqual([ 'abbey', 'abbey', 'round tower', 'round tower' ],
+                         [ row['term'] for row in rows ])
+        names = set([ row['name'] for row in rows ])
+        self.assertEqual(set([ 'Monasticon Hibernicum', 'Celtic Art & Cultures' ]), names)
+        for row in rows:
+            self.assertTrue(row['resource'].startswith('http://findcontext.org/api/resource/'))
+        self.assertTrue('round%20tower' in rows[2]['uri'])
+
+    def test_post_json_matches_sidebar_links(self):
+        rows = self.rows(self.c.post(self.url, data=json.dumps([u'\xe9glise']),
+                                     content_type='application/json'))
+        sidebar = self.c.get('/sidebar/', { 'p': self.p.uri, 'q': u'\xe9glise' })
+        for row in rows:
+            self.assertTrue(str(row['uri']).replace('&', '&amp;') in sidebar.content)
+
+    def test_get_terms(self):
+        rows = self.rows(self.c.get(self.url, { 'term': [ 'a', 'b', 'c' ] }))
+        self.assertEqual(6, len(rows))
+
+    def test_bad_templates_are_skipped(self):
+        broken = make_broken_resource()
+        self.p.resources.add(broken)
+        try:
+            rows = self.rows(self.c.get(self.url, { 'term': [ 'a', 'b' ] }))
+        finally:
+            broken.delete()
+        self.assertEqual(4, len(rows))
+        self.assertFalse('Broken' in [ row['name'] for row in rows ])
+
+    def test_bad_input(self):
+        self.assertEqual(400, self.c.post(self.url, data='{"a": 1}',
+                                          content_type='application/json').status_code)
+        self.assertEqual(404, self.c.get('/api/package/9999/links').status_code)
+        self.assertEqual(405, self.c.put(self.url).status_code)
+
+
+def make_osd(name, urls):
+    return etree.fromstring(
+        '<OpenSearchDescription xmlns="http://a9.com/-/spec/opensearch/1.1/">'
+        '<ShortName>%s</ShortName><Description>A test resource.</Description>%s'
+        '</OpenSearchDescription>' % (name, ''.join(
+                [ '<Url type="%s" template="%s"/>' % (t, u.replace('&', '&amp;'))
+                  for t, u in urls ])))
+
+ATOM_RESULTS = """<feed xmlns="http://www.w3.org/2005/Atom"
+      xmlns:opensearch="http://a9.com/-/spec/opensearch/1.1/">
+  <title>Results</title>
+  <opensearch:totalResults>42</opensearch:totalResults>
+  <entry><title>Atom one</title><link href="http://example.org/a1"/></entry>
+  <entry><title>Atom two</title><link href="http://example.org/a2"/></entry>
+</feed>"""
+
+def make_broken_resource():
+    """
+    Creates a resource whose templates are all malformed.
+    """
+    return Resource.objects.create(open_search_description=make_osd('Broken', [
+                ('text/html', 'http://example.org/{-prefix|/|a,b}'),
+                ('application/atom+xml', 'http://127.0.0.1:8082/atom{?q'),
+                ('application/x-suggestions+json', 'http://127.0.0.1:8082/a{?q') ]))
+
+RSS_RESULTS = """<rss version="2.0"><channel><title>Results</title>
+  <item><title>RSS one</title><link>http://example.org/r1</link></item>
+</channel></rss>"""
+
+class FederatedSearchTestCase(TestCase):
+    with_package = True
+
+    def setUp(self):
+        super(FederatedSearchTestCase, self).setUp()
+        self.server = StubServerThread('127.0.0.1', 8082, {
+                '/atom': ('application/atom+xml', ATOM_RESULTS, 0),
+                '/rss': ('application/rss+xml', RSS_RESULTS, 0),
+                '/slow': ('application/atom+xml', ATOM_RESULTS, 2),
+                '/drip': ('application/atom+xml', ATOM_RESULTS, 0, 0.05),
+                '/moved': (None, '/atom', 0) })
+        self.server.start()
+        from findcontext.main import federation
+        federation.ALLOW_PRIVATE_HOSTS = True
+        self.resources = []
+        for name, path, type in (('Atom', '/atom', 'application/atom+xml'),
+                                 ('RSS', '/rss', 'application/rss+xml'),
+                                 ('Slow', '/slow', 'application/atom+xml')):
+            r = Resource.objects.create(open_search_description=make_osd(name, [
+                        ('text/html', 'http://example.org/?q={searchTerms}'),
+                        (type, 'http://127.0.0.1:8082%s?q={searchTerms}' % path) ]))
+            self.resources.append(r)
+            self.p.resources.add(r)
+        self.p.resources.add(Resource.get('Monasticon Hibernicum'))
+        self.url = '/api/package/%s/search' % self.p.id
+        cache.clear()
+
+    def tearDown(self):
+        from findcontext.main import federation
+        federation.ALLOW_PRIVATE_HOSTS = False
+        self.server.stop()
+        super(FederatedSearchTestCase, self).tearDown()
+        for r in self.resources:
+            r.delete()
+
+    def test_search(self):
+        from findcontext.main import federation
+        timeout, deadline = federation.TIMEOUT, federation.DEADLINE
+        federation.TIMEOUT = federation.DEADLINE = 0.5
+        try:
+            started = time.time()
+            response = self.c.get(self.url, { 'q': 'round towers' })
+            self.assertTrue(time.time() - started < 1.5)
+        finally:
+            federation.TIMEOUT, federation.DEADLINE = timeout, deadline
+        self.assertEqual(200, response.status_code)
+        result = json.loads(response.content)
+        statuses = dict([ (r['name'], r['status']) for r in result['resources'] ])
+        self.assertEqual({ 'Atom': 'ok', 'RSS': 'ok', 'Slow': 'timeout',
+                           'Monasticon Hibernicum': 'unsupported' }, statuses)
+        self.assertEqual(43, result['totalResults'])
+        titles = [ hit['title'] for hit in result['hits'] ]
+        self.assertEqual(set([ 'Atom one', 'RSS one' ]), set(titles[:2]))
+        self.assertEqual([ 'Atom two' ], titles[2:])
+        self.assertTrue('/atom?q=round%20towers' in self.server.requests)
+
+    def test_bad_templates_are_errors(self):
+        self.resources.append(make_broken_resource())
+        self.p.resources.add(self.resources[-1])
+        response = self.c.get(self.url, { 'q': 'abbey' })
+        self.assertEqual(200, response.status_code)
+        statuses = dict([ (r['name'], r['status'])
+                          for r in json.loads(response.content)['resources'] ])
+        self.assertEqual('error', statuses['Broken'])
+        self.assertEqual('ok', statuses['Atom'])
+
+    def test_results_are_cached(self):
+        from findcontext.main import federation, services
+        package = services.get_package(self.p.id)
+        federation.search(package, u'abbey', timeout=0.5, deadline=0.5)
+        seen = len(self.server.requests)
+        result = federation.search(package, u'abbey', timeout=0.5, deadline=0.5)
+        self.assertEqual([ '/slow?q=abbey' ], self.server.requests[seen:])
+        self.assertEqual(43, result['totalResults'])
+
+    def test_unreachable_resource(self):
+        from findcontext.main import federation, services
+        self.server.responses.pop('/rss')
+        result = federation.search(services.get_package(self.p.id), u'abbey',
+                                   timeout=0.5, deadline=0.5)
+        statuses = dict([ (r['name'], r['status']) for r in result['resources'] ])
+        self.assertEqual('error', statuses['RSS'])
+
+    def test_missing_query(self):
+        self.assertEqual(400, self.c.get(self.url).status_code)
+
+    def test_slow_bodies_are_cut_off(self):
+        from findcontext.main import federation
+        started = time.time()
+        self.assertRaises(socket.timeout, federation.Fetch(
+                'http://127.0.0.1:8082/drip', 0.5).read)
+        self.assertTrue(time.time() - started < 1)
+
+    def test_timed_out_requests_are_aborted(self):
+        from findcontext.main import federation
+        request = federation.Fetch('http://127.0.0.1:8082/slow', 10)
+        async_result = federation.pool().apply_async(
+            federation.fetch, (request,))
+        time.sleep(0.2)
+        started = time.time()
+        request.abort()
+        self.assertRaises(socket.timeout, async_result.get, 1)
+        self.assertTrue(time.time() - started < 1)
+
+    def test_only_public_http_uris_are_fetched(self):
+        from findcontext.main import federation, services
+        federation.ALLOW_PRIVATE_HOSTS = False
+        for uri in ('http://127.0.0.1:8082/atom', 'http://localhost:8082/atom',
+                    'http://[::1]:8082/atom', 'http://10.1.2.3/atom',
+                    'file:///etc/passwd', 'ftp://example.org/atom'):
+            self.assertRaises(IOError, federation.check_uri, uri)
+        self.assertTrue(federation.is_public(socket.AF_INET, '93.184.216.34'))
+        self.assertFalse(federation.is_public(socket.AF_INET, '172.20.1.1'))
+        self.assertTrue(federation.is_public(socket.AF_INET6, '2001:db8::1'))
+        self.assertFalse(federation.is_public(socket.AF_INET6,
+                                              '::ffff:127.0.0.1'))
+        self.assertFalse(federation.is_public(socket.AF_INET6, 'fe80::1%eth0'))
+        result = federation.search(services.get_package(self.p.id), u'abbey',
+                                   timeout=0.5, deadline=0.5)
+        self.assertEqual(set([ 'error', 'unsupported' ]), set([
+                    r['status'] for r in result['resources'] ]))
+        self.assertEqual([], self.server.requests)
+
+    def test_redirects(self):
+        from findcontext.main import federation
+        self.assertEqual(ATOM_RESULTS, federation.Fetch(
+                'http://127.0.0.1:8082/moved', 1).read())
+        self.assertEqual(['/moved', '/atom'], self.server.requests)
+        federation.MAX_REDIRECTS, redirects = 0, federation.MAX_REDIRECTS
+        try:
+            self.assertRaises(IOError, federation.Fetch(
+                    'http://127.0.0.1:8082/moved', 1).read)
+        finally:
+            federation.MAX_REDIRECTS = redirects
+
+    def test_connections_go_to_the_checked_address(self):
+        from findcontext.main import federation
+        federation.ALLOW_PRIVATE_HOSTS = False
+        lookups = []
+        def getaddrinfo(host, port, *args):
+            lookups.append(host)
+            if len(lookups) > 1: # rebound since it was checked
+                raise socket.gaierror('Looked up again')
+            return [ (socket.AF_INET, socket.SOCK_STREAM, 6, '',
+                      ('127.0.0.1', port)) ]
+        getaddrinfo_, socket.getaddrinfo = socket.getaddrinfo, getaddrinfo
+        federation.is_public, is_public = (lambda family, address: True,
+                                           federation.is_public)
+        try:
+            self.assertEqual(ATOM_RESULTS, federation.Fetch(
+                    'http://rebound.example.org:8082/atom', 1).read())
+        finally:
+            socket.getaddrinfo = getaddrinfo_
+            federation.is_public = is_public
+        self.assertEqual(['rebound.example.org'], lookups)
+
+    def test_external_entities_are_not_resolved(self):
+        from findcontext.main import federation
+        secret = tempfile.NamedTemporaryFile()
+        secret.write('secret')
+        secret.flush()
+        try:
+            total, hits = federation.parse_results(
+                '<!DOCTYPE feed [<!ENTITY x SYSTEM "file://%s">]>'
+                '<feed xmlns="http://www.w3.org/2005/Atom"><entry>'
+                '<title>a&x;</title></entry></feed>' % secret.name)
+        finally:
+            secret.close()
+        self.assertEqual(1, total)
+        self.assertFalse('secret' in (hits[0]['title'] or ''))
+
+
+class SuggestTestCase(TestCase):
+    with_package = True
+
+    def setUp(self):
+        super(SuggestTestCase, self).setUp()
+        self.server = StubServerThread('127.0.0.1', 8082, {
+                '/a': ('application/x-suggestions+json',
+                       '["kil", ["Kilkenny", "Kildare", "Kilkee"]]', 0),
+                '/b': ('application/x-suggestions+json',
+                       '["kil", ["kilkenny", "Killarney"]]', 0),
+                '/slow': ('application/x-suggestions+json',
+                          '["kil", ["Kilrush"]]', 0.6) })
+        self.server.start()
+        from findcontext.main import federation
+        federation.ALLOW_PRIVATE_HOSTS = True
+        self.resources = []
+        for name in ('a', 'b', 'slow'):
+            r = Resource.objects.create(open_search_description=make_osd(name, [
+                        ('text/html', 'http://example.org/?q={searchTerms}'),
+                        ('application/x-suggestions+json',
+                         'http://127.0.0.1:8082/%s?q={searchTerms}' % name) ]))
+            self.resources.append(r)
+            self.p.resources.add(r)
+        self.url = '/api/package/%s/suggest' % self.p.id
+        cache.clear()
+
+    def tearDown(self):
+        from findcontext.main import federation
+        federation.ALLOW_PRIVATE_HOSTS = False
+        self.server.stop()
+        super(SuggestTestCase, self).tearDown()
+        for r in self.resources:
+            r.delete()
+
+    def test_suggest(self):
+        started = time.time()
+        response = self.c.get(self.url, { 'q': 'Kil' })
+        self.assertTrue(time.time() - started < 0.6)
+        self.assertEqual('application/x-suggestions+json; charset=utf-8', response['Content-Type'])
+        query, suggestions = json.loads(response.content)
+        self.assertEqual('Kil', query)
+        self.assertEqual(4, len(suggestions))
+        self.assertEqual(set([ 'kilkenny', 'kildare', 'kilkee', 'killarney' ]),
+                         set([ s.lower() for s in suggestions ]))
+
+    def test_bad_templates_are_skipped(self):
+        self.resources.append(make_broken_resource())
+        self.p.resources.add(self.resources[-1])
+        response = self.c.get(self.url, { 'q': 'Kil' })
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(4, len(json.loads(response.content)[1]))
+
+    def test_prefixes_reuse_cached_suggestions(self):
+        from findcontext.main import suggestions, services
+        package = services.get_package(self.p.id)
+        suggestions.suggest(package, u'kil', budget=0.3)
+        seen = len(self.server.requests)
+        self.assertEqual(set([ 'Kilkenny', 'Kilkee' ]),
+                         set(suggestions.suggest(package, u'kilk', budget=0.3)))
+        self.assertEqual([ '/slow?q=kilk' ], self.server.requests[seen:])
+        time.sleep(1)
+        seen = len(self.server.requests)
+        self.assertEqual([ 'Kilkenny' ], suggestions.suggest(package, u'kilken', budget=0.3))
+        self.assertEqual([], self.server.requests[seen:])
+
+    def test_long_queries_look_up_few_prefixes(self):
+        from findcontext.main import suggestions, services
+        package = services.get_package(self.p.id)
+        resources = list(enumerate(package.resources))
+        query = u'kil' * 1000
+        shortest = len(query) - suggestions.PREFIXES + 1
+        cache.set(suggestions.cache_key(resources[0][1], query[:shortest]),
+                  [ query ])
+        cache.set(suggestions.cache_key(resources[1][1], query[:shortest - 1]),
+                  [ query ])
+        self.assertEqual({ 0: ([ query ], True) },
+                         suggestions.from_cache(resources, query))
+
+
+class ResourceSearchTestCase(TestCase):
+    def test_search(self):
+        response = self.c.get('/api/resource/search', { 'q': 'celtic', 'count': 2 })
+        self.assertEqual(200, response.status_code)
+        result = json.loads(response.content)
+        self.assertTrue(result['totalResults'] > 2)
+        self.assertEqual(2, len(result['results']))
+        self.assertEqual('Celtic Art & Cultures', result['results'][0]['name'])
+        self.assertTrue(result['results'][0]['uri'].startswith('http://findcontext.org/api/resource/'))
+        self.assertEqual({ 'Ryan Shaw': result['totalResults'] }, result['facets']['developer'])
+        response = self.c.get('/api/resource/search', { 'q': 'celtic', 'startIndex': 3 })
+        self.assertEqual(result['totalResults'] - 2, len(json.loads(response.content)['results']))
+
+    def test_facet_filter(self):
+        result = json.loads(self.c.get('/api/resource/search', { 'developer': 'Nobody' }).content)
+        self.assertEqual(0, result['totalResults'])
+
+    def test_bad_paging(self):
+        self.assertEqual(400, self.c.get('/api/resource/search', { 'count': 0 }).status_code)
+
+
+class SpotTestCase(TestCase):
+    with_package = True
+
+    def setUp(self):
+        super(SpotTestCase, self).setUp()
+        self.monasticon = Resource.get('Monasticon Hibernicum')
+        self.p.resources.add(self.monasticon)
+        self.p.resources.add(Resource.get('Celtic Art & Cultures'))
+        for term in (u'Cork', u'County Cork', u'Clonmacnoise'):
+            GazetteerTerm.objects.create(package=self.p, term=term)
+        GazetteerTerm.objects.get(term=u'Clonmacnoise').resources.add(
+            self.monasticon)
+        self.url = '/api/package/%s/spot' % self.p.id
+
+    def spots(self, text):
+        response = self.c.post(self.url, data=text.encode('utf-8'),
+                               content_type='text/plain; charset=utf-8')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('application/json; charset=utf-8', response['Content-Type'])
+        return json.loads(response.content)['spots']
+
+    def test_spot(self):
+        text = u'From county  Cork to CLONMACNOISE, not Corkscrew.'
+        spots = self.spots(text)
+        self.assertEqual([ u'Cork', u'CLONMACNOISE' ],
+                         [ s['text'] for s in spots ])
+        self.assertEqual(u'Cork', text[spots[0]['start']:spots[0]['end']])
+        self.assertEqual(2, len(spots[0]['resources']))
+        self.assertEqual([ u'Monasticon Hibernicum' ],
+                         [ r['name'] for r in spots[1]['resources'] ])
+        self.assertTrue('Clonmacnoise' in spots[1]['resources'][0]['uri'])
+
+    def test_longest_match_wins(self):
+        spots = self.spots(u'An abbey in County\nCork.')
+        self.assertEqual([ (u'County\nCork', u'County Cork') ],
+                         [ (s['text'], s['term']) for s in spots ])
+
+    def test_bad_templates_are_skipped(self):
+        broken = make_broken_resource()
+        self.p.resources.add(broken)
+        GazetteerTerm.objects.get(term=u'Clonmacnoise').resources.add(broken)
+        try:
+            spots = self.spots(u'Clonmacnoise')
+        finally:
+            broken.delete()
+        self.assertEqual([ u'Monasticon Hibernicum' ],
+                         [ r['name'] for r in spots[0]['resources'] ])
+
+    def test_form_post(self):
+        response = self.c.post(self.url, { 'text': u'Cork' })
+        self.assertEqual(1, len(json.loads(response.content)['spots']))
+
+    def test_rebuilt_when_terms_change(self):
+        from findcontext.main import gazetteer
+        first = gazetteer.get_gazetteer(self.p.id)
+        self.assertTrue(first is gazetteer.get_gazetteer(self.p.id))
+        self.assertEqual([], self.spots(u'Kells'))
+        GazetteerTerm.objects.create(package=self.p, term=u'Kells')
+        self.assertEqual(1, len(self.spots(u'Kells')))
+
+    def test_rebuilt_when_term_resources_change(self):
+        term = GazetteerTerm.objects.get(term=u'Clonmacnoise')
+        celtic = Resource.get('Celtic Art & Cultures')
+        self.assertEqual(1, len(self.spots(u'Clonmacnoise')[0]['resources']))
+        term.resources.add(celtic)
+        self.assertEqual(2, len(self.spots(u'Clonmacnoise')[0]['resources']))
+        celtic.gazetteerterm_set.remove(term)
+        self.assertEqual(1, len(self.spots(u'Clonmacnoise')[0]['resources']))
+
+    def test_errors(self):
+        self.assertEqual(405, self.c.get(self.url).status_code)
+        response = self.c.post('/api/package/9999/spot', data='Cork',
+                               content_type='text/plain')
+        self.assertEqual(404, response.status_code)
+
+
+class ImportTestCase(TestCase):
+
+    def setUp(self):
+        super(ImportTestCase, self).setUp()
+        self.created = []
+
+    def tearDown(self):
+        Resource.objects.filter(_short_name__in=self.created).delete()
+        super(ImportTestCase, self).tearDown()
+
+    def post(self, data, content_type):
+        return self.c.post('/api/resource/import', data=data,
+                           content_type=content_type,
+                           HTTP_AUTHORIZATION=self.auth)
+
+    def report(self, response):
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('application/json; charset=utf-8', response['Content-Type'])
+        report = json.loads(response.content)
+        self.created.extend([ d['name'] for d in report['documents']
+                              if d['status'] == 'created' ])
+        return report
+
+    def test_zip(self):
+        data = StringIO()
+        archive = zipfile.ZipFile(data, 'w')
+        for name in ('worldcat.xml', 'not-an-opensearch-desc.xml'):
+            archive.write('test-data/' + name, name)
+        archive.write('test-data/worldcat.xml', 'copy/worldcat.xml')
+        archive.writestr('README', 'Not a description.')
+        archive.close()
+        report = self.report(self.post(data.getvalue(), 'application/zip'))
+        self.assertEqual((1, 1, 1), (report['created'], report['duplicate'],
+                                     report['invalid']))
+        statuses = dict([ (d['document'], d) for d in report['documents'] ])
+        self.assertEqual('created', statuses['worldcat.xml']['status'])
+        self.assertEqual(Resource.get('WorldCat Catalog: Books').uri,
+                         statuses['worldcat.xml']['uri'])
+        self.assertEqual('duplicate', statuses['copy/worldcat.xml']['status'])
+        self.assertEqual('Expecting element OpenSearchDescription, got foo, line 1',
+                         statuses['not-an-opensearch-desc.xml']['message'])
+
+    def test_tar_in_parallel(self):
+        from findcontext.api import imports
+        minimum = imports.PARALLEL_MINIMUM
+        imports.PARALLEL_MINIMUM = 2
+        data = StringIO()
+        archive = tarfile.open(fileobj=data, mode='w:gz')
+        names = [ 'Import Test %d' % i for i in range(10) ] + [ 'Import Test 0' ]
+        for i, name in enumerate(names):
+            xml = etree.tostring(make_osd(name, [
+                        ('text/html', 'http://example.org/?q={searchTerms}') ]))
+            info = tarfile.TarInfo('osd/%d.xml' % i)
+            info.size = len(xml)
+            archive.addfile(info, StringIO(xml))
+        archive.close()
+        imports.start_pool()
+        try:
+            report = self.report(self.post(data.getvalue(), 'application/x-gtar'))
+        finally:
+            imports.stop_pool()
+            imports.PARALLEL_MINIMUM = minimum
+        self.assertEqual(10, report['created'])
+        self.assertEqual('duplicate', report['documents'][-1]['status'])
+        self.assertEqual(10, Resource.objects.filter(
+                _short_name__startswith='Import Test').count())
+
+    def test_atom_round_trip(self):
+        feed = self.c.get('/api/resource/', { 'format': 'atom' }).content
+        report = self.report(self.post(feed, 'application/atom+xml'))
+        self.assertEqual(Resource.objects.count(), report['duplicate'])
+        self.assertEqual(0, report['created'] + report['invalid'])
+        self.assertEqual('Monasticon Hibernicum', report['documents'][0]['document'])
+
+    def test_errors(self):
+        response = self.c.post('/api/resource/import', data='<feed/>',
+                               content_type='application/atom+xml')
+        self.assertEqual(401, response.status_code)
+        response = self.post('<feed/>', 'text/xml')
+        self.assertEqual(400, response.status_code)
+        response = self.post('not a zip file', 'application/zip')
+        self.assertEqual(400, response.status_code)
+
+    def zip_of(self, count, size):
+        data = StringIO()
+        archive = zipfile.ZipFile(data, 'w', zipfile.ZIP_DEFLATED)
+        for i in range(count):
+            archive.writestr('%d.xml' % i, ' ' * size)
+        archive.close()
+        return data.getvalue()
+
+    def test_limits(self):
+        from findcontext.api import imports
+        limits = imports.MAX_DOCUMENTS, imports.MAX_BYTES
+        imports.MAX_DOCUMENTS, imports.MAX_BYTES = 2, 1000
+        try:
+            response = self.post(self.zip_of(3, 1), 'application/zip')
+            self.assertEqual(400, response.status_code)
+            self.assertTrue('At most 2 documents' in response.content)
+            # a small archive that unpacks into too much
+            data = self.zip_of(1, 1001)
+            self.assertTrue(len(data) < 1000)
+            response = self.post(data, 'application/zip')
+            self.assertEqual(400, response.status_code)
+            self.assertTrue('at most 1000 bytes' in response.content)
+            response = self.post(' ' * 1001, 'application/atom+xml')
+            self.assertEqual(413, response.status_code)
+        finally:
+            imports.MAX_DOCUMENTS, imports.MAX_BYTES = limits
+
+    def test_concurrent_import_conflicts(self):
+        from findcontext.api import imports
+        insert = imports.insert
+        def racing_insert(documents):
+            Resource.from_xml(documents[0]).save()
+            return insert(documents)
+        imports.insert = racing_insert
+        feed = ('<feed xmlns="http://www.w3.org/2005/Atom"><entry>'
+                '<title>worldcat</title><content type="application/xml">'
+                '%s</content></entry></feed>' % open('test-data/worldcat.xml').read())
+        self.created.append('WorldCat Catalog: Books')
+        try:
+            response = self.post(feed, 'application/atom+xml')
+        finally:
+            imports.insert = insert
+        self.assertEqual(409, response.status_code)
+        self.assertEqual(1, Resource.objects.filter(
+                _short_name='WorldCat Catalog: Books').count())
+
+
+class SyncTestCase(TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.root, 'more'))
+        for name in ('Sync Test A', 'Sync Test B', 'more/Sync Test C'):
+            self.write(name + '.xml', name.split('/')[-1])
+        from findcontext.api import sync
+        self.sync = sync.sync
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        Resource.objects.filter(_short_name__startswith='Sync Test').delete()
+
+    def write(self, filename, name, description='A test resource.'):
+        osd = make_osd(name, [ ('text/html', 'http://example.org/?q={searchTerms}') ])
+        osd.find('{http://a9.com/-/spec/opensearch/1.1/}Description').text = description
+        f = open(os.path.join(self.root, filename), 'w')
+        f.write(etree.tostring(osd))
+        f.close()
+
+    def counts(self, report):
+        return (len(report['created']), len(report['updated']),
+                report['unchanged'], len(report['deleted']))
+
+    def test_sync(self):
+        self.assertEqual((3, 0, 0, 0), self.counts(self.sync(self.root)))
+        a = Resource.get('Sync Test A')
+        self.assertEqual(3, SyncedFile.objects.filter(
+                path__startswith=self.root).count())
+        self.assertEqual((0, 0, 3, 0), self.counts(self.sync(self.root)))
+        # a changed file updates its resource in place
+        self.write('Sync Test A.xml', 'Sync Test A', 'Changed.')
+        os.utime(os.path.join(self.root, 'Sync Test A.xml'), (0, 0))
+        self.assertEqual((0, 1, 2, 0), self.counts(self.sync(self.root)))
+        self.assertEqual('Changed.', Resource.get('Sync Test A').description)
+        self.assertEqual(a.id, Resource.get('Sync Test A').id)
+        # files that are only touched aren't saved again
+        os.utime(os.path.join(self.root, 'Sync Test A.xml'), (1, 1))
+        self.assertEqual((0, 0, 3, 0), self.counts(self.sync(self.root)))
+        self.assertEqual(1, SyncedFile.objects.get(resource=a).mtime)
+        # removed files remove their resources
+        os.remove(os.path.join(self.root, 'more', 'Sync Test C.xml'))
+        self.assertEqual((0, 0, 2, 1), self.counts(self.sync(self.root)))
+        self.assertEqual(0, Resource.objects.filter(
+                _short_name='Sync Test C').count())
+
+    def test_renamed_files_keep_their_resources(self):
+        self.sync(self.root)
+        a = Resource.get('Sync Test A')
+        u = User.objects.create_user('syncer', '', 'syncerpass')
+        p = Package.objects.create(name='Sync Package', description='Synced.', owner=u)
+        p.resources.add(a)
+        try:
+            os.rename(os.path.join(self.root, 'Sync Test A.xml'),
+                      os.path.join(self.root, 'more', 'a.xml'))
+            report = self.sync(self.root)
+            self.assertEqual((0, 1, 2, 0), self.counts(report))
+            self.assertEqual([], report['conflicts'])
+            self.assertEqual(a.id, Resource.get('Sync Test A').id)
+            self.assertEqual(os.path.join(self.root, 'more', 'a.xml'),
+                             SyncedFile.objects.get(resource=a).path)
+            self.assertEqual([ a.id ], [ r.id for r in p.resources.all() ])
+            self.assertEqual((0, 0, 3, 0), self.counts(self.sync(self.root)))
+        finally:
+            p.delete()
+            u.delete()
+
+    def test_keep(self):
+        self.sync(self.root)
+        os.remove(os.path.join(self.root, 'Sync Test B.xml'))
+        self.assertEqual((0, 0, 2, 0), self.counts(self.sync(self.root, delete=False)))
+        Resource.get('Sync Test B')
+
+    def test_invalid_files_and_conflicts(self):
+        Resource.objects.create(open_search_description=make_osd(
+                'Sync Test D', [ ('text/html', 'http://example.org/?q={searchTerms}') ]))
+        self.write('d.xml', 'Sync Test D')
+        self.write('b-copy.xml', 'Sync Test B')
+        f = open(os.path.join(self.root, 'broken.xml'), 'w')
+        f.write('<foo/>')
+        f.close()
+        report = self.sync(self.root, batch_size=2)
+        self.assertEqual(3, len(report['created']))
+        # resources that no file describes yet are adopted
+        self.assertEqual([ os.path.join(self.root, 'd.xml') ], report['updated'])
+        self.assertEqual([ os.path.join(self.root, 'broken.xml') ],
+                         [ path for path, message in report['invalid'] ])
+        self.assertEqual([ os.path.join(self.root, 'b-copy.xml') ],
+                         [ path for path, message in report['conflicts'] ])
+
+    def test_command(self):
+        from django.core.management import call_command
+        from findcontext.api import imports
+        minimum = imports.PARALLEL_MINIMUM
+        imports.PARALLEL_MINIMUM = 2
+        pools = []
+        def parallel_map(function, items):
+            pools.append(imports._pool)
+            return parallel_map_(function, items)
+        parallel_map_, imports.parallel_map = imports.parallel_map, parallel_map
+        try:
+            call_command('syncosd', self.root, verbosity=0)
+        finally:
+            imports.parallel_map = parallel_map_
+            imports.PARALLEL_MINIMUM = minimum
+        self.assertTrue(pools and pools[0] is not None)
+        self.assertTrue(imports._pool is None)
+        self.assertEqual(3, Resource.objects.filter(
+                _short_name__startswith='Sync Test').count())
+
+
+class ResourceUpdateTestCase(TestCase):
+
+    def setUp(self):
+        super(ResourceUpdateTestCase, self).setUp()
+        self.data = open('test-data/worldcat.xml').read()
+        self.r = Resource.from_xml(self.data)
+        self.r.save()
+        self.url = '/api/resource/%s' % self.r.id
+
+    def tearDown(self):
+        Resource.objects.filter(_short_name__startswith='WorldCat').delete()
+        super(ResourceUpdateTestCase, self).tearDown()
+
+    def description(self, text, name='WorldCat Catalog: Books'):
+        return self.data.replace(
+            'Search Open WorldCat Catalog for Books', text).replace(
+            'WorldCat Catalog: Books', name)
+
+    def put(self, url, data, **extra):
+        return self.c.put(url, data=data,
+                          content_type='application/opensearchdescription+xml',
+                          HTTP_AUTHORIZATION=self.auth, **extra)
+
+    def stored(self, name='WorldCat Catalog: Books'):
+        return Resource.get(name).description
+
+    def test_put(self):
+        debug = settings.DEBUG
+        settings.DEBUG = True
+        connection.queries = []
+        try:
+            response = self.put(self.url, self.description('Replaced.'))
+            writes = [ q['sql'] for q in connection.queries
+                       if q['sql'].startswith(('UPDATE', 'INSERT'))
+                       and 'main_resource' in q['sql'] ]
+        finally:
+            settings.DEBUG = debug
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(1, len(writes))
+        self.assertEqual('Replaced.', self.stored())
+        self.assertEqual(self.r.id, Resource.get('WorldCat Catalog: Books').id)
+        self.assertTrue('Replaced.' in self.c.get(self.url).content)
+
+    def test_concurrent_writers_with_if_match(self):
+        etag = self.c.get(self.url)['ETag']
+        self.assertEqual(etag, self.c.get(self.url)['ETag'])
+        first = self.put(self.url, self.description('First.'), HTTP_IF_MATCH=etag)
+        second = self.put(self.url, self.description('Second.'), HTTP_IF_MATCH=etag)
+        self.assertEqual(200, first.status_code)
+        self.assertEqual(412, second.status_code)
+        self.assertEqual('First.', self.stored())
+        # a fresh ETag from any representation works
+        etag = self.c.get(self.url + '?format=json')['ETag']
+        response = self.put(self.url, self.description('Second.'),
+                            HTTP_IF_MATCH='"stale", %s' % etag)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('Second.', self.stored())
+
+    def test_if_match_needs_this_resources_etag(self):
+        other = Resource.from_xml(self.description('Other.', 'WorldCat Other'))
+        other.save()
+        Resource.objects.filter(pk=other.id).update(
+            last_updated=Resource.objects.get(pk=self.r.id).last_updated)
+        for url in ('/api/resource/%s' % other.id, '/api/resource/'):
+            etag = self.c.get(url)['ETag']
+            self.assertEqual(412, self.put(self.url, self.description('Changed.'),
+                                           HTTP_IF_MATCH=etag).status_code)
+        self.assertEqual('Search Open WorldCat Catalog for Books', self.stored())
+
+    def test_if_match_with_coarse_timestamps(self):
+        updated = Resource.objects.get(pk=self.r.id).last_updated
+        etag = self.c.get(self.url)['ETag']
+        self.assertEqual(200, self.put(self.url, self.description('First.'),
+                                       HTTP_IF_MATCH=etag).status_code)
+        # as if both writes fell within the same second
+        Resource.objects.filter(pk=self.r.id).update(last_updated=updated)
+        self.assertEqual(412, self.put(self.url, self.description('Second.'),
+                                       HTTP_IF_MATCH=etag).status_code)
+        self.assertEqual('First.', self.stored())
+
+    def test_if_match_compares_descriptions_as_text(self):
+        # PostgreSQL's xml type has no equality operator
+        etag = self.c.get(self.url)['ETag']
+        debug = settings.DEBUG
+        settings.DEBUG = True
+        connection.queries = []
+        try:
+            self.assertEqual(200, self.put(self.url, self.description('First.'),
+                                           HTTP_IF_MATCH=etag).status_code)
+            wheres = [ q['sql'].split(' WHERE ', 1)[1]
+                       for q in connection.queries if ' WHERE ' in q['sql'] ]
+        finally:
+            settings.DEBUG = debug
+        for where in wheres:
+            self.assertFalse(re.search(r'"open_search_description"\s*=', where))
+        self.assertTrue([ where for where in wheres
+                          if 'CAST("open_search_description" AS text) =' in where ])
+
+    def test_put_errors(self):
+        self.assertEqual(404, self.put('/api/resource/9999', self.data).status_code)
+        self.assertEqual(412, self.put('/api/resource/9999', self.data,
+                                       HTTP_IF_MATCH='*').status_code)
+        self.assertEqual(412, self.put(self.url, self.data,
+                                       HTTP_IF_MATCH='"garbage"').status_code)
+        response = self.put(self.url, self.description(
+                'Renamed.', name='Monasticon Hibernicum'))
+        self.assertEqual(409, response.status_code)
+        self.assertEqual(400, self.put(self.url, '<foo/>').status_code)
+        response = self.c.put(self.url, data=self.data,
+                              content_type='application/opensearchdescription+xml')
+        self.assertEqual(401, response.status_code)
+
+    def test_upsert(self):
+        response = self.put('/api/resource/', self.description(
+                'New.', name='WorldCat Catalog: Maps'))
+        self.assertEqual(201, response.status_code)
+        response = self.put('/api/resource/', self.description(
+                'Updated.', name='WorldCat Catalog: Maps'))
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('Updated.', self.stored('WorldCat Catalog: Maps'))
+        self.assertEqual(1, Resource.objects.filter(
+                _short_name='WorldCat Catalog: Maps').count())
+
+    def test_upsert_with_concurrent_insert(self):
+        replace = Resource.replace
+        def racing_replace(resource, **conditions):
+            replaced = replace(resource, **conditions)
+            if not replaced:
+                Resource.replace = replace
+                # another writer inserts the same resource in between
+                Resource.from_xml(self.description(
+                        'Theirs.', name='WorldCat Catalog: Maps')).save()
+            return replaced
+        Resource.replace = racing_replace
+        try:
+            response = self.put('/api/resource/', self.description(
+                    'Ours.', name='WorldCat Catalog: Maps'))
+        finally:
+            Resource.replace = replace
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('Ours.', self.stored('WorldCat Catalog: Maps'))
+
+    def test_create_duplicate_with_concurrent_insert(self):
+        self.r.delete()
+        save = Resource.save
+        def racing_save(resource, *args, **kwargs):
+            Resource.save = save
+            Resource.from_xml(self.data).save()
+            return save(resource, *args, **kwargs)
+        Resource.save = racing_save
+        try:
+            response = self.c.post(
+                '/api/resource/', data=self.data,
+                content_type='application/opensearchdescription+xml',
+                HTTP_AUTHORIZATION=self.auth)
+        finally:
+            Resource.save = save
+        self.assertEqual(409, response.status_code)
+        self.assertEqual(1, Resource.objects.filter(
+                _short_name='WorldCat Catalog: Books').count())
+
+
 class LiveServerTestCase(unittest.TestCase):
 
     def setUp(self):
@@ -2,6 +2,10 @@ from django.conf.urls.defaults import *
 from piston.resource import Resource
 from piston.authentication import HttpBasicAuthentication
 from handlers import ResourceHandler, PackageHandler, LogRecordHandler
+from handlers import LogBatchHandler
+from views import query_links, federated_search, suggest, search_resources
+from views import spot, import_resources
+from caching import ConditionalResource, resource_version, package_version
 
 class ResourcesResource(Resource):
     def determine_emitter(self, request, *args, **kwargs):
@@ -19,18 +23,29 @@ class PackagesResource(Resource):
             default = 'atom'
         return request.GET.get('format', default)
 
-resources = ResourcesResource(
-    ResourceHandler, authentication=HttpBasicAuthentication())
-packages = PackagesResource(
-    PackageHandler, authentication=HttpBasicAuthentication())
+resources = ConditionalResource(ResourcesResource(
+    ResourceHandler, authentication=HttpBasicAuthentication()),
+    resource_version)
+packages = ConditionalResource(PackagesResource(
+    PackageHandler, authentication=HttpBasicAuthentication()),
+    package_version)
 log = Resource(
     LogRecordHandler, authentication=HttpBasicAuthentication())
+log_batch = Resource(
+    LogBatchHandler, authentication=HttpBasicAuthentication())
 
 urlpatterns = patterns('',
    url(r'^resource/$', resources),
+   url(r'^resource/search$', search_resources),
+   url(r'^resource/import$', import_resources),
    url(r'^resource/(?P<id>[^/]+)$', resources),
    url(r'^package/$', packages),
    url(r'^package/(?P<id>[^/]+)$', packages),
+   url(r'^package/(?P<id>[^/]+)/links$', query_links),
+   url(r'^package/(?P<id>[^/]+)/search$', federated_search),
+   url(r'^package/(?P<id>[^/]+)/suggest$', suggest),
+   url(r'^package/(?P<id>[^/]+)/spot$', spot),
    url(r'^log/$', log),
+   url(r'^log/batch$', log_batch),
 )
 
@@ -1,5 +1,8 @@
 import threading
+import time
 import urllib
+import BaseHTTPServer
+import SocketServer
 from django.core.servers import basehttp 
 from django.core.handlers.wsgi import WSGIHandler 
 
@@ -52,3 +55,58 @@ class TestServerThread(threading.Thread):
         # Loop until we get a stop event.
         while not self._stopped:
             httpd.handle_request()
+
+class StubServerThread(threading.Thread):
+    """
+    Thread for running a stand-in http server that answers GETs for
+    known paths with canned (content type, body, delay in seconds)
+    responses, and counts the requests it has seen. A response may have
+    a fourth member, the seconds to wait between each byte of the body.
+    A response with no content type redirects to its body.
+    """
+    def __init__(self, address, port, responses):
+        self.responses = responses
+        self.requests = []
+        stub = self
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split('?')[0]
+                stub.requests.append(self.path)
+                if path not in stub.responses:
+                    self.send_error(404)
+                    return
+                response = stub.responses[path]
+                content_type, body, delay = response[:3]
+                time.sleep(delay)
+                if content_type is None:
+                    self.send_response(302)
+                    self.send_header('Location', body)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if len(response) > 3:
+                    for byte in body:
+                        self.wfile.write(byte)
+                        self.wfile.flush()
+                        time.sleep(response[3])
+                else:
+                    self.wfile.write(body)
+            def log_message(self, *args):
+                pass
+        class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+            daemon_threads = True
+            allow_reuse_address = True
+        self.httpd = Server((address, port), Handler)
+        super(StubServerThread, self).__init__()
+        self.daemon = True
+
+    def run(self):
+        self.httpd.serve_forever()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.join(5)
@@ -0,0 +1,185 @@
+import json
+from django.db import IntegrityError
+from django.http import HttpResponse
+from piston.utils import rc
+from piston.authentication import HttpBasicAuthentication
+from django.views.decorators.csrf import csrf_exempt
+from findcontext.main.models import Package
+from findcontext.main import services, uri_template, federation, suggestions
+from findcontext.main import search, gazetteer
+from handlers import bad_request
+import imports
+import paging
+
+authentication = HttpBasicAuthentication()
+
+def read_terms(request):
+    """
+    Returns the search terms for a request: the repeated term parameter
+    of a GET, or the body of a POST, either as a JSON list or as plain
+    text with one term per line.
+    """
+    if request.method == 'GET':
+        return request.GET.getlist('term')
+    data = request.raw_post_data
+    if request.META.get('CONTENT_TYPE', '').startswith('application/json'):
+        terms = json.loads(data)
+        if not isinstance(terms, list):
+            raise ValueError('Expected a JSON list of terms')
+        return [ unicode(term) for term in terms ]
+    return [ line.strip() for line in data.decode('utf-8').splitlines()
+             if line.strip() ]
+
+def link_rows(package, terms):
+    resources = [ r for r in package.resources
+                  if uri_template.compiles(r.template) ]
+    templates = [ r.template for r in resources ]
+    for term in terms:
+        uris = uri_template.expand_templates(
+            templates, { 'searchTerms': term.encode('utf-8') })
+        for resource, uri in zip(resources, uris):
+            yield json.dumps({ 'term': term, 'resource': resource.uri,
+                               'name': resource.name, 'uri': uri },
+                             separators=(',', ':')) + '\n'
+
+@csrf_exempt
+def query_links(request, id):
+    """
+    Streams newline-delimited JSON pairing each requested term with each
+    of a package's resources and the query URI for that term.
+    """
+    if request.method not in ('GET', 'POST'):
+        response = HttpResponse(status=405)
+        response['Allow'] = 'GET, POST'
+        return response
+    try:
+        terms = read_terms(request)
+    except (ValueError, UnicodeDecodeError) as e:
+        return bad_request(e)
+    try:
+        package = services.get_package(id)
+    except Package.DoesNotExist:
+        return rc.NOT_FOUND
+    return HttpResponse(link_rows(package, terms),
+                        mimetype='application/x-ndjson; charset=utf-8')
+
+def federated_search(request, id):
+    """
+    Searches all of a package's resources that return Atom or RSS
+    results for the q parameter, and returns the merged results as JSON.
+    """
+    if request.method != 'GET':
+        response = HttpResponse(status=405)
+        response['Allow'] = 'GET'
+        return response
+    query = request.GET.get('q', '').strip()
+    if not query:
+        return bad_request('Missing q parameter')
+    try:
+        package = services.get_package(id)
+    except Package.DoesNotExist:
+        return rc.NOT_FOUND
+    return HttpResponse(json.dumps(federation.search(package, query)),
+                        mimetype='application/json; charset=utf-8')
+
+def suggest(request, id):
+    """
+    Returns merged search suggestions for the q parameter from a
+    package's resources, in the OpenSearch suggestions format.
+    """
+    if request.method != 'GET':
+        response = HttpResponse(status=405)
+        response['Allow'] = 'GET'
+        return response
+    query = request.GET.get('q', '')
+    try:
+        package = services.get_package(id)
+    except Package.DoesNotExist:
+        return rc.NOT_FOUND
+    return HttpResponse(
+        json.dumps([ query, suggestions.suggest(package, query) ]),
+        mimetype='application/x-suggestions+json; charset=utf-8')
+
+def search_resources(request):
+    """
+    Searches the descriptions of all resources for the q parameter,
+    optionally filtered by facet values, and returns a page of matches
+    with facet counts as JSON.
+    """
+    if request.method != 'GET':
+        response = HttpResponse(status=405)
+        response['Allow'] = 'GET'
+        return response
+    try:
+        count = min(paging.positive_int(request, 'count', paging.PAGE_SIZE),
+                    paging.MAX_PAGE_SIZE)
+        start_index = paging.positive_int(request, 'startIndex', 1)
+    except ValueError as e:
+        return bad_request(e)
+    query = request.GET.get('q', '')
+    filters = dict([ (facet, request.GET[facet]) for facet in search.FACETS
+                     if request.GET.get(facet) ])
+    records, facets = search.search(query, filters)
+    return HttpResponse(json.dumps({
+                'query': query, 'totalResults': len(records),
+                'startIndex': start_index, 'itemsPerPage': count,
+                'results': records[start_index - 1:start_index - 1 + count],
+                'facets': facets }),
+                        mimetype='application/json; charset=utf-8')
+
+@csrf_exempt
+def spot(request, id):
+    """
+    Finds the package's gazetteer terms in a POSTed text, either a form
+    with a text field or the text itself, and returns each span found
+    with the query URIs for the term as JSON.
+    """
+    if request.method != 'POST':
+        response = HttpResponse(status=405)
+        response['Allow'] = 'POST'
+        return response
+    content_type = request.META.get('CONTENT_TYPE', '')
+    if content_type.startswith(('application/x-www-form-urlencoded',
+                                'multipart/form-data')):
+        text = request.POST.get('text', u'')
+    else:
+        try:
+            text = request.raw_post_data.decode('utf-8')
+        except UnicodeDecodeError as e:
+            return bad_request(e)
+    try:
+        spots = gazetteer.spot(id, text)
+    except Package.DoesNotExist:
+        return rc.NOT_FOUND
+    return HttpResponse(json.dumps({ 'spots': spots }),
+                        mimetype='application/json; charset=utf-8')
+
+@csrf_exempt
+def import_resources(request):
+    """
+    Creates resources from a POSTed Atom feed or archive of OpenSearch
+    descriptions, and returns a JSON report of what became of each one.
+    """
+    if not authentication.is_authenticated(request):
+        return authentication.challenge()
+    if request.method != 'POST':
+        response = HttpResponse(status=405)
+        response['Allow'] = 'POST'
+        return response
+    try:
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        length = 0
+    if length > imports.MAX_BYTES:
+        return HttpResponse('Request Entity Too Large', status=413)
+    try:
+        documents = imports.read_documents(
+            request.raw_post_data, request.META.get('CONTENT_TYPE', ''))
+    except ValueError as e:
+        return bad_request(e)
+    try:
+        report = imports.import_documents(documents)
+    except IntegrityError:
+        return rc.DUPLICATE_ENTRY
+    return HttpResponse(json.dumps(report),
+                        mimetype='application/json; charset=utf-8')
@@ -1,9 +1,16 @@
-from models import Resource, Package, LogRecord
+from models import Resource, Package, GazetteerTerm, LogRecord
 from django.contrib import admin
 
 class LogRecordAdmin(admin.ModelAdmin):
     list_display = ('timestamp', 'user', 'message')
 
+class GazetteerTermAdmin(admin.ModelAdmin):
+    list_display = ('term', 'package')
+    list_filter = ('package',)
+    search_fields = ('term',)
+    filter_horizontal = ('resources',)
+
 admin.site.register(Resource)
 admin.site.register(Package)
+admin.site.register(GazetteerTerm, GazetteerTermAdmin)
 admin.site.register(LogRecord, LogRecordAdmin)
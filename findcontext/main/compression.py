@@ -0,0 +1,104 @@
+import gzip
+import zlib
+from cStringIO import StringIO
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import patch_vary_headers
+
+COMPRESSION_LEVEL = getattr(settings, 'COMPRESSION_LEVEL', 6)
+
+# Bodies smaller than this aren't worth compressing
+MIN_LENGTH = 200
+
+ENCODINGS = ('gzip', 'deflate')
+
+def choose_encoding(request):
+    """
+    Returns the content-coding to use for a response to request, or None
+    if the client doesn't accept any compressed coding.
+
+    >>> from django.http import HttpRequest
+    >>> r = HttpRequest()
+    >>> r.META['HTTP_ACCEPT_ENCODING'] = 'deflate;q=0.5, gzip'
+    >>> choose_encoding(r)
+    'gzip'
+    >>> r.META['HTTP_ACCEPT_ENCODING'] = 'gzip;q=0, deflate'
+    >>> choose_encoding(r)
+    'deflate'
+    >>> r.META['HTTP_ACCEPT_ENCODING'] = 'identity'
+    >>> choose_encoding(r) is None
+    True
+    """
+    accepted = {}
+    for part in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        params = part.strip().split(';')
+        coding = params[0].strip().lower()
+        q = 1.0
+        for param in params[1:]:
+            name, _, value = param.strip().partition('=')
+            if name.strip() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+    best, best_q = None, 0.0
+    for coding in ENCODINGS:
+        q = accepted.get(coding, accepted.get('*', 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+def compress(content, encoding):
+    if encoding == 'gzip':
+        buf = StringIO()
+        f = gzip.GzipFile(mode='wb', compresslevel=COMPRESSION_LEVEL,
+                          fileobj=buf)
+        try:
+            f.write(content)
+        finally:
+            f.close()
+        return buf.getvalue()
+    if encoding == 'deflate':
+        return zlib.compress(content, COMPRESSION_LEVEL)
+    raise ValueError('Unknown content-coding: %s' % encoding)
+
+def compress_response(request, response, cache_key=None, 
+                      cache_seconds=None):
+    """
+    Compresses response in place using the best coding request accepts.
+    If cache_key is given, the compressed variant is stored under
+    cache_key plus the coding, and reused by later calls.
+    """
+    patch_vary_headers(response, ('Accept-Encoding',))
+    if (response.status_code != 200 or not response._is_string 
+        or response.has_header('Content-Encoding')):
+        return response
+    encoding = choose_encoding(request)
+    if encoding is None:
+        return response
+    content = None
+    if cache_key is not None:
+        variant_key = '%s.%s' % (cache_key, encoding)
+        content = cache.get(variant_key)
+    if content is None:
+        if len(response.content) < MIN_LENGTH:
+            return response
+        content = compress(response.content, encoding)
+        if cache_key is not None:
+            cache.set(variant_key, content, cache_seconds)
+    response.content = content
+    response['Content-Encoding'] = encoding
+    response['Content-Length'] = str(len(content))
+    return response
+
+def compressed(view):
+    """
+    Decorator that compresses a view's responses according to the
+    request's Accept-Encoding header.
+    """
+    def wrapper(request, *args, **kwargs):
+        return compress_response(request, view(request, *args, **kwargs))
+    wrapper.__name__ = view.__name__
+    wrapper.__doc__ = view.__doc__
+    return wrapper
@@ -0,0 +1,356 @@
+import hashlib
+import httplib
+import socket
+import ssl
+import struct
+import threading
+import time
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
+from urlparse import urljoin, urlsplit
+from django.conf import settings
+from django.core.cache import cache
+from lxml import etree
+import uri_template
+
+THREADS = getattr(settings, 'FEDERATED_SEARCH_THREADS', 10)
+TIMEOUT = getattr(settings, 'FEDERATED_SEARCH_TIMEOUT', 3)
+DEADLINE = getattr(settings, 'FEDERATED_SEARCH_DEADLINE', 5)
+CACHE_SECONDS = getattr(settings, 'FEDERATED_SEARCH_CACHE_SECONDS', 10 * 60)
+# Whether resources may point at loopback, private and other non-public
+# addresses. Off by default, since any visitor can make the server fetch
+# the URIs in any resource's description.
+ALLOW_PRIVATE_HOSTS = getattr(
+    settings, 'FEDERATED_SEARCH_ALLOW_PRIVATE_HOSTS', False)
+MAX_BYTES = getattr(settings, 'FEDERATED_SEARCH_MAX_BYTES', 1024 * 1024)
+MAX_REDIRECTS = 3
+HITS = 10
+
+ATOM_NS = 'http://www.w3.org/2005/Atom'
+OPENSEARCH_NAMESPACES = ('http://a9.com/-/spec/opensearch/1.1/',
+                         'http://a9.com/-/spec/opensearchrss/1.0/')
+
+# Created on first use, so processes that never search don't start threads
+_pool = None
+_pool_lock = threading.Lock()
+
+def pool():
+    global _pool
+    _pool_lock.acquire()
+    try:
+        if _pool is None:
+            _pool = ThreadPool(THREADS)
+        return _pool
+    finally:
+        _pool_lock.release()
+
+def total_results(element):
+    for ns in OPENSEARCH_NAMESPACES:
+        total = element.findtext('{%s}totalResults' % ns)
+        if total is not None:
+            try:
+                return int(total)
+            except ValueError:
+                return None
+    return None
+
+# Feeds come from anywhere, so entities and DTDs are never fetched
+parser = etree.XMLParser(resolve_entities=False, no_network=True,
+                         load_dtd=False)
+
+def parse_results(data):
+    """
+    Returns (total results, hits) for an Atom or RSS result feed. The
+    total comes from opensearch:totalResults, or is the number of
+    entries if that's missing; hits are {'title', 'link'} dicts.
+    """
+    root = etree.fromstring(data, parser)
+    hits = []
+    if root.tag == '{%s}feed' % ATOM_NS:
+        container = root
+        for entry in root.findall('{%s}entry' % ATOM_NS):
+            link = None
+            for l in entry.findall('{%s}link' % ATOM_NS):
+                if l.get('rel', 'alternate') == 'alternate':
+                    link = l.get('href')
+                    break
+            hits.append({ 'title': entry.findtext('{%s}title' % ATOM_NS),
+                          'link': link })
+    elif root.tag == 'rss' and root.find('channel') is not None:
+        container = root.find('channel')
+        for item in container.findall('item'):
+            hits.append({ 'title': item.findtext('title'),
+                          'link': item.findtext('link') })
+    else:
+        raise ValueError('Not an Atom or RSS feed')
+    total = total_results(container)
+    if total is None:
+        total = len(hits)
+    return total, hits[:HITS]
+
+# (network, prefix length) of the IPv4 and IPv6 ranges that aren't public
+PRIVATE_NETWORKS = {
+    socket.AF_INET: [ ('0.0.0.0', 8), ('10.0.0.0', 8), ('100.64.0.0', 10),
+                      ('127.0.0.0', 8), ('169.254.0.0', 16),
+                      ('172.16.0.0', 12), ('192.0.0.0', 24),
+                      ('192.168.0.0', 16), ('198.18.0.0', 15),
+                      ('224.0.0.0', 4), ('240.0.0.0', 4) ],
+    socket.AF_INET6: [ ('::', 127), ('::ffff:0:0', 96), ('64:ff9b::', 96),
+                       ('fc00::', 7), ('fe80::', 10), ('ff00::', 8) ],
+    }
+
+def address_number(family, address):
+    number = 0
+    for part in struct.unpack('!%dB' % (family == socket.AF_INET and 4 or 16),
+                              socket.inet_pton(family, address)):
+        number = (number << 8) | part
+    return number
+
+def is_public(family, address):
+    """
+    Returns whether an IP address is a public unicast one.
+    """
+    bits = family == socket.AF_INET and 32 or 128
+    number = address_number(family, address.split('%')[0])
+    for network, length in PRIVATE_NETWORKS[family]:
+        if (number >> (bits - length) ==
+            address_number(family, network) >> (bits - length)):
+            return False
+    return True
+
+def check_uri(uri):
+    """
+    Returns (scheme, host, port, path, addresses) for an http or https
+    URI, where addresses are the (family, sockaddr) pairs of its host,
+    or raises IOError if it isn't one or, unless ALLOW_PRIVATE_HOSTS is
+    set, if its host has an address that isn't public.
+    """
+    parts = urlsplit(uri)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise IOError('Not an http or https URI: %s' % uri)
+    port = parts.port or (parts.scheme == 'https' and 443 or 80)
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+    addresses = []
+    for family, type, proto, name, sockaddr in socket.getaddrinfo(
+        parts.hostname, port, 0, socket.SOCK_STREAM):
+        if not (ALLOW_PRIVATE_HOSTS or is_public(family, sockaddr[0])):
+            raise IOError('Not a public address: %s' % parts.hostname)
+        addresses.append((family, sockaddr))
+    return parts.scheme, parts.hostname, port, path, addresses
+
+def connect_to(addresses, timeout):
+    """
+    Returns a socket connected to the first of addresses that answers.
+    """
+    error = socket.error('No addresses')
+    for family, sockaddr in addresses:
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(sockaddr)
+            return sock
+        except socket.error, e:
+            error = e
+            sock.close()
+    raise error
+
+class PinnedHTTPConnection(httplib.HTTPConnection):
+    """
+    An HTTPConnection to addresses that check_uri has already vetted,
+    so that the host can't be looked up again to a different address
+    between the check and the connection.
+    """
+    def __init__(self, host, port, addresses, timeout):
+        httplib.HTTPConnection.__init__(self, host, port, timeout=timeout)
+        self.addresses = addresses
+
+    def connect(self):
+        self.sock = connect_to(self.addresses, self.timeout)
+
+class PinnedHTTPSConnection(httplib.HTTPSConnection):
+    """
+    An HTTPSConnection to addresses that check_uri has already vetted.
+    """
+    def __init__(self, host, port, addresses, timeout):
+        httplib.HTTPSConnection.__init__(self, host, port, timeout=timeout)
+        self.addresses = addresses
+
+    def connect(self):
+        sock = connect_to(self.addresses, self.timeout)
+        if hasattr(self, '_context'): # 2.7.9 and later check certificates
+            self.sock = self._context.wrap_socket(sock,
+                                                  server_hostname=self.host)
+        else:
+            self.sock = ssl.wrap_socket(sock, self.key_file, self.cert_file)
+
+class Fetch(object):
+    """
+    A GET of a URI that is cut off after timeout seconds however slowly
+    the server answers, or sooner if another thread aborts it, so that
+    slow servers can't hold pool threads.
+    """
+    def __init__(self, uri, timeout):
+        self.uri = uri
+        self.timeout = timeout
+        self.aborted = False
+        self.sock = None
+        self._lock = threading.Lock()
+
+    def abort(self):
+        self._lock.acquire()
+        try:
+            self.aborted = True
+            sock = self.sock
+        finally:
+            self._lock.release()
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR) # wakes up a blocked read
+            except socket.error:
+                pass
+
+    def connect(self, scheme, host, port, addresses):
+        if scheme == 'https':
+            connection = PinnedHTTPSConnection(host, port, addresses,
+                                               self.timeout)
+        else:
+            connection = PinnedHTTPConnection(host, port, addresses,
+                                              self.timeout)
+        connection.connect()
+        # The underlying socket is kept, since the connection closes its
+        # socket object once the response has arrived, while the
+        # response goes on reading from the underlying one
+        self._lock.acquire()
+        try:
+            self.sock = getattr(connection.sock, '_sock', connection.sock)
+            aborted = self.aborted
+        finally:
+            self._lock.release()
+        if aborted:
+            connection.close()
+            raise socket.timeout('Timed out')
+        return connection
+
+    def read(self):
+        """
+        Returns the body of the response, following redirects. Raises
+        socket.timeout if the fetch is cut off, and IOError or
+        socket.error if it fails.
+        """
+        timer = threading.Timer(self.timeout, self.abort)
+        timer.setDaemon(True)
+        timer.start()
+        try:
+            uri = self.uri
+            for i in range(MAX_REDIRECTS + 1):
+                scheme, host, port, path, addresses = check_uri(uri)
+                connection = self.connect(scheme, host, port, addresses)
+                try:
+                    connection.request('GET', path)
+                    response = connection.getresponse()
+                    location = response.getheader('Location')
+                    if response.status in (301, 302, 303, 307) and location:
+                        uri = urljoin(uri, location)
+                        continue
+                    if response.status != 200:
+                        raise IOError('HTTP status %d' % response.status)
+                    data = response.read(MAX_BYTES + 1)
+                except (httplib.HTTPException, socket.error):
+                    if self.aborted:
+                        raise socket.timeout('Timed out')
+                    raise
+                finally:
+                    connection.close()
+                if self.aborted:
+                    raise socket.timeout('Timed out')
+                if len(data) > MAX_BYTES:
+                    raise IOError('Response is over %d bytes' % MAX_BYTES)
+                return data
+            raise IOError('Too many redirects')
+        finally:
+            timer.cancel()
+
+def fetch(request):
+    """
+    Fetches and parses one resource's results. Runs on a pool thread.
+    """
+    return parse_results(request.read())
+
+def cache_key(resource, query):
+    return 'findcontext.federated.%s' % hashlib.md5(repr(
+            (resource.id, resource.feed_template, query))).hexdigest()
+
+def merge_hits(results, limit=HITS):
+    """
+    Interleaves the hits of each resource by rank.
+    """
+    lists = [ r['hits'] for r in results if r['status'] == 'ok' ]
+    merged = []
+    for rank in range(limit):
+        for hits in lists:
+            if rank < len(hits):
+                merged.append(hits[rank])
+    return merged[:limit]
+
+def search(package, query, timeout=None, deadline=None):
+    """
+    Queries every resource of a package record that has an Atom or RSS
+    Url concurrently, giving each at most timeout seconds and the whole
+    search at most deadline seconds, after which any unfinished requests
+    are aborted. Results are cached per resource and query. Returns a
+    dict with the summed totalResults, the merged top hits, and one
+    result per resource whose status is 'ok', 'error', 'timeout' or
+    'unsupported'.
+    """
+    if timeout is None:
+        timeout = TIMEOUT
+    if deadline is None:
+        deadline = DEADLINE
+    stop = time.time() + deadline
+    results = []
+    for resource in package.resources:
+        results.append({ 'resource': resource.uri, 'name': resource.name,
+                         'status': 'unsupported', 'totalResults': None,
+                         'hits': [] })
+    searchable = []
+    for i, resource in enumerate(package.resources):
+        if resource.feed_template is None:
+            continue
+        if uri_template.compiles(resource.feed_template):
+            searchable.append((i, resource))
+        else:
+            results[i]['status'] = 'error'
+    keys = dict([ (i, cache_key(r, query)) for i, r in searchable ])
+    cached = cache.get_many(keys.values())
+    uncached = []
+    for i, resource in searchable:
+        if keys[i] in cached:
+            total, hits = cached[keys[i]]
+            results[i].update(status='ok', totalResults=total, hits=hits)
+        else:
+            uncached.append((i, resource))
+    uris = uri_template.expand_templates(
+        [ r.feed_template for i, r in uncached ],
+        { 'searchTerms': query.encode('utf-8') })
+    requests = [ Fetch(uri, timeout) for uri in uris ]
+    pending = [ (i, request, pool().apply_async(fetch, (request,)))
+                for (i, r), request in zip(uncached, requests) ]
+    for i, request, async_result in pending:
+        try:
+            total, hits = async_result.get(max(0, stop - time.time()))
+        except (TimeoutError, socket.timeout):
+            request.abort() # frees the pool thread
+            results[i]['status'] = 'timeout'
+            continue
+        except Exception:
+            results[i]['status'] = 'error'
+            continue
+        cache.set(keys[i], (total, hits), CACHE_SECONDS)
+        results[i].update(status='ok', totalResults=total, hits=hits)
+    return { 'query': query,
+             'totalResults': sum([ r['totalResults'] for r in results
+                                   if r['totalResults'] is not None ]),
+             'hits': merge_hits(results),
+             'resources': results }
@@ -0,0 +1,195 @@
+import re
+from collections import deque
+from django.conf import settings
+from lru import LRUCache
+from models import Package, GazetteerTerm
+import loaders
+import services
+import uri_template
+
+# (version, Gazetteer), keyed by package id
+gazetteers = LRUCache(getattr(settings, 'GAZETTEER_CACHE_SIZE', 100))
+
+word_character = re.compile(r'\w', re.UNICODE)
+whitespace = re.compile(r'\s', re.UNICODE)
+
+def fold(text):
+    """
+    Lower-cases text and turns whitespace into spaces without changing
+    its length, so that offsets into the folded text are offsets into
+    the original.
+
+    >>> fold(u'County\\nCORK')
+    u'county cork'
+    """
+    folded = whitespace.sub(u' ', text.lower())
+    if len(folded) == len(text):
+        return folded
+    return u''.join([ len(c.lower()) == 1 and c.lower() or c
+                      for c in whitespace.sub(u' ', text) ])
+
+def normalize(term):
+    return u' '.join(fold(term).split())
+
+class Automaton(object):
+    """
+    An Aho-Corasick automaton that finds every occurrence of a set of
+    terms in one pass over a text, however many terms there are.
+
+    >>> a = Automaton([ (u'he', 1), (u'she', 2), (u'hers', 3) ])
+    >>> list(a.find(u'Ushers'))
+    [(1, 4, 2), (2, 4, 1), (2, 6, 3)]
+    """
+    def __init__(self, terms):
+        self.goto = [ {} ]
+        self.fail = [ 0 ]
+        self.output = [ () ] # (length, value) of the terms ending here
+        for term, value in terms:
+            term = normalize(term)
+            if not term:
+                continue
+            state = 0
+            for c in term:
+                next = self.goto[state].get(c)
+                if next is None:
+                    next = len(self.goto)
+                    self.goto[state][c] = next
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(())
+                state = next
+            self.output[state] += ((len(term), value),)
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for c, next in self.goto[state].items():
+                queue.append(next)
+                fail = self.fail[state]
+                while fail and c not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[next] = self.goto[fail].get(c, 0)
+                self.output[next] += self.output[self.fail[next]]
+
+    def find(self, text):
+        """
+        Yields (start, end, value) for every occurrence of a term in
+        text, in order of end.
+        """
+        goto, fail, output = self.goto, self.fail, self.output
+        state = 0
+        for i, c in enumerate(fold(text)):
+            while state and c not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(c, 0)
+            for length, value in output[state]:
+                yield (i + 1 - length, i + 1, value)
+
+def is_word(text, start, end):
+    return ((start == 0 or not word_character.match(text[start - 1])) and
+            (end == len(text) or not word_character.match(text[end])))
+
+class Gazetteer(object):
+    """
+    A package record with an automaton over its gazetteer terms.
+    """
+    def __init__(self, package, terms):
+        """
+        terms is a list of (term, resource ids) pairs; an empty list of
+        resource ids stands for all of the package's resources.
+        """
+        self.package = package
+        indexes = dict([ (r.id, i) for i, r in enumerate(package.resources) ])
+        everything = range(len(package.resources))
+        merged = {}
+        for term, resource_ids in terms:
+            key = normalize(term)
+            if resource_ids:
+                matched = [ indexes[id] for id in resource_ids if id in indexes ]
+                if not matched:
+                    continue
+            else:
+                matched = everything
+            if key not in merged:
+                merged[key] = (term, set())
+            merged[key][1].update(matched)
+        self.terms = [ (term, sorted(matched))
+                       for term, matched in merged.values() ]
+        self.automaton = Automaton([ (term, i) for i, (term, matched)
+                                     in enumerate(self.terms) ])
+
+    def spans(self, text):
+        """
+        Returns (start, end, term index) for the terms found in text as
+        whole words, preferring the leftmost and then the longest where
+        they overlap.
+        """
+        found = [ m for m in self.automaton.find(text)
+                  if is_word(text, m[0], m[1]) ]
+        found.sort(key=lambda m: (m[0], -m[1]))
+        spans = []
+        end = 0
+        for start, stop, value in found:
+            if start >= end:
+                spans.append((start, stop, value))
+                end = stop
+        return spans
+
+    def spot(self, text):
+        """
+        Returns a dict for each term found in text, with its span and
+        the query URI for the term at each of its resources whose
+        template can be expanded.
+        """
+        resources = self.package.resources
+        links = {}
+        spots = []
+        for start, end, value in self.spans(text):
+            term, matched = self.terms[value]
+            if value not in links:
+                matched = [ i for i in matched
+                            if uri_template.compiles(resources[i].template) ]
+                uris = uri_template.expand_templates(
+                    [ resources[i].template for i in matched ],
+                    { 'searchTerms': term.encode('utf-8') })
+                links[value] = [
+                    { 'resource': resources[i].uri,
+                      'name': resources[i].name, 'uri': uri }
+                    for i, uri in zip(matched, uris) ]
+            spots.append({ 'start': start, 'end': end,
+                           'text': text[start:end], 'term': term,
+                           'resources': links[value] })
+        return spots
+
+def load_terms(id):
+    """
+    Fetches a package's terms with the ids of their resources, in two
+    queries.
+    """
+    terms = GazetteerTerm.objects.filter(package=id).values_list('id', 'term')
+    links = GazetteerTerm.resources.through.objects.filter(
+        gazetteerterm__package=id).values_list('gazetteerterm', 'resource')
+    resource_ids = {}
+    for term_id, resource_id in links:
+        resource_ids.setdefault(term_id, []).append(resource_id)
+    return [ (term, resource_ids.get(term_id, [])) for term_id, term in terms ]
+
+def get_gazetteer(id):
+    """
+    Returns the Gazetteer for a package, building it only when the
+    package, its resources or its terms have changed. Raises
+    Package.DoesNotExist.
+    """
+    version = loaders.package_version(id)
+    if version is None:
+        raise Package.DoesNotExist
+    id = int(id)
+    version = (version, loaders.gazetteer_version(id))
+    cached = gazetteers.get(id)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    gazetteer = Gazetteer(services.get_package(id), load_terms(id))
+    gazetteers.set(id, (version, gazetteer))
+    return gazetteer
+
+def spot(id, text):
+    return get_gazetteer(id).spot(text)
@@ -0,0 +1,102 @@
+import hashlib
+from django.db.models import Max, Count
+from models import Resource, Package, GazetteerTerm
+
+def load_package(id):
+    """
+    Fetches a package together with all of its resources, in two queries
+    no matter how many resources the package has. The resources are
+    left in package.loaded_resources.
+    """
+    package = Package.objects.only(
+        'id', 'name', 'description', 'last_updated').get(pk=id)
+    package.loaded_resources = list(package.resources.all())
+    return package
+
+def load_packages(columns=None):
+    """
+    Fetches every package in one query. If columns are given only those
+    are selected; otherwise each package's owner is joined in.
+    """
+    if columns:
+        return Package.objects.only(*columns)
+    return Package.objects.select_related('owner')
+
+def load_resources(ids=None):
+    """
+    Fetches every resource, or those with the given ids, in one query.
+    """
+    if ids is None:
+        return Resource.objects.all()
+    return Resource.objects.filter(pk__in=ids)
+
+def resource_stamps():
+    """
+    Returns a dict mapping the id of every resource to when it was last
+    modified, in one query.
+    """
+    return dict(Resource.objects.values_list('id', 'last_updated'))
+
+def resource_state(id):
+    """
+    Returns (last modified, description source) for a resource, or None
+    if there is no such resource.
+    """
+    field = Resource._meta.get_field('open_search_description')
+    try:
+        return tuple(Resource.objects.filter(pk=id).extra(
+                select={ 'source': field.text_sql() }).values_list(
+                'last_updated', 'source')[0])
+    except (IndexError, ValueError):
+        return None
+
+def resource_version(id=None, state=None):
+    """
+    Returns (last modified, *details) for a single resource, or for the
+    whole catalog if no id is given, or None if there is no such
+    resource. A resource's details include a digest of its description,
+    so that writes within the precision of the timestamp still change
+    its version. Its state may be passed in if it has already been
+    fetched with resource_state().
+    """
+    if id is None:
+        version = Resource.objects.aggregate(Max('last_updated'), Count('id'))
+        return (version['last_updated__max'], version['id__count'])
+    if state is None:
+        state = resource_state(id)
+        if state is None:
+            return None
+    updated, source = state
+    if isinstance(source, unicode):
+        source = source.encode('utf-8')
+    return (updated, int(id), hashlib.sha1(source).hexdigest())
+
+def package_version(id=None):
+    """
+    Returns (last modified, *details) for a package and its resources, or
+    for the list of packages if no id is given, or None if there is no
+    such package.
+    """
+    if id is None:
+        version = Package.objects.aggregate(Max('last_updated'), Count('id'))
+        return (version['last_updated__max'], version['id__count'])
+    try:
+        updated, resources_updated, count = Package.objects.filter(
+            pk=id).annotate(Max('resources__last_updated'),
+                            Count('resources')).values_list(
+            'last_updated', 'resources__last_updated__max',
+            'resources__count')[0]
+    except (IndexError, ValueError):
+        return None
+    return (max(updated, resources_updated or updated), resources_updated,
+            count)
+
+def gazetteer_version(id):
+    """
+    Returns (last modified, count) for a package's gazetteer terms. A
+    term's last_updated is bumped when its resources change, so this
+    covers them too.
+    """
+    version = GazetteerTerm.objects.filter(package=id).aggregate(
+        Max('last_updated'), Count('id'))
+    return (version['last_updated__max'], version['id__count'])
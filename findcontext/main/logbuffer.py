@@ -0,0 +1,135 @@
+import atexit
+import logging
+import threading
+from datetime import datetime
+from django.conf import settings
+from django.db import connection, transaction
+from models import LogRecord
+import ranking
+
+# Records are written once this many have been collected, or once the
+# oldest has waited this many seconds, whichever comes first.
+SIZE = getattr(settings, 'LOG_BUFFER_SIZE', 100)
+SECONDS = getattr(settings, 'LOG_BUFFER_SECONDS', 5)
+# Records kept while the database can't be written to; older ones are
+# dropped beyond this.
+MAX_PENDING = getattr(settings, 'LOG_BUFFER_MAX_PENDING', 10000)
+# Most rows in one INSERT, keeping under SQLite's limit of 999 parameters
+ROWS_PER_INSERT = 300
+
+log = logging.getLogger(__name__)
+
+def insert(rows):
+    """
+    Inserts (user id, message, timestamp) rows into the log with one
+    multi-row INSERT per ROWS_PER_INSERT rows.
+    """
+    meta = LogRecord._meta
+    qn = connection.ops.quote_name
+    columns = [ qn(meta.get_field(name).column)
+                for name in ('user', 'message', 'timestamp') ]
+    cursor = connection.cursor()
+    for start in range(0, len(rows), ROWS_PER_INSERT):
+        chunk = rows[start:start + ROWS_PER_INSERT]
+        sql = 'INSERT INTO %s (%s) VALUES %s' % (
+            qn(meta.db_table), ', '.join(columns),
+            ', '.join([ '(%s, %s, %s)' ] * len(chunk)))
+        params = []
+        for user_id, message, timestamp in chunk:
+            params.extend((user_id, message,
+                           connection.ops.value_to_db_datetime(timestamp)))
+        cursor.execute(sql, params)
+    transaction.commit_unless_managed()
+
+class LogBuffer(object):
+    """
+    Collects log records in memory and writes them to the database in
+    bulk, so that a busy client costs one write every few seconds
+    rather than one per message.
+    """
+    def __init__(self, size=None, seconds=None):
+        self.size = size or SIZE
+        self.seconds = seconds or SECONDS
+        self.rows = []
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def __len__(self):
+        return len(self.rows)
+
+    def add(self, user, messages):
+        """
+        Buffers one or more messages from a user, timestamped now. If
+        this fills the buffer it is flushed; a failure to write is logged
+        rather than raised, since the records are kept for a later flush.
+        """
+        if isinstance(messages, basestring):
+            messages = [ messages ]
+        now = datetime.now()
+        self._lock.acquire()
+        try:
+            self.rows.extend([ (user.id, m, now) for m in messages ])
+            full = len(self.rows) >= self.size
+            if not full:
+                self._schedule()
+        finally:
+            self._lock.release()
+        if full:
+            try:
+                self.flush()
+            except Exception:
+                log.exception('Could not write log records')
+
+    def _schedule(self):
+        # called with the lock held
+        if self._timer is None:
+            self._timer = threading.Timer(self.seconds, self._timed_flush)
+            self._timer.setDaemon(True)
+            self._timer.start()
+
+    def flush(self):
+        """
+        Writes the buffered records and returns how many there were. If
+        the write fails they are kept and another flush is scheduled
+        before the error is raised. Click tallies already in use for
+        ranking are brought up to date.
+        """
+        self._lock.acquire()
+        try:
+            rows, self.rows = self.rows, []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        finally:
+            self._lock.release()
+        if not rows:
+            return 0
+        try:
+            insert(rows)
+        except Exception:
+            transaction.rollback_unless_managed()
+            self._lock.acquire()
+            try:
+                self.rows[:0] = rows
+                del self.rows[:-MAX_PENDING]
+                self._schedule()
+            finally:
+                self._lock.release()
+            raise
+        if ranking.clicks.refreshed is not None:
+            try:
+                ranking.clicks.refresh()
+            except Exception:
+                log.exception('Could not refresh click tallies')
+        return len(rows)
+
+    def _timed_flush(self):
+        try:
+            self.flush()
+        except Exception:
+            log.exception('Could not write log records')
+        finally:
+            connection.close() # this thread's connection
+
+buffer = LogBuffer()
+atexit.register(buffer.flush)
@@ -0,0 +1,95 @@
+import threading
+
+class LRUCache(object):
+    """
+    A thread-safe, size-bounded mapping that evicts the least recently
+    used entry when full, and keeps hit/miss counters.
+
+    >>> c = LRUCache(2)
+    >>> c.set('a', 1)
+    >>> c.set('b', 2)
+    >>> c.get('a')
+    1
+    >>> c.set('c', 3)
+    >>> c.get('b') is None
+    True
+    >>> c.get('c')
+    3
+    >>> sorted(c.stats().items())
+    [('hits', 2), ('maxsize', 2), ('misses', 1), ('size', 2)]
+    >>> c.discard('c')
+    >>> len(c)
+    1
+    """
+    # Links are [prev, next, key, value] lists in a circular list
+    # around self._root, most recently used at the front.
+    PREV, NEXT, KEY, VALUE = 0, 1, 2, 3
+
+    def __init__(self, maxsize=1000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._links = {}
+        self._root = []
+        self._root[:] = [self._root, self._root, None, None]
+    def __len__(self):
+        return len(self._links)
+    def _unlink(self, link):
+        link[self.PREV][self.NEXT] = link[self.NEXT]
+        link[self.NEXT][self.PREV] = link[self.PREV]
+    def _push_front(self, link):
+        first = self._root[self.NEXT]
+        link[self.PREV] = self._root
+        link[self.NEXT] = first
+        first[self.PREV] = link
+        self._root[self.NEXT] = link
+    def get(self, key, default=None):
+        self._lock.acquire()
+        try:
+            link = self._links.get(key)
+            if link is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._unlink(link)
+            self._push_front(link)
+            return link[self.VALUE]
+        finally:
+            self._lock.release()
+    def set(self, key, value):
+        self._lock.acquire()
+        try:
+            link = self._links.get(key)
+            if link is not None:
+                link[self.VALUE] = value
+                self._unlink(link)
+            else:
+                if len(self._links) >= self.maxsize:
+                    oldest = self._root[self.PREV]
+                    self._unlink(oldest)
+                    del self._links[oldest[self.KEY]]
+                link = [None, None, key, value]
+                self._links[key] = link
+            self._push_front(link)
+        finally:
+            self._lock.release()
+    def discard(self, key):
+        self._lock.acquire()
+        try:
+            link = self._links.pop(key, None)
+            if link is not None:
+                self._unlink(link)
+        finally:
+            self._lock.release()
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._links.clear()
+            self._root[:] = [self._root, self._root, None, None]
+            self.hits = self.misses = 0
+        finally:
+            self._lock.release()
+    def stats(self):
+        return { 'hits': self.hits, 'misses': self.misses,
+                 'size': len(self._links), 'maxsize': self.maxsize }
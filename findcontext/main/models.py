@@ -1,13 +1,53 @@
 # -*- coding: utf-8 -*-
 
+import codecs
+import re
+from datetime import datetime
 from django import forms
-from django.db import models, transaction
+from django.conf import settings
+from django.db import connection, models, transaction, IntegrityError
+from django.db.models.signals import post_save, m2m_changed
 from django.contrib.auth.models import User
-from django.contrib.sites.models import Site
 from django.utils.safestring import mark_safe
 from django.utils.html import conditional_escape
 from django.utils.encoding import force_unicode
 from lxml import etree
+from lru import LRUCache
+import uris
+
+OPENSEARCH_NS = 'http://a9.com/-/spec/opensearch/1.1/'
+
+# Parsed OpenSearch description trees, shared by all Resource instances
+parsed_osds = LRUCache(getattr(settings, 'OSD_CACHE_SIZE', 1000))
+
+xml_declaration = re.compile(r'^\s*<\?xml[^>]*\?>\s*')
+
+def xml_source(data, tree):
+    """
+    Returns the text of a UTF-8 or ASCII XML document as it should be
+    stored: unchanged apart from its XML declaration and any byte order
+    mark. Documents in other encodings are serialized from their tree.
+    """
+    encoding = (tree.getroottree().docinfo.encoding or 'UTF-8').upper()
+    if encoding not in ('UTF-8', 'ASCII', 'US-ASCII'):
+        return etree.tostring(tree, encoding=unicode)
+    if data.startswith(codecs.BOM_UTF8):
+        data = data[len(codecs.BOM_UTF8):]
+    return xml_declaration.sub('', data, 1).decode('utf-8')
+
+def in_savepoint(func, *args, **kwargs):
+    """
+    Calls func, rolling back to a savepoint if it raises IntegrityError
+    so that the surrounding transaction can carry on.
+    """
+    sid = transaction.savepoint()
+    try:
+        result = func(*args, **kwargs)
+    except IntegrityError:
+        transaction.savepoint_rollback(sid)
+        raise
+    transaction.savepoint_commit(sid)
+    return result
 
 class XMLWidget(forms.Textarea):
     def _format_value(self, value):
@@ -25,14 +65,76 @@ class XMLWidget(forms.Textarea):
                 forms.util.flatatt(final_attrs),
                 conditional_escape(force_unicode(self._format_value(value)))))
 
+class ElementDescriptor(object):
+    """
+    Holds the raw XML for an ElementField as loaded from the database
+    and only parses it the first time it is read.
+    """
+    def __init__(self, field):
+        self.field = field
+    def __get__(self, obj, type=None):
+        if obj is None:
+            return self
+        value = obj.__dict__[self.field.name]
+        if isinstance(value, basestring):
+            value = self.field.parse(obj, value)
+            obj.__dict__[self.field.name] = value
+        return value
+    def __set__(self, obj, value):
+        obj.__dict__[self.field.name] = value
+        obj.__dict__.pop(self.field.source_key, None)
+
 class ElementField(models.Field):
+    """
+    A parsed XML document or fragment.
+
+    Parsed trees are shared between model instances through a
+    process-wide LRU cache keyed by primary key and checked against the
+    instance's last_updated value and source text. Trees handed out by
+    the cache must be treated as read-only; copy them before changing
+    or re-parenting them.
+    """
     description = 'A parsed XML document or fragment'
-    __metaclass__ = models.SubfieldBase
     def __init__(self, *args, **kwargs):
         #kwargs['editable'] = False
+        self.cache = kwargs.pop('cache', None)
         super(ElementField, self).__init__(*args, **kwargs)
+    def contribute_to_class(self, cls, name):
+        super(ElementField, self).contribute_to_class(cls, name)
+        self.source_key = '_%s_source' % self.name
+        setattr(cls, self.name, ElementDescriptor(self))
+    def text_sql(self):
+        """
+        Returns SQL for the field's source text. PostgreSQL's xml type has
+        no equality operator, so the column is only compared as text.
+        """
+        return 'CAST(%s AS text)' % connection.ops.quote_name(self.column)
+    def set_source(self, obj, tree, source):
+        """
+        Sets the field to a tree parsed from source text, which is stored
+        instead of serializing the tree again.
+        """
+        obj.__dict__[self.name] = tree
+        obj.__dict__[self.source_key] = source
+    def pre_save(self, obj, add):
+        source = obj.__dict__.get(self.source_key)
+        if source is not None:
+            return source
+        return super(ElementField, self).pre_save(obj, add)
     def db_type(self):
         return 'xml'
+    def parse(self, obj, value):
+        if len(value) == 0:
+            return None
+        if self.cache is None or obj.pk is None:
+            return etree.fromstring(value)
+        version = getattr(obj, 'last_updated', None)
+        cached = self.cache.get(obj.pk)
+        if cached is not None and cached[0] == version and cached[1] == value:
+            return cached[2]
+        tree = etree.fromstring(value)
+        self.cache.set(obj.pk, (version, value, tree))
+        return tree
     def to_python(self, value):
         if isinstance(value, etree._Element):
             return value
@@ -42,6 +144,8 @@ class ElementField(models.Field):
             return None
         return etree.fromstring(value)
     def get_db_prep_value(self, value):
+        if isinstance(value, basestring):
+            return value
         return etree.tostring(value)
     def value_to_string(self, obj):
         value = self._get_val_from_obj(obj)
@@ -116,38 +220,127 @@ class Resource(models.Model):
     >>> r.delete()
     >>> r3.delete()
     """
-    open_search_description = ElementField()
+    open_search_description = ElementField(cache=parsed_osds)
     _short_name = models.CharField(max_length=36, unique=True, editable=False, db_column='short_name')
     last_updated = models.DateTimeField(auto_now=True, editable=False)
-    _derived_attributes = set()
     @classmethod
     def get(cls, short_name):
         return Resource.objects.get(_short_name__exact=short_name)
+    @classmethod
+    def from_xml(cls, data, tree=None):
+        """
+        Returns an unsaved resource for an OpenSearch description given
+        as bytes, parsing them only if their tree isn't given. Saving it
+        stores the original text and puts the tree in the parse cache,
+        so the tree must not be changed after this.
+        """
+        if tree is None:
+            tree = etree.fromstring(data)
+        resource = cls()
+        cls._meta.get_field('open_search_description').set_source(
+            resource, tree, xml_source(data, tree))
+        return resource
     def get_open_search_value(self, ns, key):
+        if ns == OPENSEARCH_NS:
+            return self.get_open_search_values().get(key)
         child = self.open_search_description.find('{%s}%s' % (ns, key))
         if child is None:
             return None
         return child.text
+    def get_open_search_values(self):
+        """
+        Returns a dict of the text values of the top-level elements in the
+        OpenSearch namespace, extracted in a single pass over the tree the
+        first time it is needed.
+        """
+        values = self.__dict__.get('_open_search_values')
+        if values is None:
+            values = {}
+            prefix = '{%s}' % OPENSEARCH_NS
+            for child in self.open_search_description:
+                tag = child.tag
+                if isinstance(tag, basestring) and tag.startswith(prefix):
+                    values.setdefault(tag[len(prefix):], child.text)
+            self.__dict__['_open_search_values'] = values
+        return values
     def save(self, *args, **kwargs):
+        self.__dict__.pop('_open_search_values', None)
         self._short_name = self.short_name
+        parsed_osds.discard(self.pk)
         super(Resource, self).save(*args, **kwargs)
+        field = self._meta.get_field('open_search_description')
+        source = self.__dict__.pop(field.source_key, None)
+        if source is not None:
+            parsed_osds.set(self.pk, (self.last_updated, source,
+                                      self.open_search_description))
+    def insert(self):
+        """
+        Saves this resource as a new row in a single INSERT. Raises
+        IntegrityError if its short name is taken.
+        """
+        in_savepoint(self.save, force_insert=True)
+    def replace(self, previous=None, **conditions):
+        """
+        Overwrites the stored description of the resource with this one's
+        id, or of the resource matching conditions if this one has no id,
+        in a single UPDATE that only applies if the row also matches
+        conditions and, if given, still has the previous description
+        source. Returns whether a row was updated, in which case this
+        resource takes its id and last_updated, and the parse cache and
+        post_save listeners are updated as by save(). Raises
+        IntegrityError if the short name belongs to another resource.
+        """
+        field = self._meta.get_field('open_search_description')
+        source = self.__dict__.get(field.source_key)
+        if source is None:
+            source = field.get_db_prep_value(self.open_search_description)
+        if self.pk is not None:
+            conditions['pk'] = self.pk
+        rows = Resource.objects.filter(**conditions)
+        if previous is not None:
+            rows = rows.extra(where=[ '%s = %%s' % field.text_sql() ],
+                              params=[ previous ])
+        self._short_name = self.short_name
+        now = datetime.now()
+        updated = in_savepoint(
+            rows.update,
+            open_search_description=source, _short_name=self._short_name,
+            last_updated=now)
+        if not updated:
+            return False
+        if self.pk is None:
+            ids = list(Resource.objects.filter(
+                    _short_name=self._short_name).values_list('id', flat=True))
+            if not ids:
+                return True # deleted since
+            self.pk = ids[0]
+        self.last_updated = now
+        self.__dict__.pop(field.source_key, None)
+        parsed_osds.set(self.pk, (now, source, self.open_search_description))
+        post_save.send(sender=Resource, instance=self, created=False)
+        return True
+    def delete(self, *args, **kwargs):
+        parsed_osds.discard(self.pk)
+        super(Resource, self).delete(*args, **kwargs)
     def get_absolute_url(self):
         return '/api/resource/%i' % self.id
     def _get_uri(self):
-        return 'http://%s%s' % (Site.objects.get_current().domain,
-                                self.get_absolute_url())
+        return uris.absolute_uri(self.get_absolute_url())
     uri = property(_get_uri)
     def __getattr__(self, key):
+        if key.startswith('_'):
+            raise AttributeError("'Resource' object has no attribute '%s'" % key)
         camel_key = ''.join([ s.capitalize() for s in key.split('_') ])
-        value = self.get_open_search_value(
-            'http://a9.com/-/spec/opensearch/1.1/', camel_key)
+        value = self.get_open_search_values().get(camel_key)
         if value is None:
             raise AttributeError("'Resource' object has no attribute '%s'" % key)
-        self._derived_attributes.add(key)
+        self.__dict__.setdefault('_derived_attributes', set()).add(key)
         return value
     def __setattr__(self, key, value):
-        if key in self._derived_attributes:
+        if key in self.__dict__.get('_derived_attributes', ()):
             raise AttributeError("'%s' attribute on 'Resource' object is read-only" % key)
+        if key == 'open_search_description':
+            self.__dict__.pop('_open_search_values', None)
         super(Resource, self).__setattr__(key, value)
     def __unicode__(self):
         return self.short_name
@@ -161,12 +354,59 @@ class Package(models.Model):
     def get_absolute_url(self):
         return '/api/package/%i' % self.id
     def _get_uri(self):
-        return 'http://%s%s' % (Site.objects.get_current().domain,
-                                self.get_absolute_url())
+        return uris.absolute_uri(self.get_absolute_url())
     uri = property(_get_uri)
     def __unicode__(self):
         return self.name
 
+def touch_owners(sender, instance, action, reverse, model, pk_set, **kwargs):
+    """
+    Bumps last_updated on the owners of a resources relation when its
+    members change, so that versions derived from it change too.
+    """
+    now = datetime.now()
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            type(instance).objects.filter(pk=instance.pk).update(
+                last_updated=now)
+            instance.last_updated = now
+    elif action in ('post_add', 'post_remove'):
+        model.objects.filter(pk__in=pk_set).update(last_updated=now)
+    elif action == 'pre_clear':
+        model.objects.filter(resources=instance).update(last_updated=now)
+
+m2m_changed.connect(touch_owners, sender=Package.resources.through)
+
+class GazetteerTerm(models.Model):
+    """
+    A place or other name to spot in text for a package, with the
+    resources to search for it. A term with no resources is searched for
+    in all of the package's resources.
+    """
+    package = models.ForeignKey(Package, related_name='gazetteer_terms')
+    term = models.CharField(max_length=200)
+    resources = models.ManyToManyField(Resource, blank=True)
+    last_updated = models.DateTimeField(auto_now=True, editable=False)
+    def __unicode__(self):
+        return self.term
+    class Meta:
+        unique_together = ('package', 'term')
+
+m2m_changed.connect(touch_owners, sender=GazetteerTerm.resources.through)
+
+class SyncedFile(models.Model):
+    """
+    An OpenSearch description file that has been synced into a resource,
+    with what the file looked like when it was.
+    """
+    path = models.CharField(max_length=255, unique=True)
+    size = models.BigIntegerField()
+    mtime = models.FloatField()
+    sha1 = models.CharField(max_length=40)
+    resource = models.ForeignKey(Resource, related_name='synced_files')
+    def __unicode__(self):
+        return self.path
+
 class LogRecord(models.Model):
     user = models.ForeignKey(User, related_name='log')
     message = models.TextField()
@@ -0,0 +1,218 @@
+import math
+import threading
+import time
+from datetime import datetime, timedelta
+from django.conf import settings
+from lru import LRUCache
+from models import Package, LogRecord
+import loaders
+import search
+import services
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# How much a resource's share of past clicks counts against how well its
+# description matches the query
+CLICK_WEIGHT = getattr(settings, 'RANKING_CLICK_WEIGHT', 0.2)
+# Only clicks from this many days back count
+CLICK_DAYS = getattr(settings, 'RANKING_CLICK_DAYS', 90)
+# Seconds before a package's vectors are rebuilt to pick up new clicks
+VECTOR_SECONDS = getattr(settings, 'RANKING_VECTOR_SECONDS', 60 * 60)
+# Most log records read each time the click tallies are brought up to date
+CLICK_SCAN = getattr(settings, 'RANKING_CLICK_SCAN', 10000)
+
+# (package version, build time, PackageVectors), keyed by package id
+package_vectors = LRUCache(getattr(settings, 'RANKING_CACHE_SIZE', 100))
+
+def url_prefix(resource):
+    """
+    Returns the literal start of a resource's query URLs.
+    """
+    template = services.search_template(resource.open_search_description)
+    if not template:
+        return None
+    return template.split('{')[0] or None
+
+class ClickTallies(object):
+    """
+    Per-day counts of the 'Opened ...' messages in the log for each
+    resource. Each refresh reads only the records logged since the last
+    one, so the log is never scanned on behalf of a single request.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self.days = {}        # date -> { resource id: clicks }
+            self.last_id = None   # id of the newest record counted
+            self.refreshed = None # time of the last refresh
+            self.version = None   # catalog version of the prefixes
+            self.prefixes = []    # (query URL prefix, resource id)
+        finally:
+            self._lock.release()
+
+    def match(self, url):
+        for prefix, id in self.prefixes:
+            if url.startswith(prefix):
+                return id
+        return None
+
+    def refresh(self):
+        """
+        Counts up to CLICK_SCAN records logged since the last refresh,
+        and forgets days more than CLICK_DAYS old.
+        """
+        self._lock.acquire()
+        try:
+            version = loaders.resource_version()
+            if version != self.version:
+                prefixes = [ (url_prefix(r), r.id)
+                             for r in loaders.load_resources() ]
+                self.prefixes = [ (p, id) for p, id in prefixes if p ]
+                self.prefixes.sort(key=lambda item: -len(item[0]))
+                self.version = version
+            since = datetime.now() - timedelta(days=CLICK_DAYS)
+            records = LogRecord.objects.filter(message__startswith='Opened ')
+            if self.last_id is None:
+                records = records.filter(timestamp__gte=since)
+            else:
+                records = records.filter(id__gt=self.last_id)
+            records = records.order_by('id').values_list(
+                'id', 'timestamp', 'message')[:CLICK_SCAN]
+            for record_id, timestamp, message in records:
+                self.last_id = record_id
+                id = self.match(message[len('Opened '):].split(' ', 1)[0])
+                if id is not None:
+                    counts = self.days.setdefault(timestamp.date(), {})
+                    counts[id] = counts.get(id, 0) + 1
+            for day in self.days.keys():
+                if day < since.date():
+                    del self.days[day]
+            self.refreshed = time.time()
+        finally:
+            self._lock.release()
+
+    def counts(self, ids):
+        self._lock.acquire()
+        try:
+            return [ sum([ counts.get(id, 0) for counts in self.days.values() ])
+                     for id in ids ]
+        finally:
+            self._lock.release()
+
+clicks = ClickTallies()
+
+def click_counts(resources):
+    """
+    Returns the number of times each resource's query links were opened
+    in the last CLICK_DAYS days. The tallies are refreshed whenever this
+    process writes log records, and here only if that hasn't happened in
+    VECTOR_SECONDS.
+    """
+    if (clicks.refreshed is None or
+        time.time() - clicks.refreshed > VECTOR_SECONDS):
+        clicks.refresh()
+    return clicks.counts([ r.id for r in resources ])
+
+class PackageVectors(object):
+    """
+    Weighted term vectors for a package's resources, stored as one
+    posting list of (resource indexes, weights) per term, plus each
+    resource's click prior. Uses NumPy arrays when NumPy is installed.
+    """
+    def __init__(self, resources, clicks):
+        self.ids = [ r.id for r in resources ]
+        n = len(resources)
+        vectors = []
+        document_frequency = {}
+        for resource in resources:
+            vector = {}
+            for field, weight in search.TEXT_FIELDS:
+                for term in search.tokenize(
+                    u' '.join(search.field_texts(resource, field))):
+                    vector[term] = vector.get(term, 0) + weight
+            for term in vector:
+                document_frequency[term] = document_frequency.get(term, 0) + 1
+            vectors.append(vector)
+        postings = {}
+        for i, vector in enumerate(vectors):
+            for term in vector:
+                vector[term] *= math.log(
+                    (1.0 + n) / (1 + document_frequency[term])) + 1
+            norm = math.sqrt(sum([ w * w for w in vector.values() ])) or 1.0
+            for term, w in vector.items():
+                indexes, weights = postings.setdefault(term, ([], []))
+                indexes.append(i)
+                weights.append(w / norm)
+        most = max(clicks + [ 0 ])
+        if most:
+            priors = [ math.log(1 + c) / math.log(1 + most) for c in clicks ]
+        else:
+            priors = [ 0.0 ] * n
+        if numpy is not None:
+            for term, (indexes, weights) in postings.items():
+                postings[term] = (numpy.array(indexes, dtype=numpy.intp),
+                                  numpy.array(weights, dtype=numpy.float64))
+            priors = numpy.array(priors, dtype=numpy.float64)
+        self.postings = postings
+        self.priors = priors
+
+    def scores(self, query):
+        counts = {}
+        for term in search.tokenize(query):
+            counts[term] = counts.get(term, 0) + 1
+        if numpy is not None:
+            scores = self.priors * CLICK_WEIGHT
+            for term, count in counts.items():
+                posting = self.postings.get(term)
+                if posting is not None:
+                    scores[posting[0]] += count * posting[1]
+            return scores
+        scores = [ p * CLICK_WEIGHT for p in self.priors ]
+        for term, count in counts.items():
+            posting = self.postings.get(term)
+            if posting is not None:
+                for i, w in zip(*posting):
+                    scores[i] += count * w
+        return scores
+
+    def rank(self, query):
+        """
+        Returns the resource ids, best match for the query first. Ties
+        keep the package's order.
+        """
+        scores = self.scores(query)
+        if numpy is not None:
+            order = numpy.argsort(-scores, kind='mergesort')
+        else:
+            order = sorted(range(len(scores)), key=lambda i: -scores[i])
+        return [ self.ids[i] for i in order ]
+
+def get_vectors(id, version=None):
+    """
+    Returns the PackageVectors for a package, building them when the
+    package or its resources have changed, or when they are more than
+    VECTOR_SECONDS old. Raises Package.DoesNotExist.
+    """
+    if version is None:
+        version = loaders.package_version(id)
+        if version is None:
+            raise Package.DoesNotExist
+    id = int(id)
+    cached = package_vectors.get(id)
+    if (cached is not None and cached[0] == version
+        and time.time() - cached[1] < VECTOR_SECONDS):
+        return cached[2]
+    resources = loaders.load_package(id).loaded_resources
+    vectors = PackageVectors(resources, click_counts(resources))
+    package_vectors.set(id, (version, time.time(), vectors))
+    return vectors
+
+def rank(id, query, version=None):
+    return get_vectors(id, version).rank(query)
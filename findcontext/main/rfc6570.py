@@ -0,0 +1,226 @@
+import re
+import urllib
+from lru import LRUCache
+
+'''
+URI Templates as specified by RFC 6570, up to and including level 4.
+
+Values may be strings (unicode, or UTF-8 encoded str), lists of
+strings, or mappings; mappings are expanded in the order their items()
+method returns. None, empty lists and empty mappings are undefined.
+
+Usage:
+
+>>> import rfc6570
+>>> rfc6570.compile('http://example.com/search{?q,lang}').expand({'q': 'dogs & cats'})
+'http://example.com/search?q=dogs%20%26%20cats'
+
+Templates are parsed once and cached. To expand one template against
+many sets of parameters, or many templates against one set, use
+expand_many() and expand_templates(); values shared between expansions
+are only encoded once per call.
+'''
+
+UNRESERVED = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-._~'
+RESERVED = ":/?#[]@!$&'()*+,;="
+
+# operator: (first, separator, named, if empty, allow reserved)
+OPERATORS = {
+    '':  ('',  ',', False, '',  False),
+    '+': ('',  ',', False, '',  True),
+    '#': ('#', ',', False, '',  True),
+    '.': ('.', '.', False, '',  False),
+    '/': ('/', '/', False, '',  False),
+    ';': (';', ';', True,  '',  False),
+    '?': ('?', '&', True,  '=', False),
+    '&': ('&', '&', True,  '=', False),
+    }
+
+expression = re.compile(r'{([^}]*)}')
+varspec = re.compile(r'^((?:[A-Za-z0-9_]|%[0-9A-Fa-f]{2})(?:\.?(?:[A-Za-z0-9_]|%[0-9A-Fa-f]{2}))*)(?::([1-9][0-9]{0,3})|(\*))?$')
+pct_encoded = re.compile(r'(%[0-9A-Fa-f]{2})')
+
+class TemplateError(ValueError):
+    pass
+
+def encode(value, allow_reserved):
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    elif not isinstance(value, str):
+        value = str(value)
+    if not allow_reserved:
+        return urllib.quote(value, UNRESERVED)
+    # keep existing pct-encoded triplets as they are
+    parts = pct_encoded.split(value)
+    for i in range(0, len(parts), 2):
+        parts[i] = urllib.quote(parts[i], UNRESERVED + RESERVED)
+    return ''.join(parts)
+
+def prefix(value, length):
+    if isinstance(value, str):
+        value = value.decode('utf-8')
+    elif not isinstance(value, unicode):
+        value = unicode(value)
+    return value[:length]
+
+def is_undefined(value):
+    if value is None:
+        return True
+    if isinstance(value, basestring):
+        return False
+    if hasattr(value, 'items') or isinstance(value, (list, tuple)):
+        return len(value) == 0
+    return False
+
+class Expression(object):
+    """
+    One {...} expression: an operator and a list of
+    (name, prefix length, explode) variable specifications.
+    """
+    def __init__(self, body):
+        self.body = body
+        operator = body[:1]
+        if operator in OPERATORS and operator != '':
+            body = body[1:]
+        elif operator in '=,!@|':
+            raise TemplateError('Reserved operator in {%s}' % self.body)
+        else:
+            operator = ''
+        (self.first, self.separator, self.named, self.if_empty,
+         self.allow_reserved) = OPERATORS[operator]
+        self.variables = []
+        for spec in body.split(','):
+            match = varspec.match(spec)
+            if match is None:
+                raise TemplateError('Bad variable "%s" in {%s}' % (spec, self.body))
+            name, length, explode = match.groups()
+            self.variables.append((name, length and int(length), bool(explode)))
+
+    def expand(self, params, memo):
+        parts = []
+        named = self.named
+        allow_reserved = self.allow_reserved
+        def enc(value):
+            key = (value, allow_reserved)
+            try:
+                return memo[key]
+            except KeyError:
+                encoded = memo[key] = encode(value, allow_reserved)
+                return encoded
+            except TypeError: # unhashable
+                return encode(value, allow_reserved)
+        for name, length, explode in self.variables:
+            value = params.get(name)
+            if is_undefined(value):
+                continue
+            if isinstance(value, basestring) or not (
+                hasattr(value, 'items') or isinstance(value, (list, tuple))):
+                if length:
+                    value = prefix(value, length)
+                if named:
+                    if value == '':
+                        parts.append(name + self.if_empty)
+                    else:
+                        parts.append('%s=%s' % (name, enc(value)))
+                else:
+                    parts.append(enc(value))
+                continue
+            if hasattr(value, 'items'):
+                items = [ (k, v) for k, v in value.items() if v is not None ]
+            else:
+                items = None
+                value = [ v for v in value if v is not None ]
+            if not explode:
+                if items is not None:
+                    encoded = ','.join(
+                        [ '%s,%s' % (enc(k), enc(v)) for k, v in items ])
+                else:
+                    encoded = ','.join([ enc(v) for v in value ])
+                if named:
+                    parts.append('%s=%s' % (name, encoded))
+                else:
+                    parts.append(encoded)
+            elif items is not None:
+                for k, v in items:
+                    if named and v == '':
+                        parts.append(enc(k) + self.if_empty)
+                    else:
+                        parts.append('%s=%s' % (enc(k), enc(v)))
+            elif named:
+                for v in value:
+                    if v == '':
+                        parts.append(name + self.if_empty)
+                    else:
+                        parts.append('%s=%s' % (name, enc(v)))
+            else:
+                parts.extend([ enc(v) for v in value ])
+        if not parts:
+            return ''
+        return self.first + self.separator.join(parts)
+
+class Template(object):
+    """
+    A template parsed into a list of nodes: literal strings (already
+    encoded) and Expressions. Use compile() to get a cached instance.
+    """
+    def __init__(self, template):
+        self.template = template
+        self.nodes = []
+        position = 0
+        for match in expression.finditer(template):
+            if match.start() > position:
+                self.nodes.append(
+                    encode(template[position:match.start()], True))
+            self.nodes.append(Expression(match.group(1)))
+            position = match.end()
+        literal = template[position:]
+        if '{' in literal or '}' in literal:
+            raise TemplateError('Unbalanced braces in %s' % template)
+        if literal:
+            self.nodes.append(encode(literal, True))
+
+    def expand(self, params, memo=None):
+        if memo is None:
+            memo = {}
+        parts = []
+        for node in self.nodes:
+            if isinstance(node, Expression):
+                parts.append(node.expand(params, memo))
+            else:
+                parts.append(node)
+        return ''.join(parts)
+
+    def expand_many(self, param_sets):
+        """
+        Expands the template against each of a sequence of parameter
+        dicts, returning a list of URIs.
+        """
+        memo = {}
+        return [ self.expand(params, memo) for params in param_sets ]
+
+templates = LRUCache(1000)
+
+def compile(template):
+    """
+    Returns the Template for a template string, parsing it only the first
+    time it is seen. Raises TemplateError if the template is malformed.
+    """
+    compiled = templates.get(template)
+    if compiled is None:
+        compiled = Template(template)
+        templates.set(template, compiled)
+    return compiled
+
+def expand(template, params):
+    return compile(template).expand(params)
+
+def expand_many(template, param_sets):
+    return compile(template).expand_many(param_sets)
+
+def expand_templates(template_list, params):
+    """
+    Expands each of a sequence of templates against one parameter dict,
+    returning a list of URIs.
+    """
+    memo = {}
+    return [ compile(t).expand(params, memo) for t in template_list ]
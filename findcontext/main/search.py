@@ -0,0 +1,204 @@
+import re
+import threading
+import time
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+from models import Resource, OPENSEARCH_NS
+import loaders
+
+# Seconds between checks that the index reflects changes made by other
+# processes; changes made in this process are applied immediately.
+CHECK_SECONDS = getattr(settings, 'SEARCH_INDEX_CHECK_SECONDS', 10)
+
+# Weight of a term by the field it appears in
+TEXT_FIELDS = (('ShortName', 3), ('Tags', 2), ('Description', 1),
+               ('Developer', 1), ('Language', 1))
+FACETS = ('language', 'developer', 'tag')
+
+word = re.compile(r'\w+', re.UNICODE)
+
+def tokenize(text):
+    if not text:
+        return []
+    return word.findall(text.lower())
+
+def field_texts(resource, field):
+    """
+    Returns the stripped, non-empty texts of every element of the given
+    name in a resource's description.
+    """
+    elements = resource.open_search_description.findall(
+        '{%s}%s' % (OPENSEARCH_NS, field))
+    return [ e.text.strip() for e in elements if e.text and e.text.strip() ]
+
+def facet_values(resource):
+    values = resource.get_open_search_values()
+    developer = (values.get('Developer') or '').strip()
+    return {
+        'language': field_texts(resource, 'Language'),
+        'developer': developer and [ developer ] or [],
+        'tag': tokenize(values.get('Tags')),
+        }
+
+class Index(object):
+    """
+    An in-memory inverted index over the text of resource descriptions,
+    with facet values for each resource.
+    """
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self.postings = {}  # term -> { resource id: weight }
+            self.documents = {} # resource id -> (terms, facets, record)
+            self.stamps = None  # resource id -> last modified when indexed
+            self.checked = 0
+        finally:
+            self._lock.release()
+
+    def add(self, resource):
+        values = resource.get_open_search_values()
+        terms = {}
+        for field, weight in TEXT_FIELDS:
+            for term in tokenize(u' '.join(field_texts(resource, field))):
+                terms[term] = max(terms.get(term, 0), weight)
+        record = { 'id': resource.id, 'uri': resource.uri,
+                   'name': values.get('ShortName'),
+                   'description': values.get('Description') }
+        self._lock.acquire()
+        try:
+            self.remove(resource.id)
+            for term, weight in terms.items():
+                self.postings.setdefault(term, {})[resource.id] = weight
+            self.documents[resource.id] = (
+                terms.keys(), facet_values(resource), record)
+            self.stamps[resource.id] = resource.last_updated
+        finally:
+            self._lock.release()
+
+    def remove(self, id):
+        self._lock.acquire()
+        try:
+            document = self.documents.pop(id, None)
+            if document is None:
+                return
+            del self.stamps[id]
+            for term in document[0]:
+                posting = self.postings[term]
+                del posting[id]
+                if not posting:
+                    del self.postings[term]
+        finally:
+            self._lock.release()
+
+    def changes(self, stamps):
+        """
+        Compares the index with the last modified times of every resource
+        and returns (ids of new or changed resources, ids of deleted
+        ones). The first list is None if nothing has been indexed yet.
+        """
+        self._lock.acquire()
+        try:
+            if self.stamps is None:
+                return None, []
+            return ([ id for id, updated in stamps.items()
+                      if self.stamps.get(id) != updated ],
+                    [ id for id in self.stamps if id not in stamps ])
+        finally:
+            self._lock.release()
+
+    def update(self, resources, deleted=()):
+        self._lock.acquire()
+        try:
+            if self.stamps is None:
+                self.stamps = {}
+            for id in deleted:
+                self.remove(id)
+            for resource in resources:
+                self.add(resource)
+            self.checked = time.time()
+        finally:
+            self._lock.release()
+
+    def search(self, query, filters=None):
+        """
+        Returns (records, facet counts) for the resources matching every
+        term of the query and every facet filter, best matches first. An
+        empty query matches every resource.
+        """
+        filters = filters or {}
+        self._lock.acquire()
+        try:
+            terms = tokenize(query)
+            if terms:
+                scores = None
+                for term in terms:
+                    posting = self.postings.get(term, {})
+                    if scores is None:
+                        scores = dict(posting)
+                    else:
+                        scores = dict([ (id, score + posting[id]) for
+                                        id, score in scores.items()
+                                        if id in posting ])
+            else:
+                scores = dict([ (id, 0) for id in self.documents ])
+            for facet, value in filters.items():
+                scores = dict([ (id, score) for id, score in scores.items()
+                                if value in self.documents[id][1][facet] ])
+            counts = dict([ (facet, {}) for facet in FACETS ])
+            for id in scores:
+                for facet, values in self.documents[id][1].items():
+                    for value in values:
+                        counts[facet][value] = counts[facet].get(value, 0) + 1
+            ranked = sorted(scores.items(),
+                            key=lambda item: (-item[1],
+                                              self.documents[item[0]][2]['name']))
+            return [ self.documents[id][2] for id, score in ranked ], counts
+        finally:
+            self._lock.release()
+
+index = Index()
+
+def current_index():
+    """
+    Returns the index, first bringing it up to date with any resources
+    that other processes have added, changed or deleted. Only those
+    resources are fetched, since this process's own changes are already
+    in it.
+    """
+    if index.stamps is None or time.time() - index.checked > CHECK_SECONDS:
+        changed, deleted = index.changes(loaders.resource_stamps())
+        if changed == []:
+            resources = []
+        else:
+            resources = loaders.load_resources(changed)
+        index.update(resources, deleted)
+    return index
+
+def search(query, filters=None):
+    return current_index().search(query, filters)
+
+# The handlers below apply this process's changes right away, recording
+# each resource's last modified time so the next check skips it.
+
+def resource_saved(sender, instance, raw=False, **kwargs):
+    if index.stamps is None:
+        return
+    if raw:
+        # fixtures may not be indexable as they stand, so have the next
+        # search fetch the resource again
+        index.remove(instance.id)
+        index.checked = 0
+        return
+    index.add(instance)
+
+def resource_deleted(sender, instance, **kwargs):
+    if index.stamps is None:
+        return
+    index.remove(instance.id)
+
+post_save.connect(resource_saved, sender=Resource)
+post_delete.connect(resource_deleted, sender=Resource)
@@ -0,0 +1,110 @@
+from urlparse import urlparse
+from django.conf import settings
+from django.core.urlresolvers import resolve, Resolver404
+from lru import LRUCache
+from models import Package, OPENSEARCH_NS
+import loaders
+import uris
+
+# Resource records, keyed by resource id
+resource_records = LRUCache(getattr(settings, 'OSD_CACHE_SIZE', 1000))
+
+class ResourceRecord(object):
+    """
+    The parts of a resource's description that views need, as plain
+    values.
+    """
+    __slots__ = ('id', 'name', 'description', 'template', 'feed_template',
+                 'suggest_template')
+    def __init__(self, id, name, description, template, feed_template=None,
+                 suggest_template=None):
+        self.id = id
+        self.name = name
+        self.description = description
+        self.template = template
+        self.feed_template = feed_template
+        self.suggest_template = suggest_template
+    def _get_uri(self):
+        return uris.absolute_uri('/api/resource/%i' % self.id)
+    uri = property(_get_uri)
+
+class PackageRecord(object):
+    """
+    A package and the records of its resources.
+    """
+    __slots__ = ('id', 'name', 'description', 'last_updated', 'resources')
+    def __init__(self, id, name, description, last_updated, resources):
+        self.id = id
+        self.name = name
+        self.description = description
+        self.last_updated = last_updated
+        self.resources = resources
+
+def search_template(osd):
+    """
+    Returns the template of the first HTML Url in an OpenSearch
+    description, or of the first Url if none is HTML.
+    """
+    urls = osd.findall('{%s}Url' % OPENSEARCH_NS)
+    for url in urls:
+        if url.get('type') == 'text/html':
+            return url.get('template')
+    if urls:
+        return urls[0].get('template')
+    return None
+
+FEED_TYPES = ('application/atom+xml', 'application/rss+xml')
+SUGGEST_TYPES = ('application/x-suggestions+json',)
+
+def typed_template(osd, types):
+    """
+    Returns the template of the first Url in an OpenSearch description
+    with one of the given types, or None.
+    """
+    for url in osd.findall('{%s}Url' % OPENSEARCH_NS):
+        if url.get('type') in types:
+            return url.get('template')
+    return None
+
+def resource_record(resource):
+    version = (resource.id, resource.last_updated)
+    cached = resource_records.get(resource.id)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    record = ResourceRecord(
+        resource.id, resource.short_name, resource.description,
+        search_template(resource.open_search_description),
+        typed_template(resource.open_search_description, FEED_TYPES),
+        typed_template(resource.open_search_description, SUGGEST_TYPES))
+    resource_records.set(resource.id, (version, record))
+    return record
+
+def package_id(uri):
+    """
+    Returns the package id from a package URI, or raises ValueError if
+    the URI doesn't name a package.
+    """
+    path = urlparse(uri or '')[2]
+    try:
+        view, args, kwargs = resolve(path)
+    except Resolver404:
+        kwargs = {}
+    if not (path.startswith('/api/package/') and 'id' in kwargs):
+        raise ValueError('Not a package URI: %s' % uri)
+    return kwargs['id']
+
+def get_package(id):
+    """
+    Returns a PackageRecord for the package with the given id, or raises
+    Package.DoesNotExist.
+    """
+    try:
+        package = loaders.load_package(id)
+    except ValueError:
+        raise Package.DoesNotExist
+    return PackageRecord(
+        package.id, package.name, package.description, package.last_updated,
+        [ resource_record(r) for r in package.loaded_resources ])
+
+def get_package_by_uri(uri):
+    return get_package(package_id(uri))
@@ -0,0 +1,125 @@
+import hashlib
+import textwrap
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+from models import Package
+import loaders
+import services
+import uri_template
+
+CACHE_SECONDS = getattr(settings, 'SIDEBAR_CACHE_SECONDS', 60 * 60)
+
+INFO = { 'height': 60 }
+BUTTON = { 'width': 240, 'height': 25, 'spacing': 31 }
+
+# Placeholders left in the rendered templates and filled in per request.
+# NUL can't appear in XML, so they can't clash with real content.
+QUERY = u'\x00query\x00'
+BUTTONS = u'\x00buttons\x00'
+QUERY_URI = u'\x00query_uri\x00'
+POSITION = u'\x00position\x00'
+SLOTS = (QUERY, BUTTONS, QUERY_URI, POSITION)
+
+def split_slots(rendered):
+    """
+    Splits rendered text into a list of literal strings and slot
+    placeholders.
+    """
+    parts = [ rendered ]
+    for slot in SLOTS:
+        split = []
+        for part in parts:
+            if part in SLOTS:
+                split.append(part)
+                continue
+            pieces = part.split(slot)
+            for piece in pieces[:-1]:
+                split.extend([ piece, slot ])
+            split.append(pieces[-1])
+        parts = split
+    return [ part for part in parts if part ]
+
+class Skeleton(object):
+    """
+    A package's sidebar rendered once, with the query, the buttons'
+    query URIs and the buttons' positions left as slots. Buttons are
+    kept separately so they can be laid out in any order.
+    """
+    def __init__(self, package):
+        self.resource_ids = [ r.id for r in package.resources ]
+        self.templates = [ r.template for r in package.resources ]
+        # Buttons whose template is missing or malformed get no link
+        self.expandable = [ i for i, t in enumerate(self.templates)
+                            if uri_template.compiles(t) ]
+        self.buttons = [ split_slots(render_to_string('sidebar-button.svg', {
+                        'query_uri': QUERY_URI, 'position': POSITION,
+                        'name': r.name,
+                        'description': textwrap.wrap(r.description, 43),
+                        'button': BUTTON })) for r in package.resources ]
+        height = BUTTON['spacing'] * len(self.buttons) + INFO['height'] + 5
+        self.frame = split_slots(render_to_string('sidebar.svg', {
+                    'query': QUERY, 'buttons': mark_safe(BUTTONS),
+                    'height': height, 'button': BUTTON, 'info': INFO }))
+
+    def order(self, ids):
+        """
+        Returns the order of buttons for a list of resource ids, or None
+        if the ids aren't this package's resources.
+        """
+        positions = dict([ (id, i) for i, id in enumerate(self.resource_ids) ])
+        order = [ positions[id] for id in ids if id in positions ]
+        if len(order) != len(positions):
+            return None
+        return order
+
+    def render(self, query, order=None):
+        """
+        Returns the sidebar for a query as UTF-8. order is an optional
+        list of indexes into the package's resources, giving the order
+        in which to lay out their buttons.
+        """
+        if order is None:
+            order = range(len(self.buttons))
+        query_uris = [ '' ] * len(self.templates)
+        expanded = uri_template.expand_templates(
+            [ self.templates[i] for i in self.expandable ],
+            { 'searchTerms': query.encode('utf-8') })
+        for i, query_uri in zip(self.expandable, expanded):
+            query_uris[i] = query_uri
+        escaped_query = escape(query)
+        out = []
+        for part in self.frame:
+            if part == QUERY:
+                out.append(escaped_query)
+            elif part == BUTTONS:
+                for position, i in enumerate(order):
+                    for button_part in self.buttons[i]:
+                        if button_part == QUERY_URI:
+                            out.append(escape(query_uris[i]))
+                        elif button_part == POSITION:
+                            out.append(unicode(position * BUTTON['spacing']))
+                        else:
+                            out.append(button_part)
+            else:
+                out.append(part)
+        return u''.join(out).encode('utf-8')
+
+def get_skeleton(id):
+    """
+    Returns the Skeleton for a package, building it only when the package
+    or its resources have changed since it was cached. Raises
+    Package.DoesNotExist if there is no such package.
+    """
+    version = loaders.package_version(id)
+    if version is None:
+        raise Package.DoesNotExist
+    key = 'findcontext.sidebar.%s' % hashlib.md5(repr((id, version))).hexdigest()
+    skeleton = cache.get(key)
+    if skeleton is None:
+        skeleton = Skeleton(services.get_package(id))
+        cache.set(key, skeleton, CACHE_SECONDS)
+    skeleton.version = version
+    return skeleton
@@ -0,0 +1,129 @@
+import hashlib
+import json
+import logging
+import time
+from multiprocessing import TimeoutError
+from django.conf import settings
+from django.core.cache import cache
+import federation
+import uri_template
+
+BUDGET = getattr(settings, 'SUGGEST_BUDGET', 0.3)
+TIMEOUT = getattr(settings, 'SUGGEST_TIMEOUT', 2)
+CACHE_SECONDS = getattr(settings, 'SUGGEST_CACHE_SECONDS', 60 * 60)
+LIMIT = 10
+
+# A source that returns fewer suggestions than this is assumed to have
+# returned every suggestion for the query, so the suggestions for longer
+# queries can be filtered out of them without asking it again.
+SOURCE_LIMIT = 10
+
+# Only this many of the longest prefixes of a query are looked up in the
+# cache, so long queries don't cost a cache key per character.
+PREFIXES = 16
+
+log = logging.getLogger(__name__)
+
+def normalize(query):
+    return u' '.join(query.lower().split())
+
+def fetch(request):
+    """
+    Fetches one source's suggestions. Runs on a pool thread.
+    """
+    data = json.loads(request.read())
+    if not (isinstance(data, list) and len(data) > 1 and
+            isinstance(data[1], list)):
+        raise ValueError('Not an x-suggestions+json response')
+    return [ s for s in data[1] if isinstance(s, basestring) ]
+
+def cache_key(resource, query):
+    return 'findcontext.suggest.%s' % hashlib.md5(repr(
+            (resource.id, resource.suggest_template,
+             query.encode('utf-8')))).hexdigest()
+
+def matching(suggestions, query):
+    return [ s for s in suggestions if normalize(s).startswith(query) ]
+
+def from_cache(resources, query):
+    """
+    Returns a dict mapping resource indexes to (suggestions, fresh) for
+    the resources that have cached suggestions for the query or one of
+    its PREFIXES longest prefixes. fresh is False when the suggestions
+    were filtered from an incomplete list for a shorter prefix.
+    """
+    keys = {}
+    for i, resource in resources:
+        for end in range(len(query), max(0, len(query) - PREFIXES), -1):
+            keys[cache_key(resource, query[:end])] = (i, end)
+    cached = cache.get_many(keys.keys())
+    found = {}
+    for key, (i, end) in sorted(keys.items(), key=lambda item: -item[1][1]):
+        if i in found or key not in cached:
+            continue
+        suggestions = cached[key]
+        if end == len(query):
+            found[i] = (suggestions, True)
+        else:
+            found[i] = (matching(suggestions, query),
+                        len(suggestions) < SOURCE_LIMIT)
+    return found
+
+def merge(lists, limit=LIMIT):
+    """
+    Interleaves lists of suggestions by rank, dropping duplicates.
+    """
+    seen = set()
+    merged = []
+    for rank in range(max([ len(l) for l in lists ] + [ 0 ])):
+        for suggestions in lists:
+            if rank < len(suggestions):
+                key = normalize(suggestions[rank])
+                if key not in seen:
+                    seen.add(key)
+                    merged.append(suggestions[rank])
+                    if len(merged) == limit:
+                        return merged
+    return merged
+
+def suggest(package, query, budget=None):
+    """
+    Returns merged suggestions for a query from every resource of a
+    package record with an x-suggestions+json Url template that can be
+    expanded. Sources that don't answer within budget seconds are left
+    out, but are given up to TIMEOUT seconds to answer so that their
+    suggestions can be cached for the next keystroke.
+    """
+    if budget is None:
+        budget = BUDGET
+    stop = time.time() + budget
+    query = normalize(query)
+    resources = [ (i, r) for i, r in enumerate(package.resources)
+                  if uri_template.compiles(r.suggest_template) ]
+    if not query or not resources:
+        return []
+    found = from_cache(resources, query)
+    lists = dict([ (i, suggestions) for i, (suggestions, fresh)
+                   in found.items() ])
+    stale = [ (i, r) for i, r in resources
+              if i not in found or not found[i][1] ]
+    uris = uri_template.expand_templates(
+        [ r.suggest_template for i, r in stale ],
+        { 'searchTerms': query.encode('utf-8') })
+    pending = []
+    for (i, resource), uri in zip(stale, uris):
+        key = cache_key(resource, query)
+        def store(suggestions, key=key):
+            cache.set(key, suggestions, CACHE_SECONDS)
+        request = federation.Fetch(uri, TIMEOUT)
+        pending.append((i, federation.pool().apply_async(
+                    fetch, (request,), callback=store)))
+    for i, async_result in pending:
+        try:
+            lists[i] = async_result.get(max(0, stop - time.time()))
+        except TimeoutError:
+            pass # too slow; keep any suggestions from the cache
+        except Exception:
+            log.warning('Suggestions from %s failed', package.resources[i].id,
+                        exc_info=True)
+    return merge([ lists[i] for i, r in resources if i in lists ])
@@ -1,5 +1,5 @@
 /*jslint eqeqeq: true, immed: true, newcap: true, nomen: true, onevar: true, passfail: true, plusplus: true, regexp: true, undef: true, white: true, indent: 2*/
-/*global jetpack, console, encodeURIComponent, $ */
+/*global jetpack, console, encodeURIComponent, window, $ */
 
 jetpack.future.import('me');  
 jetpack.future.import('menu');
@@ -21,22 +21,47 @@ function base64encode(string) {
   return jetpack.tabs.focused.contentWindow.btoa(string);
 }
 
-function log(message) {
+var logQueue = [];
+var logTimer = null;
+
+function sendLog(sync) {
+  clearTimeout(logTimer);
+  logTimer = null;
+  if (logQueue.length == 0) return;
+  var messages = logQueue;
+  logQueue = [];
   $.ajax({
     'type': 'POST',
-    'url': API_URI + 'log/',
-    'contentType': 'text/plain',
-    'data': message,
+    'url': API_URI + 'log/batch',
+    'contentType': 'application/json',
+    'data': JSON.stringify(messages),
     'processData': false,
+    'async': ! sync,
     'beforeSend': function (request) {
       request.setRequestHeader(
         'Authorization', 
         'Basic ' + base64encode(USER + ':' + PASS));
     }
   });
+}
+
+function log(message) {
+  logQueue.push(message);
+  if (logQueue.length >= 20) {
+    sendLog(false);
+  } else if (logTimer == null) {
+    logTimer = setTimeout(function () {
+      sendLog(false);
+    }, 5000);
+  }
   console.log(message);
 }
 
+// send whatever is still queued before the extension goes away
+window.addEventListener('unload', function () {
+  sendLog(true);
+}, false);
+
 function initPackage(callback) {
   if (pkg) {
     callback(pkg);
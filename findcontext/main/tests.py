@@ -1,7 +1,618 @@
+import unittest
+from lxml import etree
+from django.db import connection
+from django.contrib.sites.models import Site
+from django.contrib.auth.models import User
+from django.test.client import Client
+from findcontext.main.lru import LRUCache
+from findcontext.main.models import Resource, Package, LogRecord, parsed_osds
+from findcontext.main import uris, services, sidebars, search, ranking
+from findcontext.main import uri_template, rfc6570, logbuffer
+from findcontext.main.compression import choose_encoding
+from findcontext.main.gazetteer import fold, Automaton
+from django.core.cache import cache
+
 __test__ = {"doctest": """
 Another way to test that 1 + 1 is equal to 2.
 
 >>> 1 + 1 == 2
 True
-"""}
+""", "lru": LRUCache, "compression": choose_encoding,
+    "fold": fold, "automaton": Automaton}
+
+
+class ParsedOSDCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.r = Resource.objects.create(
+            open_search_description=etree.parse(
+                'test-data/wikipedia.xml').getroot())
+        parsed_osds.clear()
+
+    def tearDown(self):
+        self.r.delete()
+
+    def test_trees_are_shared_between_loads(self):
+        first = Resource.objects.get(pk=self.r.id).open_search_description
+        second = Resource.objects.get(pk=self.r.id).open_search_description
+        self.assertTrue(first is second)
+        self.assertEqual(1, parsed_osds.hits)
+        self.assertEqual(1, parsed_osds.misses)
+
+    def test_save_invalidates(self):
+        first = Resource.objects.get(pk=self.r.id)
+        first.open_search_description
+        first.save()
+        self.assertTrue(parsed_osds.get(self.r.id) is None)
+        second = Resource.objects.get(pk=self.r.id)
+        self.assertFalse(
+            first.open_search_description is second.open_search_description)
+
+    def test_unparsed_until_read(self):
+        Resource.objects.get(pk=self.r.id)
+        self.assertEqual(0, len(parsed_osds))
+
+
+class IngestTestCase(unittest.TestCase):
+    def setUp(self):
+        self.data = open('test-data/worldcat.xml').read()
+        parsed_osds.clear()
+
+    def tearDown(self):
+        Resource.objects.filter(_short_name='WorldCat Catalog: Books').delete()
+
+    def stored(self, r):
+        return Resource.objects.filter(pk=r.id).values_list(
+            'open_search_description', flat=True)[0]
+
+    def test_original_text_is_stored(self):
+        r = Resource.from_xml('<?xml version="1.0" encoding="UTF-8"?>\n' + self.data)
+        r.save()
+        self.assertEqual(self.data.decode('utf-8'), self.stored(r))
+
+    def test_tree_is_cached_on_save(self):
+        r = Resource.from_xml(self.data)
+        tree = r.open_search_description
+        r.save()
+        loaded = Resource.objects.get(pk=r.id)
+        self.assertTrue(loaded.open_search_description is tree)
+        self.assertEqual(1, parsed_osds.hits)
+        self.assertEqual(0, parsed_osds.misses)
+
+    def test_reassigned_tree_is_serialized(self):
+        r = Resource.from_xml(self.data)
+        tree = etree.fromstring(self.data)
+        tree.find('{http://a9.com/-/spec/opensearch/1.1/}Description').text = 'Changed.'
+        r.open_search_description = tree
+        r.save()
+        self.assertTrue('Changed.' in self.stored(r))
+        self.assertTrue(parsed_osds.get(r.id) is None)
+
+    def test_other_encodings_are_serialized(self):
+        data = ('<?xml version="1.0" encoding="ISO-8859-1"?>\n' +
+                self.data.replace('Books', 'B\xf6oks'))
+        r = Resource.from_xml(data)
+        r.save()
+        self.assertEqual(u'WorldCat Catalog: B\xf6oks', r.short_name)
+        self.assertTrue(u'B\xf6oks' in self.stored(r))
+        self.assertFalse(self.stored(r).startswith('<?xml'))
+        r.delete()
+
+
+class DerivedAttributesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.osd = etree.parse('test-data/wikipedia.xml').getroot()
+
+    def test_values_extracted_in_one_pass(self):
+        r = Resource(open_search_description=self.osd)
+        self.assertEqual('rocksoccer', r.developer)
+        self.assertEqual('UTF-8', r.get_open_search_values()['InputEncoding'])
+
+    def test_read_only_attributes_are_per_instance(self):
+        r = Resource(open_search_description=self.osd)
+        r.developer
+        self.assertRaises(AttributeError, setattr, r, 'developer', 'x')
+        other = Resource()
+        other.developer = 'x'
+        self.assertEqual('x', other.developer)
+
+    def test_reassigning_description_resets_values(self):
+        r = Resource(open_search_description=self.osd)
+        self.assertEqual('rocksoccer', r.get_open_search_values()['Developer'])
+        r.open_search_description = etree.parse('test-data/worldcat.xml').getroot()
+        self.assertEqual('Search Open WorldCat Catalog for Books', r.description)
+
+
+class URITestCase(unittest.TestCase):
+    def setUp(self):
+        self.site = Site.objects.get_current()
+        self.r = Resource.get('Monasticon Hibernicum')
+
+    def tearDown(self):
+        self.site.domain = 'findcontext.org'
+        self.site.save()
+
+    def test_base_uri_follows_site_changes(self):
+        self.assertEqual('http://findcontext.org/api/resource/1', self.r.uri)
+        self.site.domain = 'example.org'
+        self.site.save()
+        self.assertEqual('http://example.org', uris.base_uri())
+        self.assertEqual('http://example.org/api/resource/1', self.r.uri)
+
+
+class SidebarTestCase(unittest.TestCase):
+    def setUp(self):
+        self.c = Client()
+        self.u = User.objects.create_user('tester', '', 'testerpass')
+        self.p = Package.objects.create(name='Test Package', description='This is a test.', owner=self.u)
+        self.r = Resource.get('Monasticon Hibernicum')
+        self.p.resources.add(self.r)
+
+    def tearDown(self):
+        self.p.delete()
+        self.u.delete()
+
+    def test_package_records(self):
+        package = services.get_package_by_uri(self.p.uri)
+        self.assertEqual('Test Package', package.name)
+        self.assertEqual(1, len(package.resources))
+        record = package.resources[0]
+        self.assertEqual('Monasticon Hibernicum', record.name)
+        self.assertEqual(self.r.description, record.description)
+        self.assertTrue('{searchTerms}' in record.template)
+
+    def test_bad_package_uri(self):
+        self.assertRaises(ValueError, services.package_id,
+                          'http://findcontext.org/api/resource/1')
+        self.assertRaises(Package.DoesNotExist, services.get_package, 9999)
+
+    def test_sidebar(self):
+        response = self.c.get('/sidebar/', { 'p': self.p.uri, 'q': 'abbey' })
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('image/svg+xml', response['Content-Type'])
+        self.assertTrue('Monasticon Hibernicum' in response.content)
+        self.assertTrue('abbey' in response.content)
+
+    def test_query_is_escaped(self):
+        response = self.c.get('/sidebar/', { 'p': self.p.uri, 'q': '<b>&' })
+        self.assertTrue('&lt;b&gt;&amp;' in response.content)
+        self.assertFalse('<b>' in response.content)
+
+
+class SkeletonTestCase(unittest.TestCase):
+    def setUp(self):
+        self.u = User.objects.create_user('tester', '', 'testerpass')
+        self.p = Package.objects.create(name='Test Package', description='This is a test.', owner=self.u)
+        self.p.resources.add(Resource.get('Monasticon Hibernicum'))
+        self.p.resources.add(Resource.get('Celtic Art & Cultures'))
+        cache.clear()
+
+    def tearDown(self):
+        self.p.delete()
+        self.u.delete()
+
+    def test_skeleton_is_cached(self):
+        first = sidebars.get_skeleton(self.p.id)
+        self.assertTrue('<b>x</b>' not in first.render(u'<b>x</b>'))
+        cached = sidebars.get_skeleton(self.p.id)
+        self.assertEqual(first.frame, cached.frame)
+        self.assertEqual(first.render(u'abbey'), cached.render(u'abbey'))
+
+    def test_membership_change_invalidates(self):
+        sidebars.get_skeleton(self.p.id)
+        self.p.resources.remove(Resource.get('Celtic Art & Cultures'))
+        skeleton = sidebars.get_skeleton(self.p.id)
+        self.assertEqual(1, len(skeleton.buttons))
+        self.assertFalse('Celtic Art' in skeleton.render(u'abbey'))
+
+    def test_order(self):
+        skeleton = sidebars.get_skeleton(self.p.id)
+        names = [ Resource.objects.get(pk=id).short_name for id in skeleton.resource_ids ]
+        forward = skeleton.render(u'abbey')
+        backward = skeleton.render(u'abbey', order=[1, 0])
+        self.assertTrue(forward.index(names[0].encode('utf-8')) < forward.index(names[1].encode('utf-8').replace('&', '&amp;')))
+        self.assertTrue(backward.index(names[0].encode('utf-8')) > backward.index(names[1].encode('utf-8').replace('&', '&amp;')))
+        self.assertEqual(len(forward), len(backward))
+
+    def test_bad_templates_get_no_link(self):
+        broken = [ make_resource('Broken %d' % i, 'Broken.', template=t)
+                   for i, t in enumerate(('{-nope|&amp;|searchTerms}',
+                                          'http://example.org/{?q')) ]
+        try:
+            for r in broken:
+                self.p.resources.add(r)
+            skeleton = sidebars.get_skeleton(self.p.id)
+            rendered = skeleton.render(u'abbey')
+            self.assertTrue('Broken 0' in rendered and 'Broken 1' in rendered)
+            self.assertEqual(2, rendered.count('xlink:href=""'))
+            self.assertEqual(2, rendered.count('abbey"'))
+        finally:
+            for r in broken:
+                r.delete()
+
+
+class URITemplateTestCase(unittest.TestCase):
+    def test_compiled(self):
+        t = '/path/to/{foo}{-prefix|&|bar}'
+        self.assertTrue(uri_template.compile(t) is uri_template.compile(t))
+        for params in ({}, {'foo': 'a'}, {'foo': 'a', 'bar': 'b c'}):
+            self.assertEqual(uri_template.sub(t, params),
+                             uri_template.compile(t).expand(params))
+        self.assertEqual(uri_template.sub(t, {}, partial=True),
+                         uri_template.compile(t).expand({}, partial=True))
+
+    def test_batch(self):
+        self.assertEqual(['/path/to/a', '/path/to/b'], uri_template.expand_many('/path/to/{foo}', [{'foo': 'a'}, {'foo': 'b'}]))
+        self.assertEqual(['/path/to/&a/b', '/path/to/a%2Fb', '/path/to?foo=a%2Fb'],
+                         uri_template.expand_templates(['/path/to/{-prefix|&|foo}', '/path/to/{foo*}', '/path/to{?foo}'], {'foo': 'a/b'}))
+        self.assertFalse(uri_template.is_rfc6570('/path/to/{-prefix|&|foo}{bar}'))
+        self.assertTrue(uri_template.is_rfc6570('/path/to/{foo:3}'))
+
+    def test_compiles(self):
+        self.assertTrue(uri_template.compiles('/path/to/{foo}'))
+        self.assertTrue(uri_template.compiles('/path/to{?foo}'))
+        for template in (None, '/path/to/{-nope|&|foo}', '/path/to/{-prefix}',
+                         '/path/to{?foo', '/path/to/{-prefix|/|a,b}'):
+            self.assertFalse(uri_template.compiles(template))
+
+
+# A mapping that keeps its items in order
+class Pairs(list):
+    def items(self):
+        return self
+
+# The examples from section 3.2 of RFC 6570
+rfc6570_params = {
+    'count': ['one', 'two', 'three'],
+    'dom': ['example', 'com'],
+    'dub': 'me/too',
+    'hello': 'Hello World!',
+    'half': '50%',
+    'var': 'value',
+    'who': 'fred',
+    'base': 'http://example.com/home/',
+    'path': '/foo/bar',
+    'list': ['red', 'green', 'blue'],
+    'keys': Pairs([('semi', ';'), ('dot', '.'), ('comma', ',')]),
+    'v': '6',
+    'x': '1024',
+    'y': '768',
+    'empty': '',
+    'empty_keys': {},
+    'undef': None,
+    }
+
+rfc6570_examples = [
+    ('{count}',                 'one,two,three'),
+    ('{count*}',                'one,two,three'),
+    ('{/count}',                '/one,two,three'),
+    ('{/count*}',               '/one/two/three'),
+    ('{;count}',                ';count=one,two,three'),
+    ('{;count*}',               ';count=one;count=two;count=three'),
+    ('{?count}',                '?count=one,two,three'),
+    ('{?count*}',               '?count=one&count=two&count=three'),
+    ('{&count*}',               '&count=one&count=two&count=three'),
+    ('{var}',                   'value'),
+    ('{hello}',                 'Hello%20World%21'),
+    ('{half}',                  '50%25'),
+    ('O{empty}X',               'OX'),
+    ('O{undef}X',               'OX'),
+    ('{x,y}',                   '1024,768'),
+    ('{x,hello,y}',             '1024,Hello%20World%21,768'),
+    ('?{x,empty}',              '?1024,'),
+    ('?{x,undef}',              '?1024'),
+    ('?{undef,y}',              '?768'),
+    ('{var:3}',                 'val'),
+    ('{var:30}',                'value'),
+    ('{list}',                  'red,green,blue'),
+    ('{list*}',                 'red,green,blue'),
+    ('{keys}',                  'semi,%3B,dot,.,comma,%2C'),
+    ('{keys*}',                 'semi=%3B,dot=.,comma=%2C'),
+    ('{+var}',                  'value'),
+    ('{+hello}',                'Hello%20World!'),
+    ('{+half}',                 '50%25'),
+    ('{base}index',             'http%3A%2F%2Fexample.com%2Fhome%2Findex'),
+    ('{+base}index',            'http://example.com/home/index'),
+    ('O{+empty}X',              'OX'),
+    ('{+path}/here',            '/foo/bar/here'),
+    ('here?ref={+path}',        'here?ref=/foo/bar'),
+    ('up{+path}{var}/here',     'up/foo/barvalue/here'),
+    ('{+x,hello,y}',            '1024,Hello%20World!,768'),
+    ('{+path,x}/here',          '/foo/bar,1024/here'),
+    ('{+path:6}/here',          '/foo/b/here'),
+    ('{+list}',                 'red,green,blue'),
+    ('{+list*}',                'red,green,blue'),
+    ('{+keys}',                 'semi,;,dot,.,comma,,'),
+    ('{+keys*}',                'semi=;,dot=.,comma=,'),
+    ('{#var}',                  '#value'),
+    ('{#hello}',                '#Hello%20World!'),
+    ('{#half}',                 '#50%25'),
+    ('foo{#empty}',             'foo#'),
+    ('foo{#undef}',             'foo'),
+    ('{#x,hello,y}',            '#1024,Hello%20World!,768'),
+    ('{#path,x}/here',          '#/foo/bar,1024/here'),
+    ('{#path:6}/here',          '#/foo/b/here'),
+    ('{#list}',                 '#red,green,blue'),
+    ('{#list*}',                '#red,green,blue'),
+    ('{#keys}',                 '#semi,;,dot,.,comma,,'),
+    ('{#keys*}',                '#semi=;,dot=.,comma=,'),
+    ('{.who}',                  '.fred'),
+    ('{.who,who}',              '.fred.fred'),
+    ('{.half,who}',             '.50%25.fred'),
+    ('www{.dom*}',              'www.example.com'),
+    ('X{.var}',                 'X.value'),
+    ('X{.empty}',               'X.'),
+    ('X{.undef}',               'X'),
+    ('X{.var:3}',               'X.val'),
+    ('X{.list}',                'X.red,green,blue'),
+    ('X{.list*}',               'X.red.green.blue'),
+    ('X{.keys}',                'X.semi,%3B,dot,.,comma,%2C'),
+    ('X{.keys*}',               'X.semi=%3B.dot=..comma=%2C'),
+    ('X{.empty_keys}',          'X'),
+    ('X{.empty_keys*}',         'X'),
+    ('{/who}',                  '/fred'),
+    ('{/who,who}',              '/fred/fred'),
+    ('{/half,who}',             '/50%25/fred'),
+    ('{/who,dub}',              '/fred/me%2Ftoo'),
+    ('{/var}',                  '/value'),
+    ('{/var,empty}',            '/value/'),
+    ('{/var,undef}',            '/value'),
+    ('{/var,x}/here',           '/value/1024/here'),
+    ('{/var:1,var}',            '/v/value'),
+    ('{/list}',                 '/red,green,blue'),
+    ('{/list*}',                '/red/green/blue'),
+    ('{/list*,path:4}',         '/red/green/blue/%2Ffoo'),
+    ('{/keys}',                 '/semi,%3B,dot,.,comma,%2C'),
+    ('{/keys*}',                '/semi=%3B/dot=./comma=%2C'),
+    ('{;who}',                  ';who=fred'),
+    ('{;half}',                 ';half=50%25'),
+    ('{;empty}',                ';empty'),
+    ('{;v,empty,who}',          ';v=6;empty;who=fred'),
+    ('{;v,bar,who}',            ';v=6;who=fred'),
+    ('{;x,y}',                  ';x=1024;y=768'),
+    ('{;x,y,empty}',            ';x=1024;y=768;empty'),
+    ('{;x,y,undef}',            ';x=1024;y=768'),
+    ('{;hello:5}',              ';hello=Hello'),
+    ('{;list}',                 ';list=red,green,blue'),
+    ('{;list*}',                ';list=red;list=green;list=blue'),
+    ('{;keys}',                 ';keys=semi,%3B,dot,.,comma,%2C'),
+    ('{;keys*}',                ';semi=%3B;dot=.;comma=%2C'),
+    ('{?who}',                  '?who=fred'),
+    ('{?half}',                 '?half=50%25'),
+    ('{?x,y}',                  '?x=1024&y=768'),
+    ('{?x,y,empty}',            '?x=1024&y=768&empty='),
+    ('{?x,y,undef}',            '?x=1024&y=768'),
+    ('{?var:3}',                '?var=val'),
+    ('{?list}',                 '?list=red,green,blue'),
+    ('{?list*}',                '?list=red&list=green&list=blue'),
+    ('{?keys}',                 '?keys=semi,%3B,dot,.,comma,%2C'),
+    ('{?keys*}',                '?semi=%3B&dot=.&comma=%2C'),
+    ('{&who}',                  '&who=fred'),
+    ('{&half}',                 '&half=50%25'),
+    ('?fixed=yes{&x}',          '?fixed=yes&x=1024'),
+    ('{&x,y,empty}',            '&x=1024&y=768&empty='),
+    ('{&var:3}',                '&var=val'),
+    ('{&list}',                 '&list=red,green,blue'),
+    ('{&list*}',                '&list=red&list=green&list=blue'),
+    ('{&keys}',                 '&keys=semi,%3B,dot,.,comma,%2C'),
+    ('{&keys*}',                '&semi=%3B&dot=.&comma=%2C'),
+    ]
+
+class RFC6570TestCase(unittest.TestCase):
+    def test_examples(self):
+        for template, expected in rfc6570_examples:
+            self.assertEqual(expected, rfc6570.expand(template, rfc6570_params), 'testing %r' % template)
+
+    def test_unicode(self):
+        self.assertEqual('%C3%BCber', rfc6570.expand('{q}', {'q': u'\xfcber'}))
+        self.assertEqual('%C3%BC', rfc6570.expand('{q:1}', {'q': u'\xfcber'.encode('utf-8')}))
+
+    def test_errors(self):
+        for template in ('{=foo}', '{foo', 'foo}', '{foo:0}', '{foo bar}', '{}'):
+            self.assertRaises(rfc6570.TemplateError, rfc6570.compile, template)
+
+    def test_batch(self):
+        t = 'http://example.com/{?q,lang}'
+        self.assertEqual(['http://example.com/?q=a&lang=en', 'http://example.com/?q=b'],
+                         rfc6570.expand_many(t, [{'q': 'a', 'lang': 'en'}, {'q': 'b'}]))
+        self.assertEqual(['http://example.com/?q=a', 'http://example.org/a'],
+                         rfc6570.expand_templates([t, 'http://example.org/{q}'], {'q': 'a'}))
+        self.assertTrue(rfc6570.compile(t) is rfc6570.compile(t))
+
+
+def make_resource(name, description, tags='', languages=(), developer='',
+                  template='http://example.org/?q={searchTerms}'):
+    return Resource.objects.create(open_search_description=etree.fromstring(
+            '<OpenSearchDescription xmlns="http://a9.com/-/spec/opensearch/1.1/">'
+            '<ShortName>%s</ShortName><Description>%s</Description>'
+            '<Url type="text/html" template="%s"/>'
+            '<Tags>%s</Tags>%s<Developer>%s</Developer>'
+            '</OpenSearchDescription>' % (
+                name, description, template, tags,
+                ''.join([ '<Language>%s</Language>' % l for l in languages ]),
+                developer)))
+
+class SearchIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        search.index.clear()
+        self.resources = [
+            make_resource('Quux Annals', 'Chronicles of old Quuxland.',
+                          'quuxhistory quuxland', ('en', 'ga'), 'Jane'),
+            make_resource('Quux Poetry', 'Poems of old Quuxland.',
+                          'quuxpoetry', ('cy',), 'Jane'),
+            make_resource('Quux Stones', 'Inscriptions, mostly illegible.',
+                          'quuxland quuxstones', ('en',), 'Sam') ]
+
+    def tearDown(self):
+        for r in self.resources:
+            r.delete()
+
+    def names(self, records):
+        return [ r['name'] for r in records ]
+
+    def test_search(self):
+        records, facets = search.search(u'old quuxland')
+        self.assertEqual([ 'Quux Annals', 'Quux Poetry' ], self.names(records))
+        self.assertEqual({ 'Jane': 2 }, facets['developer'])
+        self.assertEqual({ 'en': 1, 'ga': 1, 'cy': 1 }, facets['language'])
+        # names and tags outweigh descriptions
+        records, facets = search.search(u'Quuxland')
+        self.assertEqual([ 'Quux Annals', 'Quux Stones', 'Quux Poetry' ],
+                         self.names(records))
+
+    def test_filters(self):
+        records, facets = search.search(u'', { 'language': 'en' })
+        self.assertEqual([ 'Quux Annals', 'Quux Stones' ], self.names(records))
+        records, facets = search.search(u'quuxland', { 'developer': 'Sam' })
+        self.assertEqual([ 'Quux Stones' ], self.names(records))
+        self.assertEqual({ 'quuxland': 1, 'quuxstones': 1 }, facets['tag'])
+
+    def test_languages_and_developers_are_searchable(self):
+        self.assertEqual([ 'Quux Stones' ], self.names(search.search(u'sam')[0]))
+        self.assertEqual([ 'Quux Annals' ], self.names(search.search(u'ga')[0]))
+
+    def test_incremental_updates(self):
+        search.search(u'')
+        r = make_resource('Quux Names', 'Place names of the Isle of Quux.')
+        self.resources.append(r)
+        self.assertEqual([ 'Quux Names' ], self.names(search.index.search(u'isle')[0]))
+        r.open_search_description.find(
+            '{http://a9.com/-/spec/opensearch/1.1/}Description').text = 'Gone.'
+        r.save()
+        self.assertEqual([], search.index.search(u'isle')[0])
+        self.resources.remove(r)
+        r.delete()
+        self.assertEqual([], search.index.search(u'gone')[0])
+
+    def test_rebuilds_when_catalog_changes_elsewhere(self):
+        search.search(u'')
+        Resource.objects.filter(pk=self.resources[0].id).delete()
+        search.index.checked = 0
+        self.assertEqual([], search.search(u'chronicles')[0])
+
+    def test_local_changes_dont_hide_changes_elsewhere(self):
+        search.search(u'')
+        connection.cursor().execute('DELETE FROM main_resource WHERE id = %s',
+                                    [ self.resources[0].id ])
+        self.resources.append(make_resource('Quux Names', 'Place names.'))
+        search.index.checked = 0
+        self.assertEqual([], search.search(u'chronicles')[0])
+
+    def test_only_resources_changed_elsewhere_are_fetched(self):
+        search.search(u'')
+        fetched = []
+        def load_resources(ids=None):
+            fetched.append(ids)
+            return load_resources_(ids)
+        load_resources_ = search.loaders.load_resources
+        search.loaders.load_resources = load_resources
+        try:
+            self.resources.append(make_resource('Quux Names', 'Toponyms.'))
+            search.index.checked = 0
+            self.assertEqual([ 'Quux Names' ],
+                             self.names(search.search(u'toponyms')[0]))
+            self.assertEqual([], fetched)
+            r = self.resources[1]
+            r.open_search_description.find(
+                '{http://a9.com/-/spec/opensearch/1.1/}Description'
+                ).text = 'Quuxsongs.'
+            Resource.objects.filter(pk=r.id).update(
+                open_search_description=r.open_search_description,
+                last_updated=r.last_updated.replace(year=2000))
+            search.index.checked = 0
+            self.assertEqual([ 'Quux Poetry' ],
+                             self.names(search.search(u'quuxsongs')[0]))
+            self.assertEqual([ [ r.id ] ], fetched)
+        finally:
+            search.loaders.load_resources = load_resources_
+
+class RankingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.c = Client()
+        self.u = User.objects.create_user('ranker', '', 'rankerpass')
+        self.p = Package.objects.create(
+            name='Ranked Package', description='Ranked.', owner=self.u)
+        self.resources = [
+            make_resource('Quux Annals', 'Chronicles of old Quuxland.',
+                          'quuxhistory', developer='Jane',
+                          template='http://a.example.org/?q={searchTerms}'),
+            make_resource('Quux Poetry', 'Poems and songs of old Quuxland.',
+                          'quuxpoetry', developer='Jane',
+                          template='http://p.example.org/?q={searchTerms}'),
+            make_resource('Quux Stones', 'Inscriptions, mostly illegible.',
+                          'quuxstones', developer='Jane',
+                          template='http://s.example.org/?q={searchTerms}') ]
+        for r in self.resources:
+            self.p.resources.add(r)
+        ranking.package_vectors.clear()
+        ranking.clicks.clear()
+
+    def tearDown(self):
+        ranking.clicks.clear()
+        for r in self.resources:
+            r.delete()
+        self.p.delete()
+        self.u.delete()
+
+    def names(self, ids):
+        return [ Resource.objects.get(pk=id).short_name for id in ids ]
+
+    def test_rank(self):
+        self.assertEqual(['Quux Poetry', 'Quux Annals', 'Quux Stones'],
+                         self.names(ranking.rank(self.p.id, u'poetry songs')))
+        self.assertEqual(['Quux Stones', 'Quux Annals', 'Quux Poetry'],
+                         self.names(ranking.rank(self.p.id, u'inscriptions')))
+        # no matching terms keeps the package's order
+        self.assertEqual([ r.id for r in self.p.resources.all() ],
+                         ranking.rank(self.p.id, u'nothing'))
+        self.assertRaises(Package.DoesNotExist, ranking.rank, 9999, u'poetry')
+
+    def test_clicks(self):
+        for i in range(3):
+            LogRecord.objects.create(
+                user=self.u, message='Opened http://s.example.org/?q=x%d' % i)
+        counts = ranking.click_counts(self.resources)
+        self.assertEqual([0, 0, 3], counts)
+        # clicks break ties between equally relevant resources
+        self.assertEqual('Quux Stones',
+                         self.names(ranking.rank(self.p.id, u'quux'))[0])
+        # but don't outweigh relevance
+        self.assertEqual('Quux Poetry',
+                         self.names(ranking.rank(self.p.id, u'poetry'))[0])
+
+    def test_click_tallies_read_new_records_on_flush(self):
+        self.assertEqual([0, 0, 0], ranking.click_counts(self.resources))
+        LogRecord.objects.create(
+            user=self.u, message='Opened http://a.example.org/?q=y')
+        self.assertEqual([0, 0, 0], ranking.click_counts(self.resources))
+        scan = ranking.CLICK_SCAN
+        ranking.CLICK_SCAN = 1
+        try:
+            logbuffer.buffer.add(self.u, 'Opened http://a.example.org/?q=z')
+            logbuffer.buffer.flush()
+            self.assertEqual([1, 0, 0], ranking.click_counts(self.resources))
+            ranking.clicks.refresh()
+            self.assertEqual([2, 0, 0], ranking.click_counts(self.resources))
+        finally:
+            ranking.CLICK_SCAN = scan
+
+    def test_vectors_are_rebuilt_when_package_changes(self):
+        vectors = ranking.get_vectors(self.p.id)
+        self.assertTrue(vectors is ranking.get_vectors(self.p.id))
+        self.p.resources.remove(self.resources[2])
+        self.p.save()
+        self.assertEqual(2, len(ranking.rank(self.p.id, u'inscriptions')))
+
+    def test_sidebar_order(self):
+        response = self.c.get('/sidebar/', { 'p': self.p.uri, 'q': 'inscriptions' })
+        self.assertTrue(response.content.index('Quux Stones') <
+                        response.content.index('Quux Annals'))
+        response = self.c.get('/sidebar/', { 'p': self.p.uri, 'q': 'chronicles' })
+        self.assertTrue(response.content.index('Quux Annals') <
+                        response.content.index('Quux Stones'))
 
+    def test_package_api_order(self):
+        response = self.c.get('/api/package/%s' % self.p.id,
+                              { 'format': 'json', 'q': 'poems' })
+        self.assertEqual(200, response.status_code)
+        self.assertTrue(response.content.index('Quux Poetry') <
+                        response.content.index('Quux Annals'))
@@ -1,5 +1,7 @@
 import urllib
 import re
+from lru import LRUCache
+import rfc6570
 
 '''
 Regexp-based implementation of URI Templates v3.
@@ -8,6 +10,8 @@ Features:
 
 1) A partial expansion mode inspired by sporkonger/addressable (rubygem)
 2) Overridable quoting of special charactors
+3) Templates are parsed once and cached; compile(template).expand(params) reuses the parsed form
+4) expand_many() and expand_templates() also accept RFC 6570 templates, which are handed to the rfc6570 module
 
 Usage:
 
@@ -27,16 +31,120 @@ Mike Burrows (asplake), email mailto:mjb@asplake.co.uk, website http://positivei
 '''
 
 def sub(template, params, encoding=urllib.quote, partial=False):
-    return re.sub(r'{(-)?([^}]+)}', lambda match: matched(match, params, encoding, partial), template)
-
-def matched(match, params, encoding, partial):
-    is_operator, body = match.groups()
-    if is_operator: # leading '-'
-        operator, arg, operands = re.split(r'\|', body)
-        variables = re.split(',', operands)
-        return operators[operator](arg, variables, params, encoding, partial)
-    else:
-        return operators['variable'](body, params, encoding, partial)
+    return compile(template).expand(params, encoding, partial)
+
+expression = re.compile(r'{(-)?([^}]+)}')
+
+class Template(object):
+    """
+    A template parsed once into a list of nodes: literal strings, and
+    (operator function, arguments) tuples for the expressions between
+    them. Use compile() to get a cached instance.
+    """
+    def __init__(self, template):
+        self.template = template
+        self.nodes = []
+        position = 0
+        for match in expression.finditer(template):
+            if match.start() > position:
+                self.nodes.append(template[position:match.start()])
+            is_operator, body = match.groups()
+            if is_operator: # leading '-'
+                operator, arg, operands = body.split('|')
+                self.nodes.append(
+                    (operators[operator], (arg, operands.split(','))))
+            else:
+                self.nodes.append((operators['variable'], (body,)))
+            position = match.end()
+        if position < len(template):
+            self.nodes.append(template[position:])
+
+    def expand(self, params, encoding=urllib.quote, partial=False):
+        parts = []
+        for node in self.nodes:
+            if isinstance(node, tuple):
+                func, args = node
+                parts.append(func(*(args + (params, encoding, partial))) or '')
+            else:
+                parts.append(node)
+        return ''.join(parts)
+
+templates = LRUCache(1000)
+
+def compile(template):
+    """
+    Returns the Template for a template string, parsing it only the first
+    time it is seen.
+    """
+    compiled = templates.get(template)
+    if compiled is None:
+        compiled = Template(template)
+        templates.set(template, compiled)
+    return compiled
+
+# An expression using an RFC 6570 operator or modifier; drafts before
+# RFC 6570 used {-operator|...} instead.
+rfc6570_expression = re.compile(r'{[+#./;?&]|{[^}-][^}]*(?:\*|:[0-9]+)(?:,[^}]*)?}')
+
+def is_rfc6570(template):
+    return rfc6570_expression.search(template) is not None
+
+engines = LRUCache(1000)
+
+def compile_any(template):
+    """
+    Returns the compiled form of a template written in either syntax.
+    """
+    compiled = engines.get(template)
+    if compiled is None:
+        if is_rfc6570(template):
+            compiled = rfc6570.compile(template)
+        else:
+            compiled = compile(template)
+        engines.set(template, compiled)
+    return compiled
+
+checked = LRUCache(1000)
+
+def compiles(template):
+    """
+    Returns whether a template, in either syntax, can be expanded. Some
+    malformed expressions only fail when expanded, so it is expanded
+    once without parameters to find out.
+    """
+    ok = checked.get(template)
+    if ok is None:
+        try:
+            compile_any(template).expand({})
+            ok = True
+        except (TypeError, ValueError, KeyError):
+            ok = False
+        checked.set(template, ok)
+    return ok
+
+def expand_many(template, param_sets):
+    """
+    Expands a template against each of a sequence of parameter dicts.
+    """
+    compiled = compile_any(template)
+    if isinstance(compiled, rfc6570.Template):
+        return compiled.expand_many(param_sets)
+    return [ compiled.expand(params) for params in param_sets ]
+
+def expand_templates(template_list, params):
+    """
+    Expands each of a sequence of templates, in either syntax, against
+    one parameter dict.
+    """
+    memo = {}
+    uris = []
+    for template in template_list:
+        compiled = compile_any(template)
+        if isinstance(compiled, rfc6570.Template):
+            uris.append(compiled.expand(params, memo))
+        else:
+            uris.append(compiled.expand(params))
+    return uris
 
 def single_variable(variables):
     if len(variables) != 1:
@@ -0,0 +1,24 @@
+from django.contrib.sites.models import Site
+from django.db.models.signals import post_save, post_delete
+
+_base_uri = None
+
+def base_uri():
+    """
+    Returns 'http://<domain>' for the current Site, looking the Site up
+    only once per process (or after it changes).
+    """
+    global _base_uri
+    if _base_uri is None:
+        _base_uri = 'http://%s' % Site.objects.get_current().domain
+    return _base_uri
+
+def absolute_uri(path):
+    return base_uri() + path
+
+def clear_base_uri(sender=None, **kwargs):
+    global _base_uri
+    _base_uri = None
+
+post_save.connect(clear_base_uri, sender=Site)
+post_delete.connect(clear_base_uri, sender=Site)
@@ -1,21 +1,12 @@
-import json
-import copy
-import textwrap
-import uri_template
-from urlparse import urlparse
-from django.http import HttpRequest, Http404
+from django.http import HttpResponse, Http404
 from django.template import RequestContext
 from django.shortcuts import render_to_response
-from django.core.urlresolvers import resolve
 from django.contrib.auth.decorators import login_required
-
-def _load_json(request, uri):
-    view, args, kwargs = resolve(urlparse(uri)[2])
-    GET = copy.copy(request.GET)
-    GET['format'] = 'json'
-    request.GET = GET
-    kwargs['request'] = request
-    return json.loads(view(*args, **kwargs).content)    
+from compression import compressed
+from models import Package
+import ranking
+import services
+import sidebars
 
 def index(request):
     return render_to_response('index.html')
@@ -33,25 +24,14 @@ def jetpack(request):
                               context_instance=RequestContext(request),
                               mimetype='text/javascript')
 
+@compressed
 def sidebar(request):
-    package_uri = request.GET.get('p')
     query = request.GET.get('q', '')
-    o = _load_json(request, package_uri)
-    entries = o['feed']['entry']
-    resources = []
-    for e in entries:
-        r = {}
-        osd = e['content']['OpenSearchDescription']
-        template = osd['Url']['template']
-        r['query_uri'] = uri_template.sub(
-            template, { 'searchTerms': query.encode('utf-8') });
-        r['name'] = osd['ShortName']['$t']
-        r['description'] = textwrap.wrap(osd['Description']['$t'], 43)
-        resources.append(r)
-    info = { 'height': 60 }
-    button = { 'width': 240, 'height': 25, 'spacing': 31 }
-    height = button['spacing'] * len(resources) + info['height'] + 5
-    return render_to_response('sidebar.svg', { 
-            'query': query, 'resources': resources,
-            'height': height, 'button': button, 'info': info },
-                              mimetype='image/svg+xml')
+    try:
+        id = services.package_id(request.GET.get('p'))
+        skeleton = sidebars.get_skeleton(id)
+    except (ValueError, Package.DoesNotExist):
+        raise Http404
+    order = skeleton.order(ranking.rank(id, query, skeleton.version))
+    return HttpResponse(skeleton.render(query, order),
+                        mimetype='image/svg+xml')
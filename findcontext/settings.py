@@ -19,6 +19,85 @@ USE_I18N = True
 # Number of days users have to activate their accounts after registering.
 ACCOUNT_ACTIVATION_DAYS = 7
 
+# Maximum number of parsed OpenSearch description trees kept in memory.
+OSD_CACHE_SIZE = 1000
+
+# Rendered fragments of each resource are cached in up to six variants
+# (OSD, Atom and JSON, pretty and compact), alongside whole responses, so
+# the cache needs room for several entries per resource. The locmem
+# default of 300 entries is too small for that; use memcached in
+# production, e.g. 'memcached://127.0.0.1:11211/'.
+CACHE_BACKEND = 'locmem://?max_entries=10000'
+
+# Seconds to keep rendered API responses in the cache. Entries are keyed by
+# the rows' timestamps, so saving a resource or package invalidates them.
+API_CACHE_SECONDS = 60 * 60
+
+# Seconds to keep each package's prerendered sidebar. Entries are keyed by
+# the package's and its resources' timestamps.
+SIDEBAR_CACHE_SECONDS = 60 * 60
+
+# Default and maximum page sizes for paged resource and package listings.
+API_PAGE_SIZE = 20
+API_MAX_PAGE_SIZE = 500
+
+# zlib compression level (1-9) for gzip and deflate encoded responses.
+COMPRESSION_LEVEL = 6
+
+# Federated search: worker threads, seconds allowed per resource and for
+# the whole search, and seconds to cache each resource's results.
+FEDERATED_SEARCH_THREADS = 10
+FEDERATED_SEARCH_TIMEOUT = 3
+FEDERATED_SEARCH_DEADLINE = 5
+FEDERATED_SEARCH_CACHE_SECONDS = 10 * 60
+# Federated searches and suggestions only fetch http and https URIs, up to
+# this many bytes, from public addresses unless private hosts are allowed.
+FEDERATED_SEARCH_MAX_BYTES = 1024 * 1024
+FEDERATED_SEARCH_ALLOW_PRIVATE_HOSTS = False
+
+# Seconds allowed for collecting search suggestions, seconds a slow source
+# is given to answer for the cache, and seconds to cache each resource's
+# suggestions.
+SUGGEST_BUDGET = 0.3
+SUGGEST_TIMEOUT = 2
+SUGGEST_CACHE_SECONDS = 60 * 60
+
+# Seconds between checks that the in-memory resource search index has
+# seen changes made by other processes.
+SEARCH_INDEX_CHECK_SECONDS = 10
+
+# Ranking of a package's resources for a query: the weight of past clicks
+# against text relevance, how many days of clicks count, seconds to keep
+# each package's term vectors before rebuilding them, and the most log
+# records read each time the click tallies are brought up to date.
+RANKING_CLICK_WEIGHT = 0.2
+RANKING_CLICK_DAYS = 90
+RANKING_VECTOR_SECONDS = 60 * 60
+RANKING_CLICK_SCAN = 10000
+
+# Number of packages whose gazetteer automata are kept in memory
+GAZETTEER_CACHE_SIZE = 100
+
+# Bulk resource imports: worker processes that validate documents (None
+# for one per CPU; they are started by django.wsgi), the fewest documents
+# worth sending to the workers, the most documents accepted in one
+# payload, and the most bytes accepted in the payload and, in total, in
+# the documents unpacked from it.
+BULK_IMPORT_PROCESSES = None
+BULK_IMPORT_PARALLEL_MINIMUM = 8
+BULK_IMPORT_MAX_DOCUMENTS = 1000
+BULK_IMPORT_MAX_BYTES = 10 * 1024 * 1024
+
+# Number of resources the syncosd command saves per transaction
+SYNC_BATCH_SIZE = 500
+
+# Log records are buffered in memory and written in bulk once this many
+# have been collected or the oldest is this many seconds old.
+LOG_BUFFER_SIZE = 100
+LOG_BUFFER_SECONDS = 5
+# Records kept in memory while the database can't be written to
+LOG_BUFFER_MAX_PENDING = 10000
+
 # Absolute path to the directory that holds media.
 # Example: "/home/media/media.lawrence.com/"
 MEDIA_ROOT = ''